@@ -1,47 +1,79 @@
 """
 Docstring
 """
+import json
+import time
 import logging
 
-from opsdroid.matchers import match_regex
+from opsdroid.matchers import match_always
 
+from .locks import room_locks
+from .metrics import metrics
+from .rng import rngs
+from .dispatch import dispatcher, route
 from .matchers import match_gm
 
 # from .constants.regex_constants import *
 from .combat import attack
 from .characters import whoami, howami, Character #get_character, put_character
 from .initiative import create_initiative
-from .picard import intent_self_in_room, get_matrix_connector, load_from_memory, update_memory
-from .scenes import load_scene, get_info
+from .party import update_party, restore_hp
+from .picard import (intent_self_in_room, get_matrix_connector, get_skill_config, roster_cache,
+                     flush_rosters_periodically, http_client)
+from .scenes import load_scene, get_info, build_scene_graphs
+from .templates import templates, prepare_templates
+from .responses import configure_responses
 
 
 def setup(opsdroid):
+    config = get_skill_config(opsdroid)
+    roster_cache.configure(max_rooms=config.get('roster_cache_rooms'),
+                           flush_interval=config.get('roster_flush_interval'))
+    opsdroid.eventloop.create_task(flush_rosters_periodically(opsdroid))
+    http_client.configure(pool_size=config.get('http_pool_size'))
+    opsdroid.eventloop.create_task(http_client.run())
+    templates.configure(workers=config.get('template_workers'))
+    prepare_templates(opsdroid, config)
+    opsdroid.eventloop.create_task(build_scene_graphs(opsdroid, config))
+    configure_responses(max_size=config.get('response_max_size'),
+                        deadline=config.get('response_flush_deadline'))
+    rngs.configure(seed=config.get('rng_seed'), block_size=config.get('rng_block_size'))
+
     logging.info("Loaded rpgchar module - ready to play Role-Playing Games!")
 
 
-@match_regex(f'(you|we) (take|have) a long rest', case_sensitive=False)
+async def teardown(opsdroid):
+    """
+    Write back the cached rosters and close the shared HTTP session.
+
+    opsdroid has no hook for unloading a skill, so whatever runs the skill should await this
+    before stopping its event loop.
+    """
+    await roster_cache.flush_all(opsdroid)
+    await http_client.close()
+
+
+@match_always
+async def dispatch(opsdroid, config, message):
+    """Hand the message to whichever of the skill's handlers it matches."""
+    await dispatcher.dispatch(opsdroid, config, message)
+
+
+@route(f'(you|we) (take|have) a long rest', case_sensitive=False, keywords=['rest'])
 @match_gm
 async def long_rest(opsdroid, config, message):
     """
     Do all the long rest things.
     At the moment this consists solely of giving everyone their hit points back.
     """
+    # Everyone in the room is healed with one read and one write, however many there are
+    rested = await update_party(opsdroid, message.room, restore_hp, reason='heal')
+    if not rested:
+        return await message.respond("There's no one here to rest.")
+    await message.respond("Everyone is restored to full health.")
 
-    # with memory_in_room(message.room, opsdroid):
-    #     chars = await opsdroid.memory.get('chars', {})
-    chars = await load_from_memory(opsdroid, message.room, 'chars')
-    for charname in chars.keys():
-        # if charname.lower() == '_id':
-        #     continue
-        # char = await get_character(charname, opsdroid, config, message)
-        # char = Character(**chars[charname])
-        chars[charname]['current_hp'] = chars[charname]['max_hp']
-        # await put_character(char, opsdroid, message.room)
-    await update_memory(opsdroid, message.room, 'chars', chars)
-    await messge.respond("Everyone is restored to full health.")
-
-
-@match_regex('!toroom (?P<roomname>\w+) (?P<msg>.*)', case_sensitive=False)
+
+@route(r'!toroom (?P<roomname>\w+) (?P<msg>.*)', case_sensitive=False)
 async def to_room(opsdroid, config, message):
     """
     Relay a message to a specified room, as named in the config.
@@ -51,7 +83,83 @@ async def to_room(opsdroid, config, message):
     await message.respond(match('msg'), room=match('roomname'))
 
 
-@match_regex("!help", case_sensitive=False)
+def stats_summary(top=5):
+    """Summarise the slowest commands and rooms, memory traffic and lock contention."""
+    handlers = sorted(metrics.histograms.get('rpgchar_handler_seconds', {}).items(),
+                      key=lambda item: item[1].sum, reverse=True)
+    lines = ['Commands (by total time):']
+    for labels, hist in handlers[:top]:
+        lines.append(f"  {dict(labels)['handler']}: {hist.count} calls, {hist.sum:.3f}s total, "
+                     f"p50 <{hist.quantile(0.5) * 1000:g}ms, p99 <{hist.quantile(0.99) * 1000:g}ms")
+
+    rooms = sorted(metrics.counters.get('rpgchar_room_handler_seconds_total', {}).items(),
+                   key=lambda item: item[1], reverse=True)
+    lines.append('Rooms (by total time):')
+    lines += [f"  {dict(labels)['room']}: {seconds:.3f}s" for labels, seconds in rooms[:top]]
+
+    def total(name, **match):
+        return sum(value for labels, value in metrics.counters.get(name, {}).items()
+                   if all(dict(labels).get(k) == v for k, v in match.items()))
+
+    lines.append(f"Memory: {total('rpgchar_memory_calls_total', op='get')} reads "
+                 f"({total('rpgchar_memory_bytes_total', op='get')} bytes), "
+                 f"{total('rpgchar_memory_calls_total', op='put')} writes "
+                 f"({total('rpgchar_memory_bytes_total', op='put')} bytes)")
+    lines.append(f"YAML files parsed: {total('rpgchar_yaml_parses_total')}")
+    lines.append(f"Responses sent: {total('rpgchar_responses_total')} "
+                 f"({total('rpgchar_response_bytes_total')} bytes)")
+    lines.append(f"Messages seen: {dispatcher.messages}, "
+                 f"matching no command: {dispatcher.unmatched}")
+
+    contended = [(key, s) for key, s in room_locks.contention() if s['contended']]
+    if contended:
+        lines.append('Most contended locks:')
+        lines += [f"  {key} in {room}: {s['contended']}/{s['acquired']} waited, "
+                  f"longest {s['wait_max'] * 1000:.1f}ms" for (room, key), s in contended[:top]]
+    return '\n'.join(lines)
+
+
+@route('!stats( (?P<format>json|prometheus))?', case_sensitive=False)
+@match_gm
+async def report_stats(opsdroid, config, message):
+    """
+    Report where time is going, or dump every metric as JSON or in the Prometheus text format.
+    """
+    fmt = (message.regex.group('format') or '').lower()
+    if fmt == 'prometheus':
+        await message.respond(metrics.to_prometheus())
+    elif fmt == 'json':
+        dump = metrics.to_json()
+        dump['dispatch'] = dispatcher.stats()
+        dump['locks'] = [dict(stats, room=room, key=key)
+                         for (room, key), stats in room_locks.contention()]
+        await message.respond(json.dumps(dump, indent=1))
+    else:
+        await message.respond(stats_summary())
+
+
+@route(r'!seed( (?P<seed>\d+))?( !usemem (?P<memroom>\w+))?', case_sensitive=False)
+@match_gm
+async def seed_dice(opsdroid, config, message):
+    """
+    Report the seed behind the dice in a room, or reseed them so a sequence of rolls can be
+    replayed.
+    """
+    match = message.regex.group
+    room = match('memroom') or message.room
+    if match('seed'):
+        seed = rngs.seed(room, int(match('seed')), reason=f'set by {message.user}')
+        await message.respond(f"Dice in {room} reseeded with {seed}")
+        return
+    rng = rngs[room]
+    draws = ', '.join(f'{n}d{sides}' for sides, n in sorted(rng.draws.items())) or 'nothing'
+    history = '\n'.join(f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(entry['time']))}: "
+                         f"{entry['seed']} ({entry['reason']})" for entry in rngs.history(room))
+    await message.respond(f"Dice in {room} are seeded with {rng.current_seed}, and have rolled "
+                          f"{draws} since.\nSeeds used:\n{history}")
+
+
+@route("!help", case_sensitive=False)
 async def user_help(opsdroid, config, message):
     await message.respond(f"""<p>Greetings, adventurers!</p>
 
@@ -0,0 +1,3 @@
+"""
+Benchmarks for the rpgchar skill, run with ``python -m benchmarks`` from the skill's directory.
+"""
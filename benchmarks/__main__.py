@@ -0,0 +1,78 @@
+"""
+Run the benchmarks and report throughput, latency and database traffic for each workload.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from .harness import Harness
+from .workloads import WORKLOADS
+
+
+def percentile(values, q):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarise(name, harness, elapsed):
+    latencies = harness.latencies
+    calls = harness.opsdroid.database.calls
+    return {
+        'workload': name,
+        'messages': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'memory_gets': calls['get'],
+        'memory_puts': calls['put'],
+        'memory_calls_per_message': (calls['get'] + calls['put']) / max(len(latencies), 1),
+        'responses': len(harness.sent),
+    }
+
+
+async def run(names, latency, seed):
+    results = []
+    # The skill keeps its caches in module globals, so every workload shares one instance and
+    # gets a room of its own
+    async with Harness(nrooms=len(names), latency=latency, seed=seed) as harness:
+        for i, name in enumerate(names):
+            room = harness.room(i)
+            start = time.perf_counter()
+            await WORKLOADS[name](harness, room)
+            results.append(summarise(name, harness, time.perf_counter() - start))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('workloads', nargs='*',
+                        help=f"workloads to run, from {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument('--latency', type=float, default=1.,
+                        help="milliseconds each database call takes (default: 1)")
+    parser.add_argument('--seed', type=int, default=1, help="dice seed (default: 1)")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args.workloads or list(WORKLOADS), args.latency / 1000, args.seed))
+    if args.json:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+        return
+    print(f"{'workload':<20}{'msgs':>7}{'msg/s':>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'gets':>8}{'puts':>8}{'calls/msg':>11}")
+    for r in results:
+        print(f"{r['workload']:<20}{r['messages']:>7}{r['throughput']:>10.1f}{r['p50_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['memory_gets']:>8}{r['memory_puts']:>8}"
+              f"{r['memory_calls_per_message']:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+An in-process stand-in for opsdroid and the Matrix connector, for driving the skill directly.
+
+The skill is imported as the ``rpgchar`` package from this checkout and messages are passed
+straight to its dispatcher, so a benchmark exercises the same code as a live bot apart from
+the network. opsdroid and the skill's other requirements must be installed.
+"""
+import sys
+import time
+import asyncio
+import tempfile
+import importlib.util
+from copy import deepcopy
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+GM = 'gm'
+
+
+def load_skill(name='rpgchar'):
+    """Import this checkout as the package `name`, as opsdroid would."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, ROOT / '__init__.py',
+                                                  submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeDatabase:
+    """
+    A per-room opsdroid database held in a dict, which waits `latency` seconds on every call.
+
+    Like the Matrix database it has a ``room`` attribute, so the skill gives each room its own
+    copy; the copies share the stored data and the call counts.
+    """
+    def __init__(self, latency=0.):
+        self.latency = latency
+        self.room = None
+        self.data = {}
+        self.calls = {'get': 0, 'put': 0}
+
+    async def get(self, key):
+        self.calls['get'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return deepcopy(self.data.get((self.room, key)))
+
+    async def put(self, key, value):
+        self.calls['put'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.data[(self.room, key)] = deepcopy(value)
+
+    def reset_counts(self):
+        self.calls['get'] = self.calls['put'] = 0
+
+
+class FakeMemory:
+    def __init__(self, database):
+        self.databases = [database]
+
+
+class FakeConnector:
+    """A Matrix connector which knows about its rooms but never talks to a server."""
+    name = 'ConnectorMatrix'
+
+    def __init__(self, rooms):
+        self.rooms = dict(rooms)
+        self.room_ids = {}
+
+
+class FakeOpsdroid:
+    def __init__(self, config, rooms, latency=0.):
+        self.config = config
+        self.database = FakeDatabase(latency)
+        self.memory = FakeMemory(self.database)
+        self.default_connector = FakeConnector(rooms)
+        self.connectors = [self.default_connector]
+        self.eventloop = asyncio.get_event_loop()
+
+
+class FakeMessage:
+    """A message from `user` in `room`, recording everything sent in response."""
+    def __init__(self, text, user, room, sent):
+        self.text = text
+        self.user = user
+        self.room = room
+        self.regex = None
+        self.connector = None
+        self._sent = sent
+
+    async def respond(self, text, room=None):
+        self._sent.append((room or self.room, text))
+
+
+CHARACTER = {
+    'level': 3, 'max_hp': 1000000, 'race': 'Human', 'class_': 'Fighter', 'AC': 12,
+    'abilities': {'Str': 14, 'Dex': 12, 'Con': 12, 'Int': 10, 'Wis': 10, 'Cha': 10},
+    'weapons': {'sword': {'modifier': 'Str', 'damage': '1d8'}},
+}
+
+
+def character(name, **changes):
+    return dict(deepcopy(CHARACTER), name=name, **changes)
+
+
+def write_campaign(path, name='bench', nscenes=50, monsters=4):
+    """
+    Write a campaign of `nscenes` scenes in a ring (each with a 'next' exit and `monsters`
+    goblins) under `path`.
+    """
+    characters = Path(path, 'characters')
+    scenes = Path(path, 'scenes', name)
+    characters.mkdir(parents=True, exist_ok=True)
+    scenes.mkdir(parents=True, exist_ok=True)
+    (characters / 'goblin.yaml').write_text(yaml.safe_dump(character('goblin')))
+
+    files = ['00-start.yaml'] + [f'scene-{i}.yaml' for i in range(1, nscenes)]
+    for i, fname in enumerate(files):
+        scene = {'name': f'Scene {i}', 'intro_text': f'You arrive at scene {i}.',
+                 'characters': {'goblin': {'loadfile': 'goblin.yaml', 'number': monsters}},
+                 'dm_info': {'exits': {'next': files[(i + 1) % len(files)]},
+                             'notes': {'lighting': 'dim', 'smell': 'damp'}}}
+        (scenes / fname).write_text(yaml.safe_dump(scene))
+
+
+class Harness:
+    """
+    A skill instance with `nrooms` campaign rooms, ready to receive messages.
+
+    Use as ``async with Harness(...) as harness:``, then `send` messages and read the counters.
+    """
+    def __init__(self, nrooms=1, latency=0., nscenes=50, monsters=4, seed=1, skill='rpgchar'):
+        self.nrooms = nrooms
+        self.latency = latency
+        self.nscenes = nscenes
+        self.monsters = monsters
+        self.seed = seed
+        self.skill_name = skill
+        self.sent = []
+        self.latencies = []
+
+    def room(self, i):
+        """Return the id of the i'th campaign room."""
+        return f'#campaign{i}:bench'
+
+    async def __aenter__(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix='rpgchar-bench-')
+        write_campaign(self._tmp.name, nscenes=self.nscenes, monsters=self.monsters)
+        rooms = {'main': '#main:bench'}
+        rooms.update({f'campaign{i}': self.room(i) for i in range(self.nrooms)})
+        self.config = {
+            'name': 'rpgchar', 'game_master': GM, 'rng_seed': self.seed,
+            'campaigns': {f'campaign{i}': {'name': 'bench', 'characters': {}}
+                          for i in range(self.nrooms)},
+        }
+        self.opsdroid = FakeOpsdroid({'module-path': self._tmp.name, 'skills': [self.config]},
+                                     rooms, self.latency)
+        self.skill = load_skill(self.skill_name)
+        self._tasks = set(asyncio.all_tasks())
+        self.skill.setup(self.opsdroid)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.skill.teardown(self.opsdroid)
+        tasks = asyncio.all_tasks() - self._tasks - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tmp.cleanup()
+        # The skill's caches are module level, so drop them for the next harness
+        self.skill.picard.roster_cache.clear()
+        self.skill.scenes._scene_info.clear()
+
+    def reset(self):
+        """Forget the responses, latencies and database calls recorded so far."""
+        self.sent.clear()
+        self.latencies.clear()
+        self.opsdroid.database.reset_counts()
+
+    async def send(self, text, user=GM, room=None):
+        """Deliver a message to the skill and wait for it to be handled."""
+        room = room or self.room(0)
+        message = FakeMessage(text, user, room, self.sent)
+        start = time.perf_counter()
+        await self.skill.dispatcher.dispatch(self.opsdroid, self.config, message)
+        self.latencies.append(time.perf_counter() - start)
+        return message
+
+    async def add_characters(self, room, chars):
+        """Put characters straight into a room's roster, without going through a command."""
+        await self.skill.picard.put_many(self.opsdroid, room,
+                                         {stats['name']: stats for stats in chars})
+
+    async def active_player(self, room):
+        return await self.skill.picard.load_active_player(self.opsdroid, room)
@@ -0,0 +1,256 @@
+"""
+Replay game sessions in many rooms at once and report how fairly the rooms are served.
+
+Every room plays its own session concurrently on one event loop against the fake opsdroid
+harness. Each message is handled in a task of its own, as opsdroid does, and the player waits
+for the reply and a think time before sending the next. Run with
+``python -m benchmarks.loadgen --rooms 200``.
+
+Sessions are either generated (a scene change, initiative and a few rounds of combat) or read
+from a JSON lines file of ``{"room": 0, "user": "gm", "text": "roll initiative"}`` records, in
+which ``{room}`` is replaced by the room's number, ``{active}`` by whoever's turn it is and
+``{attack}`` by an attack from them. A user of ``{active}`` sends as the active player, or as
+the GM if that's a monster.
+
+Character names include their room's number, so any reply or stored record mentioning another
+room's characters is reported as a leak between rooms.
+"""
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+from .harness import GM, Harness, FakeMessage, character
+from .__main__ import percentile
+
+ACTIVE = '{active}'
+ATTACK = '{attack}'
+_TAGGED = re.compile(r'\bR(\d+)Hero\d+\b')
+
+
+def hero(room, i):
+    return f'R{room}Hero{i}'
+
+
+def generated_session(room, heroes=3, rounds=3, goblins=4):
+    """Return the steps of a typical session in room number `room`."""
+    steps = [(GM, '!goto 00-start.yaml'), (GM, 'roll initiative')]
+    for turn in range(rounds * (heroes + goblins)):
+        steps.append((ACTIVE, ATTACK))
+        if turn % 5 == 0:
+            steps.append((hero(room, turn % heroes), 'how am I'))
+        steps.append((ACTIVE, 'next player'))
+    steps += [(GM, f'!info campaign{room} notes'), (GM, '!goto next')]
+    return steps
+
+
+def recorded_sessions(path):
+    """Read sessions from a JSON lines file, returning {room number: [(user, text)]}."""
+    sessions = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                sessions[int(record['room'])].append((record['user'], record['text']))
+    return sessions
+
+
+class RoomStats:
+    __slots__ = ('messages', 'latencies', 'queue_delays', 'started', 'finished')
+
+    def __init__(self):
+        self.messages = 0
+        self.latencies = []
+        self.queue_delays = []
+        self.started = self.finished = None
+
+    @property
+    def throughput(self):
+        elapsed = (self.finished or 0) - (self.started or 0)
+        return self.messages / elapsed if elapsed > 0 else 0.
+
+
+def jain_index(values):
+    """Jain's fairness index: 1 if every value is equal, down to 1/n if one gets everything."""
+    values = list(values)
+    if not values or not any(values):
+        return 1.
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+class LoadGenerator:
+    def __init__(self, harness, sessions, think=0.5, ramp=1., heroes=3, seed=1):
+        self.harness = harness
+        self.sessions = sessions
+        self.think = think
+        self.ramp = ramp
+        self.heroes = heroes
+        self.random = random.Random(seed)
+        self.stats = defaultdict(RoomStats)
+        self.leaks = []
+
+    async def setup(self):
+        for i in self.sessions:
+            await self.harness.add_characters(
+                self.harness.room(i), [character(hero(i, n)) for n in range(self.heroes)])
+        self.harness.reset()
+
+    async def _resolve(self, i, user, text, turn):
+        """Fill in the placeholders in a step, as it's about to be sent."""
+        if ACTIVE in (user, text) or ATTACK in text:
+            active = await self.harness.active_player(self.harness.room(i)) or GM
+            mine = active.startswith(f'R{i}Hero')
+            if user == ACTIVE:
+                user = active if mine else GM
+            if mine:
+                attack = f'I attack goblin{turn % 4 + 1} with my sword'
+            else:
+                attack = f'{active} attacks {hero(i, turn % self.heroes)} with their sword'
+            text = text.replace(ATTACK, attack).replace(ACTIVE, active)
+        return user, text.replace('{room}', str(i))
+
+    async def _send(self, i, user, text):
+        """Deliver a message in its own task, timing how long it waited to start."""
+        room = self.harness.room(i)
+        stats = self.stats[i]
+        replies = []
+        message = FakeMessage(text, user, room, replies)
+        started = []
+
+        async def handle():
+            started.append(time.perf_counter())
+            await self.harness.skill.dispatcher.dispatch(self.harness.opsdroid,
+                                                         self.harness.config, message)
+
+        sent = time.perf_counter()
+        await asyncio.ensure_future(handle())
+        done = time.perf_counter()
+        stats.messages += 1
+        stats.latencies.append(done - sent)
+        stats.queue_delays.append(started[0] - sent)
+        self.harness.sent.extend(replies)
+        self._check_replies(i, replies)
+
+    def _check_replies(self, i, replies):
+        allowed = {self.harness.room(i), f'campaign{i}', 'main'}
+        for room, text in replies:
+            if room not in allowed:
+                self.leaks.append(f"Reply to a message in room {i} sent to {room}: {text!r:.80}")
+            for other in _TAGGED.findall(str(text)):
+                if int(other) != i:
+                    self.leaks.append(f"Reply in room {i} mentions room {other}: {text!r:.80}")
+
+    async def _play(self, i, steps):
+        stats = self.stats[i]
+        await asyncio.sleep(self.random.uniform(0, self.ramp))
+        stats.started = time.perf_counter()
+        for turn, (user, text) in enumerate(steps):
+            user, text = await self._resolve(i, user, text, turn)
+            await self._send(i, user, text)
+            if self.think:
+                await asyncio.sleep(self.random.expovariate(1 / self.think))
+        stats.finished = time.perf_counter()
+
+    def check_storage(self):
+        """Look for characters stored under a room they don't belong to."""
+        rooms = {self.harness.room(i): i for i in self.sessions}
+        for (room, key), value in self.harness.opsdroid.database.data.items():
+            if room not in rooms:
+                continue
+            for other in _TAGGED.findall(json.dumps(value, default=str) + key):
+                if int(other) != rooms[room]:
+                    self.leaks.append(f"{key} in room {rooms[room]} mentions room {other}")
+
+    async def run(self):
+        await self.setup()
+        start = time.perf_counter()
+        await asyncio.gather(*[self._play(i, steps) for i, steps in self.sessions.items()])
+        elapsed = time.perf_counter() - start
+        await self.harness.skill.picard.roster_cache.flush_all(self.harness.opsdroid)
+        self.check_storage()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        rooms = self.stats.values()
+        latencies = [l for s in rooms for l in s.latencies]
+        delays = [d for s in rooms for d in s.queue_delays]
+        calls = self.harness.opsdroid.database.calls
+        mean_latency = {i: sum(s.latencies) / len(s.latencies)
+                        for i, s in self.stats.items() if s.latencies}
+        slowest = sorted(mean_latency.items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            'rooms': len(self.stats),
+            'messages': len(latencies),
+            'seconds': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed else 0.,
+            'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+            'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+            'queue_delay_p50_ms': percentile(delays, 0.5) * 1000,
+            'queue_delay_p99_ms': percentile(delays, 0.99) * 1000,
+            'queue_delay_max_ms': max(delays, default=0.) * 1000,
+            'fairness_throughput': jain_index(s.throughput for s in rooms),
+            'fairness_latency': jain_index(1 / l for l in mean_latency.values() if l),
+            'slowest_rooms_ms': {i: l * 1000 for i, l in slowest},
+            'memory_gets': calls['get'],
+            'memory_puts': calls['put'],
+            'leaks': self.leaks,
+        }
+
+
+async def run(args):
+    if args.sessions:
+        sessions = recorded_sessions(args.sessions)
+        nrooms = max(sessions) + 1
+    else:
+        nrooms = args.rooms
+        sessions = {i: generated_session(i, heroes=args.heroes, rounds=args.rounds)
+                    for i in range(nrooms)}
+    async with Harness(nrooms=nrooms, latency=args.latency / 1000, seed=args.seed) as harness:
+        generator = LoadGenerator(harness, sessions, think=args.think, ramp=args.ramp,
+                                  heroes=args.heroes, seed=args.seed)
+        return await generator.run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadgen',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rooms', type=int, default=100, help="rooms to simulate (default: 100)")
+    parser.add_argument('--sessions', help="JSON lines file of sessions to replay")
+    parser.add_argument('--rounds', type=int, default=3, help="combat rounds per session")
+    parser.add_argument('--heroes', type=int, default=3, help="player characters per room")
+    parser.add_argument('--think', type=float, default=0.05,
+                        help="mean seconds between a reply and the next message (default: 0.05)")
+    parser.add_argument('--ramp', type=float, default=1.,
+                        help="seconds over which the rooms start (default: 1)")
+    parser.add_argument('--latency', type=float, default=1.,
+                        help="milliseconds each database call takes (default: 1)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    if args.json:
+        json.dump(result, sys.stdout, indent=1)
+        print()
+        return
+    print(f"{result['rooms']} rooms, {result['messages']} messages in {result['seconds']:.1f}s "
+          f"({result['throughput']:.1f} msg/s)")
+    print(f"latency p50 {result['latency_p50_ms']:.1f}ms, p99 {result['latency_p99_ms']:.1f}ms")
+    print(f"queueing delay p50 {result['queue_delay_p50_ms']:.2f}ms, "
+          f"p99 {result['queue_delay_p99_ms']:.2f}ms, max {result['queue_delay_max_ms']:.2f}ms")
+    print(f"fairness (Jain's index) by throughput {result['fairness_throughput']:.3f}, "
+          f"by latency {result['fairness_latency']:.3f}")
+    print("slowest rooms: " + ', '.join(f"{i} ({ms:.1f}ms)"
+                                        for i, ms in result['slowest_rooms_ms'].items()))
+    print(f"database: {result['memory_gets']} gets, {result['memory_puts']} puts")
+    print(f"cross-room leaks: {len(result['leaks'])}")
+    for leak in result['leaks'][:10]:
+        print(f"  {leak}")
+
+
+if __name__ == '__main__':
+    main()
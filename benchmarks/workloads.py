@@ -0,0 +1,60 @@
+"""
+Realistic sequences of commands for the benchmarks, each run in a room of its own.
+
+Each workload sets up the state it needs, calls `harness.reset()` and then sends the messages
+being measured.
+"""
+from .harness import GM, character
+
+__all__ = ['roll_initiative', 'combat', 'scene_transitions', 'list_characters', 'WORKLOADS']
+
+
+async def roll_initiative(harness, room, characters=20, repeat=50):
+    """Roll initiative for a party of `characters`, `repeat` times."""
+    await harness.add_characters(room, [character(f'Hero{i}') for i in range(characters)])
+    harness.reset()
+    for _ in range(repeat):
+        await harness.send('roll initiative', room=room)
+
+
+async def combat(harness, room, heroes=4, goblins=8, rounds=20):
+    """
+    Fight `rounds` rounds of combat: on each turn the active combatant attacks and then
+    passes to the next player.
+    """
+    await harness.add_characters(room, [character(f'Hero{i}') for i in range(heroes)] +
+                                       [character(f'Goblin{i}') for i in range(goblins)])
+    await harness.send('roll initiative', room=room)
+    harness.reset()
+    for turn in range(rounds * (heroes + goblins)):
+        active = await harness.active_player(room)
+        if active.startswith('Hero'):
+            user, text = active, f"I attack Goblin{turn % goblins} with my sword"
+        else:
+            user, text = GM, f"{active} attacks Hero{turn % heroes} with their sword"
+        await harness.send(text, user=user, room=room)
+        await harness.send('next player', user=user, room=room)
+
+
+async def scene_transitions(harness, room, moves=40):
+    """Move through `moves` scenes, each of which spawns a pack of monsters."""
+    await harness.send('!goto 00-start.yaml', room=room)
+    harness.reset()
+    for _ in range(moves):
+        await harness.send('!goto next', room=room)
+
+
+async def list_characters(harness, room, characters=500, repeat=50):
+    """List a roster of `characters` characters `repeat` times."""
+    await harness.add_characters(room, [character(f'Npc{i}') for i in range(characters)])
+    harness.reset()
+    for _ in range(repeat):
+        await harness.send('!list characters', room=room)
+
+
+WORKLOADS = {
+    'roll_initiative': roll_initiative,
+    'combat': combat,
+    'scene_transitions': scene_transitions,
+    'list_characters': list_characters,
+}
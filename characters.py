@@ -2,19 +2,22 @@
 Docstring
 """
 
-import re
-import yaml
 import logging
-from os.path import join
-from random import randint
-from functools import partial
+import random
+from bisect import bisect_right
+from types import MappingProxyType
 from collections import OrderedDict as od
 
-from opsdroid.matchers import match_regex
 
+from .dice import compile_dice
+from .rng import room_rng
+from .locks import room_lock
+from .dispatch import route
+from .responses import buffer_responses
+from .templates import templates, load_template_async, copy_template, campaign_path
 from .matchers import match_gm
 from .constants.regex_constants import *
-from .picard import load_from_memory, save_new_to_memory, update_memory, get_roomname
+from .picard import get_roomname, get_char, put_char, get_many, put_many, delete_chars
 
 
 level_XPs = [0, 300, 900, 2700, 6500,
@@ -22,11 +25,32 @@ level_XPs = [0, 300, 900, 2700, 6500,
              85000, 100000, 120000, 140000, 165000,
              195000, 225000, 265000, 305000, 355000]
 
+
+def level_for_xp(XP):
+    """Return the level reached with `XP` experience points."""
+    return bisect_right(level_XPs, XP)
+
+
 # TODO come up with a subclass system for different character classes.
 class Character:
+    """
+    A character and their current state.
+
+    Ability modifiers, proficiency bonus and short name are worked out when the abilities,
+    level or name change rather than on every use. Characters are stored using `to_dict`,
+    which is versioned by `SCHEMA_VERSION`.
+    """
+    SCHEMA_VERSION = 2
+    fields = ('name', 'level', 'max_hp', 'race', 'class_', 'AC', 'abilities', 'XP',
+              'current_hp', 'weapons', 'unconscious', 'death_saves', 'conditions')
+
+    __slots__ = ('_name', '_level', 'race', 'class_', 'max_hp', 'AC', '_abilities', 'XP',
+                 'current_hp', 'weapons', 'unconscious', 'death_saves', 'conditions',
+                 '_shortname', '_proficiency', '_modifiers')
+
     def __init__(self, name, level, max_hp, race, class_, AC, abilities,
                  XP=0, current_hp=None, weapons=None, unconscious=False,
-                 death_saves={'success': 0, 'fail': 0}):
+                 death_saves=None, conditions=None):
         self.name = name
         self.level = level # Change this to XP and calculate level
         self.race = race
@@ -36,32 +60,82 @@ class Character:
         self.abilities = abilities
 
         self.XP = XP
-        if current_hp:
-            self.current_hp = current_hp
-        else:
-            self.current_hp = max_hp
+        # A character on 0 HP stays there; only a missing value means they're unhurt
+        self.current_hp = max_hp if current_hp is None else current_hp
         self.weapons = weapons
 
         self.unconscious = unconscious
-        self.death_saves = death_saves
+        self.death_saves = death_saves if death_saves else {'success': 0, 'fail': 0}
+        self.conditions = list(conditions) if conditions else []
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a character from its stored form, including pre-versioning `__dict__` dumps."""
+        data = dict(data)
+        version = data.pop('schema', 0)
+        if version > cls.SCHEMA_VERSION:
+            raise ValueError(f"Character {data.get('name')} was stored with a newer schema "
+                             f"(version {version})")
+        return cls(**data)
+
+    def to_dict(self):
+        """Return the character in the form in which it is stored."""
+        data = {field: getattr(self, field) for field in self.fields}
+        data['abilities'] = dict(self._abilities)
+        data['schema'] = self.SCHEMA_VERSION
+        return data
 
     def __repr__(self):
         return f"{self.name} ({self.race} {self.class_} {self.level})"
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._shortname = name.split()[0] if ' ' in name else name
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self, level):
+        self._level = level
+        proficiencies = [2, 3, 4, 5, 6]
+        self._proficiency = proficiencies[(int(level) - 1) // 4]
+
+    @property
+    def abilities(self):
+        """The character's ability scores. Use `set_ability` to change one."""
+        return MappingProxyType(self._abilities)
+
+    @abilities.setter
+    def abilities(self, abilities):
+        self._abilities = dict(abilities)
+        self._modifiers = {ability: (score-10) // 2 for ability, score in abilities.items()}
+
+    def set_ability(self, ability, score):
+        self._abilities[ability] = score
+        self._modifiers[ability] = (score-10) // 2
+
     async def take_damage(self, ndamage, opsdroid, message):
         """Handle removing of health from the character by e.g. a weapon attack."""
-        # Damage happens
-        self.current_hp -= ndamage
-
-        # Need to handle cases in which damage causes unconsciousness or death
-        # if self.current_hp <= self.max_hp / 2:
-        #     self.die(opsdroid)
-        # elif self.current_hp < 0:
-        #     self.unconscious = True
-        if self.current_hp < 0:
-            await self.die(opsdroid, message)
-        else:
-            await put_character(self, opsdroid, message.room)
+        async with room_lock(message.room, 'active_player', 'chars', 'initiatives'):
+            # Damage happens
+            self.current_hp -= ndamage
+
+            # Need to handle cases in which damage causes unconsciousness or death
+            # if self.current_hp <= self.max_hp / 2:
+            #     self.die(opsdroid)
+            # elif self.current_hp < 0:
+            #     self.unconscious = True
+            if self.current_hp < 0:
+                await self.die(opsdroid, message)
+            else:
+                await put_character(self, opsdroid, message.room, reason='damage')
 
     async def add_health(self, nhealth):
         """Add health to the character by e.g. a spell heal. Can exceed max HP."""
@@ -76,42 +150,42 @@ class Character:
         self.current_hp = min(self.max_hp, self.current_hp+nhealth)
 
     def gain_xp(self, nXP):
+        """Add experience points, returning whether the character went up a level."""
         self.XP += nXP
-        if self.XP >= level_XPs[self.level]:
-            self.level += 1
+        level = level_for_xp(self.XP)
+        if level > self.level:
+            self.level = level
             return True
         return False
 
     def modifier(self, ability):
         """Return the modifier for a given ability"""
-        return (self.abilities[ability]-10) // 2
+        return self._modifiers[ability]
 
     async def die(self, opsdroid, message):
         """Remove the character from the game without pissing off the player"""
         # Here because it's a circular import otherwise. Consider refactoring
         from .initiative import remove_from_initiative
 
-        await remove_from_initiative(self.shortname(), opsdroid, message.room)
-        chars = await load_from_memory(opsdroid, message.room, 'chars')
-        chars.pop(self.shortname())
-        await save_new_to_memory(opsdroid, message.room, 'chars', chars)
-        await message.respond(f"{self.shortname()} died!")
+        async with room_lock(message.room, 'active_player', 'chars', 'initiatives'):
+            await remove_from_initiative(self.shortname(), opsdroid, message.room)
+            await delete_chars(opsdroid, message.room, [self.shortname()])
+            await message.respond(f"{self.shortname()} died!")
 
     @property
     def proficiency(self):
         """Return the character's proficiency bonus as determined by level"""
-        proficiencies = [2, 3, 4, 5, 6]
-        return proficiencies[(int(self.level) - 1) // 4]
+        return self._proficiency
 
-    def ability_check(self, ability, passive=False):
+    def ability_check(self, ability, passive=False, rng=random):
         """Make a check for the specified ability and return the roll, modifier and total"""
-        base_roll = 10 if passive else randint(1, 20)
+        base_roll = 10 if passive else rng.randint(1, 20)
         check_roll = [base_roll, self.modifier(ability)]
         check_total = sum(check_roll)
 
         return check_total, check_roll
 
-    def skill_check(self, skill, passive=False):
+    def skill_check(self, skill, passive=False, rng=random):
         """Make a check for the specified skill and return the roll, modifier and total"""
         # TODO No proficiency here, need to add that
         # TODO Also replace this big ugly if block with a dictionary somewhere.
@@ -126,7 +200,7 @@ class Character:
         elif skill.lower() in ['deception', 'intimidation', 'performance', 'persuasion']:
             ability = 'Cha'
 
-        return self.ability_check(ability, passive=passive)
+        return self.ability_check(ability, passive=passive, rng=rng)
 
     async def attack(self, target, weapon_name, message, adv=None):
         weapon = self.weapons[weapon_name]
@@ -135,11 +209,12 @@ class Character:
                    'proficiency': self.proficiency})
         # Resolve any other conditions which would affect the roll
 
+        rng = room_rng(message.room)
         if adv:
-            a, b = randint(1, 20), randint(1, 20)
+            a, b = rng.rolls(20, 2)
             base_roll = abs(max(a*adv, b*adv))
         else:
-            base_roll = randint(1, 20)
+            base_roll = rng.roll(20)
 
         atk_roll = od()
         atk_roll['roll'] = base_roll
@@ -163,16 +238,15 @@ class Character:
 
         mods = od({weapon['modifier']: self.modifier(weapon['modifier'])})
 
-        match = re.match("(?P<ndice>\d+)?(?:d(?P<dice>\d+))", weapon['damage'])
-        ndice = match.group('ndice')
-        ndice = int(ndice) if ndice else 1
-        ndice = ndice * 2 if critical else ndice
-        dice = int(match.group('dice'))
+        damage = compile_dice(weapon['damage']).roll(critical=critical,
+                                                      rng=room_rng(message.room))
 
         dmg_roll = od()
-        dmg_roll['roll'] = list(map(partial(randint, 1), [dice]*ndice))
+        dmg_roll['roll'] = damage.dice
+        if damage.modifier:
+            dmg_roll['bonus'] = damage.modifier
         dmg_roll.update(mods)
-        dmg_total = sum(dmg_roll['roll']) + sum(mods.values())
+        dmg_total = damage.total + sum(mods.values())
 
         await target.take_damage(dmg_total, opsdroid, message)
 
@@ -186,16 +260,15 @@ class Character:
 
         mods = od({weapon['modifier']: self.modifier(weapon['modifier'])})
 
-        match = re.match("(?P<ndice>\d+)?(?:d(?P<dice>\d+))", weapon['damage'])
-        ndice = match.group('ndice')
-        ndice = int(ndice) if ndice else 1
-        ndice = ndice * 2 if critical else ndice
-        dice = int(match.group('dice'))
+        damage = compile_dice(weapon['damage']).roll(critical=critical,
+                                                      rng=room_rng(message.room))
 
         dmg_roll = od()
-        dmg_roll['roll'] = list(map(partial(randint, 1), [dice]*ndice))
+        dmg_roll['roll'] = damage.dice
+        if damage.modifier:
+            dmg_roll['bonus'] = damage.modifier
         dmg_roll.update(mods)
-        dmg_total = sum(dmg_roll['roll'])
+        dmg_total = damage.total
 
         await target.take_damage(dmg_total, opsdroid, message)
 
@@ -209,15 +282,14 @@ class Character:
 
         mods = od({weapon['modifier']: self.modifier(weapon['modifier'])})
 
-        match = re.match("(?P<ndice>\d+)?(?:d(?P<dice>\d+))", weapon['damage'])
-        ndice = match.group('ndice')
-        ndice = int(ndice) if ndice else 1
-        dice = int(match.group('dice'))
+        damage = compile_dice(weapon['damage']).roll(rng=room_rng(message.room))
 
         dmg_roll = od()
-        dmg_roll['roll'] = list(map(partial(randint, 1), [dice]*ndice))
+        dmg_roll['roll'] = damage.dice
+        if damage.modifier:
+            dmg_roll['bonus'] = damage.modifier
         dmg_roll.update(mods)
-        dmg_total = sum(dmg_roll['roll']) + sum(mods.values())
+        dmg_total = damage.total + sum(mods.values())
 
         await target.add_health(dmg_total, opsdroid, message)
 
@@ -227,7 +299,7 @@ class Character:
         return dmg_roll, dmg_total
 
     def shortname(self):
-        return self.name.split()[0] if ' ' in self.name else self.name
+        return self._shortname
 
 
 async def get_character(name, opsdroid, config, message, room=None):
@@ -237,43 +309,33 @@ async def get_character(name, opsdroid, config, message, room=None):
 
     room = room if room else message.room
 
-    # Ensure that a list of the characters exists
-    chars = await load_from_memory(opsdroid, room, 'chars')
-
-    logging.debug((name, chars.keys()))
-    if name not in chars.keys():
-        conn = opsdroid.default_connector
-        for connroom in conn.rooms:
-            if room == connroom or room == conn.room_ids[connroom]:
-                roomname = connroom
-                break
-        if opsdroid.config.get('module-path', None):
-            charstats = join(opsdroid.config['module-path'], 'characters',
-                             config['campaigns'][roomname]['characters'][name])
-        else:
-            charstats = join('characters', config['campaigns'][roomname]['characters'][name])
+    # Only this character's record is fetched, not the whole roster
+    charstats = await get_char(opsdroid, room, name)
+
+    logging.debug((name, charstats))
+    if charstats is None:
+        roomname = get_roomname(opsdroid, room)
+        charstats = campaign_path(opsdroid, 'characters',
+                                  config['campaigns'][roomname]['characters'][name])
         if isinstance(charstats, str):
-            with open(charstats) as f:
-                charstats = yaml.safe_load(f)
+            charstats = await load_template_async(charstats)
         elif 'loadfile' in charstats:
             file_ = charstats.pop('loadfile')
-            with open(file_) as f:
-                defaults = yaml.safe_load(f)
-                defaults.update(charstats)
-                charstats = defaults
+            defaults = await load_template_async(file_)
+            defaults.update(charstats)
+            charstats = defaults
             # defaults.update(charstats)
         logging.debug(charstats)
-        char = Character(**charstats)
-        await put_character(char, opsdroid, room, chars)
+        char = Character.from_dict(charstats)
+        await put_character(char, opsdroid, room)
         await message.respond(f"Character {name} not in memory - loaded from config.")
         return char
 
-    charstats = chars[name]
-    return Character(**charstats)
+    return Character.from_dict(charstats)
 
 
-@match_regex(f'!load( !usemem (?P<memroom>\w+))? ((?P<name>\D+)|((?P<n>\d)x)) (?P<file>.*)',
-             case_sensitive=False)
+@route(rf'!load( !usemem (?P<memroom>\w+))? ((?P<name>\D+)|((?P<n>\d)x)) (?P<file>.*)',
+       case_sensitive=False)
 @match_gm
 async def load_character(opsdroid, config, message):
     match = message.regex.group
@@ -291,25 +353,21 @@ async def load_character(opsdroid, config, message):
     if not loadfile[-5:] == '.yaml':
         loadfile += '.yaml'
 
-    # Ensure that a list of the characters exists
-    chars = await load_from_memory(opsdroid, room, 'chars')
-
-    logging.debug((name, chars.keys()))
-    if opsdroid.config.get('module-path', None):
-        loadfile = join(opsdroid.config['module-path'], loadfile)
-    for n in range(ntimes):
-        with open(loadfile) as f:
-            charstats = yaml.safe_load(f)
-        if ntimes > 1:
-            name = name[:-1] + str(n+1)
-        charstats['name'] = name
-        logging.debug(charstats)
-        chars[name] = charstats
-    await update_memory(opsdroid, room, 'chars', chars)
-    await message.respond(f"Character loaded from config.")
-
-
-@match_regex(f'!remove {OBJECT}( !usemem (?P<memroom>\w+))?', case_sensitive=False)
+    async with room_lock(room, 'chars'):
+        chars = {}
+        template = await templates.get_async(campaign_path(opsdroid, loadfile))
+        for n in range(ntimes):
+            charstats = copy_template(template)
+            if ntimes > 1:
+                name = name[:-1] + str(n+1)
+            charstats['name'] = name
+            logging.debug(charstats)
+            chars[name] = charstats
+        await put_many(opsdroid, room, chars)
+        await message.respond(f"Character loaded from config.")
+
+
+@route(rf'!remove {OBJECT}( !usemem (?P<memroom>\w+))?', case_sensitive=False)
 @match_gm
 async def remove_character(opsdroid, config, message):
     match = message.regex.group
@@ -317,29 +375,30 @@ async def remove_character(opsdroid, config, message):
     room = match('memroom')
     room = room if room else message.room
 
-    chars = await load_from_memory(opsdroid, room, 'chars')
-    chars.pop(name)
-    await save_new_to_memory(opsdroid, room, 'chars', chars)
+    async with room_lock(room, 'chars'):
+        await delete_chars(opsdroid, room, [name])
 
 
-@match_regex(f'!list characters( !usemem (?P<memroom>\w+))?', case_sensitive=False)
+@route(rf'!list characters( !usemem (?P<memroom>\w+))?', case_sensitive=False)
 async def list_characters(opsdroid, config, message):
     room = message.regex.group('memroom')
     room = room if room else message.room
-    chars = await load_from_memory(opsdroid, room, 'chars')
+    # Read-only, so no need to take the roster lock
+    chars = await get_many(opsdroid, room)
+    # Same as Character.__repr__, without building a Character for every entry
     await message.respond('\n'.join(
-        [f'{Character(**chars[char])}' for char in chars])) # Could do with clearer var names here..
+        [f"{stats['name']} ({stats['race']} {stats['class_']} {stats['level']})"
+         for stats in chars.values()]))
 
 
-async def put_character(char, opsdroid, room, chars=None):
+async def put_character(char, opsdroid, room, reason='update'):
     """Save a character into memory"""
-    if not chars:
-        chars = await load_from_memory(opsdroid, room, 'chars')
-    chars[char.name] = char.__dict__
-    await update_memory(opsdroid, room, 'chars', chars)
+    # Only this character's record is written
+    await put_char(opsdroid, room, char.name, char.to_dict(), reason)
 
 
-@match_regex('who am I', case_sensitive=False)
+@route('who am I', case_sensitive=False, keywords=['who'])
+@buffer_responses
 async def whoami(opsdroid, config, message):
     """Basic reporting of character identity"""
 
@@ -351,7 +410,9 @@ async def whoami(opsdroid, config, message):
         await message.respond(f"You are {char}, a fearless adventurer!")
 
 
-@match_regex(f"how('?s| am| is) {SUBJECT}( !usemem (?P<memroom>\w+))?", case_sensitive=False)
+@route(rf"how('?s| am| is) {SUBJECT}( !usemem (?P<memroom>\w+))?", case_sensitive=False,
+       keywords=['how'])
+@buffer_responses
 async def howami(opsdroid, config, message):
     """Basic reporting of characters' current health."""
     name = message.regex.group('subject')
@@ -393,35 +454,9 @@ async def get_players(opsdroid, config, room):
     return players
 
 
-async def grant_xp(charname, nXP, opsdroid, config, message):
-    char = await get_character(charname, opsdroid, config, message)
-    levelup = char.gain_xp(match('nXP'))
-    if levelup:
-        await message.respond(f'{charname}, you have reached level {char.level}! Hooray!')
-
-
-@match_regex(f'{OBJECT} {GAIN_VERB} (?P<nXP>\d+) XP', case_sensitive=False)
-@match_gm
-async def parse_xp(opsdroid, config, message):
-
-    match = message.regex.group
-
-    # Get character(s)
-    charname = match('object')
-    XP = match('nXP')
-
-    # Handle granting XP to the whole group
-    if charname.lower() in ['everyone', 'you all', 'the party', 'the group']:
-        chars = await load_from_memory(opsdroid, message.room, 'chars')
-        for charname in chars.keys():
-            grant_xp(charname, XP, opsdroid, config, message)
-    # Single character
-    else:
-        grant_xp(charname, XP, opsdroid, config, message)
-
-
-@match_regex(f'{OBJECT},? makes? an? (?P<p>passive )?(?P<skill>\w+) check( !usemem (?P<memroom>\w+))?',
-             case_sensitive=False)
+@route(rf'{OBJECT},? makes? an? (?P<p>passive )?(?P<skill>\w+) check( !usemem (?P<memroom>\w+))?',
+       case_sensitive=False, keywords=['check'])
+@buffer_responses
 async def make_check(opsdroid, config, message):
     match = message.regex.group
     charname = match('object')
@@ -433,16 +468,36 @@ async def make_check(opsdroid, config, message):
     skill = match('skill').title()
 
     char = await get_character(charname, opsdroid, config, message, room)
+    rng = room_rng(room)
     if skill in ['Str', 'Dex', 'Con', 'Int', 'Wis', 'Cha']:
-        total, rolls = char.ability_check(skill, passive=passive)
+        total, rolls = char.ability_check(skill, passive=passive, rng=rng)
     else:
-        total, rolls = char.skill_check(skill, passive=passive)
+        total, rolls = char.skill_check(skill, passive=passive, rng=rng)
 
     await message.respond(f"{charname} gets {total} ({' + '.join(str(r) for r in rolls)})!")
 
 
-@match_regex(f'!setvalue {OBJECT} (?P<attribute>\w+) (?P<value>\d+)( !usemem (?P<memroom>\w+))?',
-             case_sensitive=False)
+def get_attribute(char, attr):
+    """Return a character's attribute or ability score by name."""
+    if attr in char.abilities:
+        return char.abilities[attr]
+    if attr not in Character.fields:
+        raise AttributeError(f"Characters don't have a {attr}")
+    return getattr(char, attr)
+
+
+def set_attribute(char, attr, value):
+    """Set a character's attribute or ability score by name."""
+    if attr in char.abilities:
+        char.set_ability(attr, value)
+    elif attr in Character.fields:
+        setattr(char, attr, value)
+    else:
+        raise AttributeError(f"Characters don't have a {attr}")
+
+
+@route(rf'!setvalue {OBJECT} (?P<attribute>\w+) (?P<value>\d+)( !usemem (?P<memroom>\w+))?',
+       case_sensitive=False)
 @match_gm
 async def set_value(opsdroid, config, message):
     match = message.regex.group
@@ -450,12 +505,18 @@ async def set_value(opsdroid, config, message):
     room = match('memroom')
     room = room if room else message.room
 
-    char = await get_character(charname, opsdroid, config, message, room)
-    setattr(char, match('attribute'), int(match('value')))
-    await put_character(char, opsdroid, room)
+    attr = match('attribute')
 
-@match_regex(f'!changevalue {OBJECT} (?P<attribute>\w+) (?P<value>(\+|-)\d+)'
-             f'( !usemem (?P<memroom>\w+))?', case_sensitive=False)
+    async with room_lock(room, 'chars'):
+        char = await get_character(charname, opsdroid, config, message, room)
+        try:
+            set_attribute(char, attr, int(match('value')))
+        except AttributeError:
+            return await message.respond(f"{charname} has no attribute '{attr}'")
+        await put_character(char, opsdroid, room)
+
+@route(rf'!changevalue {OBJECT} (?P<attribute>\w+) (?P<value>(\+|-)\d+)'
+       rf'( !usemem (?P<memroom>\w+))?', case_sensitive=False)
 @match_gm
 async def _value(opsdroid, config, message):
     match = message.regex.group
@@ -464,6 +525,10 @@ async def _value(opsdroid, config, message):
     room = match('memroom')
     room = room if room else message.room
 
-    char = await get_character(charname, opsdroid, config, message, room)
-    setattr(char, attr, getattr(char, attr)+int(match('value')))
-    await put_character(char, opsdroid, room)
+    async with room_lock(room, 'chars'):
+        char = await get_character(charname, opsdroid, config, message, room)
+        try:
+            set_attribute(char, attr, get_attribute(char, attr)+int(match('value')))
+        except AttributeError:
+            return await message.respond(f"{charname} has no attribute '{attr}'")
+        await put_character(char, opsdroid, room)
@@ -3,15 +3,17 @@ Docstring
 """
 import re
 import logging
-from functools import partial
-from random import randint
 from collections import OrderedDict as od
 
-from opsdroid.matchers import match_regex
-
 from .constants.regex_constants import *
-from .characters import get_character, put_character
-from .matchers import match_active_player
+from .dice import compile_dice
+from .rng import room_rng
+from .characters import Character, get_character, put_character
+from .locks import room_lock
+from .dispatch import route
+from .responses import buffer_responses
+from .matchers import match_gm, match_active_player
+from .picard import get_char, char_names, delete_chars
 
 
 async def weapon_attack(attacker, defender, weapon, opsdroid, config, message):
@@ -25,20 +27,17 @@ async def weapon_attack(attacker, defender, weapon, opsdroid, config, message):
     hitmiss = 'misses'
 
     # Make attack roll
-    base_roll = randint(1, 20)
+    rng = room_rng(message.room)
+    base_roll = rng.roll(20)
     mod = attacker.modifier(weapon['modifier'])
     atk_roll = [base_roll, attacker.proficiency, mod]
     atk_total = sum(atk_roll)
     if atk_total >= defender.AC or base_roll == 20 and base_roll != 1:
         hitmiss = 'hits'
-        match = re.match("(?P<ndice>\d+)?(?:d(?P<dice>\d+))", weapon['damage'])
-        ndice = match.group('ndice')
-        ndice = int(ndice) if ndice else 1
-        ndice = ndice * 2 if base_roll == 20 else ndice
-        dice = int(match.group('dice'))
+        damage = compile_dice(weapon['damage']).roll(critical=(base_roll == 20), rng=rng)
 
-        rolls = list(map(partial(randint, 1), [dice]*ndice)) + [mod]
-        total_damage = sum(rolls)
+        rolls = damage.dice + [mod]
+        total_damage = damage.total + mod
 
         await defender.take_damage(total_damage, opsdroid, config, message)
     else:
@@ -57,9 +56,10 @@ async def weapon_attack(attacker, defender, weapon, opsdroid, config, message):
     return report, defender
 
 
-@match_regex(f'{OBJECT} {ATK_VERB} {SUBJECT} with {POSSESSIVE} {WEAPON}'
-             f'( with (?P<adv>advantage|disadvantage))?',
-             case_sensitive=False)
+@route(f'{SINGLE} {ATK_VERB} {SUBJECT} with {POSSESSIVE} {WEAPON}'
+       f'( with (?P<adv>advantage|disadvantage))?',
+       case_sensitive=False, keywords=ATK_VERBS)
+@buffer_responses
 @match_active_player
 async def attack(opsdroid, config, message):
     """
@@ -72,24 +72,26 @@ async def attack(opsdroid, config, message):
     atkr_name = match('object')
     if atkr_name.upper() == 'I':
         atkr_name = message.user
-    attacker = await get_character(atkr_name, opsdroid, config, message)
-    def_name = match('subject')
-    defender = await get_character(def_name, opsdroid, config, message)
-    weapon = match('weapon')
-    adv = match('adv')
-    if adv:
-        adv = -1 if 'dis' in adv else 1
-    logging.debug(adv)
-
-    atk_roll, atk_total = await attacker.attack(defender, weapon,  message, adv)
-    roll = atk_roll['roll']
-    if atk_total >= defender.AC or roll == 20 and roll != 1:
-        dmg_roll, dmg_total = await attacker.roll_damage(defender, weapon, message, opsdroid,
-                                                         critical=(roll==20))
-
-
-@match_regex(f'{OBJECT} {SPL_VERB} {HEAL_SPELL} on {SUBJECT}',
-             case_sensitive=False)
+    async with room_lock(message.room, 'active_player', 'chars', 'initiatives'):
+        attacker = await get_character(atkr_name, opsdroid, config, message)
+        def_name = match('subject')
+        defender = await get_character(def_name, opsdroid, config, message)
+        weapon = match('weapon')
+        adv = match('adv')
+        if adv:
+            adv = -1 if 'dis' in adv else 1
+        logging.debug(adv)
+
+        atk_roll, atk_total = await attacker.attack(defender, weapon,  message, adv)
+        roll = atk_roll['roll']
+        if atk_total >= defender.AC or roll == 20 and roll != 1:
+            dmg_roll, dmg_total = await attacker.roll_damage(defender, weapon, message, opsdroid,
+                                                             critical=(roll==20))
+
+
+@route(f'{OBJECT} {SPL_VERB} {HEAL_SPELL} on {SUBJECT}',
+       case_sensitive=False, keywords=SPL_VERBS)
+@buffer_responses
 @match_active_player
 async def castheal(opsdroid, config, message):
     """
@@ -98,21 +100,23 @@ async def castheal(opsdroid, config, message):
     """
     match = message.regex.group
 
-    # Get characters
-    atkr_name = match('object')
-    if atkr_name.upper() == 'I':
-        atkr_name = message.user
-    attacker = await get_character(atkr_name, opsdroid, config, message)
-    def_name = match('subject')
-    defender = await get_character(def_name, opsdroid, config, message)
-    weapon = match('HEAL_SPELL')
+    async with room_lock(message.room, 'chars'):
+        # Get characters
+        atkr_name = match('object')
+        if atkr_name.upper() == 'I':
+            atkr_name = message.user
+        attacker = await get_character(atkr_name, opsdroid, config, message)
+        def_name = match('subject')
+        defender = await get_character(def_name, opsdroid, config, message)
+        weapon = match('HEAL_SPELL')
 
-    dmg_roll, dmg_total = await attacker.roll_heal(defender, weapon, message, opsdroid)
+        dmg_roll, dmg_total = await attacker.roll_heal(defender, weapon, message, opsdroid)
 
 
-@match_regex(f'{OBJECT} {SPL_VERB} {ATK_SPELL} on {SUBJECT} '
-             f'( with (?P<adv>advantage|disadvantage))?',
-             case_sensitive=False)
+@route(f'{OBJECT} {SPL_VERB} {ATK_SPELL} on {SUBJECT} '
+       f'( with (?P<adv>advantage|disadvantage))?',
+       case_sensitive=False, keywords=SPL_VERBS)
+@buffer_responses
 @match_active_player
 async def castdmg(opsdroid, config, message):
     """
@@ -121,21 +125,101 @@ async def castdmg(opsdroid, config, message):
     """
     match = message.regex.group
 
-    # Get characters
-    atkr_name = match('object')
-    if atkr_name.upper() == 'I':
-        atkr_name = message.user
-    attacker = await get_character(atkr_name, opsdroid, config, message)
-    def_name = match('subject')
-    defender = await get_character(def_name, opsdroid, config, message)
-    weapon = match('ATK_SPELL')
-    adv = match('adv')
-    if adv:
-        adv = -1 if 'dis' in adv else 1
-    logging.debug(adv)
-
-    atk_roll, atk_total = await attacker.attack(defender, weapon, message, adv)
-    roll = atk_roll['roll']
-    if atk_total >= defender.AC or roll == 20 and roll != 1:
-        dmg_roll, dmg_total = await attacker.roll_spelldamage(defender, weapon, message, opsdroid,
-                                                              critical=(roll==20))
+    async with room_lock(message.room, 'active_player', 'chars', 'initiatives'):
+        # Get characters
+        atkr_name = match('object')
+        if atkr_name.upper() == 'I':
+            atkr_name = message.user
+        attacker = await get_character(atkr_name, opsdroid, config, message)
+        def_name = match('subject')
+        defender = await get_character(def_name, opsdroid, config, message)
+        weapon = match('ATK_SPELL')
+        adv = match('adv')
+        if adv:
+            adv = -1 if 'dis' in adv else 1
+        logging.debug(adv)
+
+        atk_roll, atk_total = await attacker.attack(defender, weapon, message, adv)
+        roll = atk_roll['roll']
+        if atk_total >= defender.AC or roll == 20 and roll != 1:
+            dmg_roll, dmg_total = await attacker.roll_spelldamage(defender, weapon, message, opsdroid,
+                                                                  critical=(roll==20))
+
+
+def group_members(chars, group):
+    """
+    Return the names of the numbered characters making up `group`.
+
+    Groups are spawned by `!load 5x goblins/goblin` or a scene's `number:` as Goblin1, Goblin2,
+    etc., so "goblins" matches any name that is "goblin" (or "goblins") plus a number.
+    """
+    group = group.lower()
+    bases = {group}
+    if group.endswith('s'):
+        bases.add(group[:-1])
+    if group.endswith('es'):
+        bases.add(group[:-2])
+    members = []
+    for name in chars:
+        match = re.fullmatch(r'(?P<base>.+?)_?\d+', name)
+        if match and match.group('base').lower() in bases:
+            members.append(name)
+    return members
+
+
+@route(f'{GROUP} {ATK_VERB} {SUBJECT}( with {POSSESSIVE} {WEAPON})?', case_sensitive=False,
+       keywords=ATK_VERBS)
+@match_gm
+async def group_attack(opsdroid, config, message):
+    """
+    Resolve the attacks of a whole group of identical characters against one target at once.
+
+    All the attack and damage rolls are made in batches, the total damage is applied with a
+    single write to the target's record, and the result is reported in one message.
+    """
+    match = message.regex.group
+    room = message.room
+
+    async with room_lock(room, 'active_player', 'chars', 'initiatives'):
+        # Load the target first, in case that adds them to the roster
+        defender = await get_character(match('subject'), opsdroid, config, message)
+        members = group_members(await char_names(opsdroid, room), match('group'))
+        if not members:
+            return await message.respond(f"I can't find any {match('group')} here!")
+
+        # The group are identical, so the first of them stands in for all of them
+        attacker = Character.from_dict(await get_char(opsdroid, room, members[0]))
+        weapon_name = match('weapon') or next(iter(attacker.weapons))
+        if weapon_name not in attacker.weapons and weapon_name.rstrip('s') in attacker.weapons:
+            weapon_name = weapon_name.rstrip('s')
+        weapon = attacker.weapons[weapon_name]
+        mod = attacker.modifier(weapon['modifier'])
+        bonus = mod + attacker.proficiency
+
+        rng = room_rng(room)
+        rolls = compile_dice('1d20').totals(len(members), rng=rng)
+        hits = [roll for roll in rolls if roll + bonus >= defender.AC or roll == 20]
+        ncrits = hits.count(20)
+        damage = compile_dice(weapon['damage'])
+        dmg_rolls = (damage.totals(len(hits) - ncrits, rng=rng) +
+                     damage.totals(ncrits, critical=True, rng=rng))
+        dmg_total = sum(dmg_rolls) + mod * len(hits)
+
+        report = [f"{len(members)} {match('group')} attack {defender.name} with their "
+                  f"{weapon_name}: {len(hits)} hit{'s' if len(hits) != 1 else ''}"
+                  f"{f' ({ncrits} critical)' if ncrits else ''} for {dmg_total} damage!",
+                  f"(attack rolls: {', '.join(f'{roll}+{bonus}' for roll in rolls)})"]
+
+        defender.current_hp -= dmg_total
+        if defender.current_hp < 0:
+            # Here because it's a circular import otherwise
+            from .initiative import load_turn_order, remove_from_initiative
+
+            await delete_chars(opsdroid, room, [defender.name])
+            if defender.name in await load_turn_order(opsdroid, room):
+                await remove_from_initiative(defender.name, opsdroid, room)
+            report.append(f"{defender.shortname()} died!")
+        else:
+            await put_character(defender, opsdroid, room, reason='damage')
+
+    await message.respond('\n'.join(report))
@@ -3,15 +3,20 @@ Definitions of regexes for matching common useful sentence parts.
 """
 
 # Regex definitions
-OBJECT = '(?P<object>\w+)' # in grammatical sense - person who is acting
-SUBJECT = '(?P<subject>\w+)' # acted upon
+OBJECT = r'(?P<object>\w+)' # in grammatical sense - person who is acting
+SUBJECT = r'(?P<subject>\w+)' # acted upon
+GROUP = r'the (?P<group>\w+)' # several identical characters acting together, e.g. "the goblins"
+SINGLE = r'(?<!\bthe )\b' + OBJECT # an OBJECT which isn't a GROUP, i.e. not after "the"
 POSSESSIVE = '(a|my|his|her|their)'
 
 ATK_VERB = '(hits?|attacks?|swings? at|shoots?)'
-WEAPON = '(?P<weapon>\w+)'
+ATK_VERBS = ('hit', 'hits', 'attack', 'attacks', 'swing', 'swings', 'shoot', 'shoots')
+WEAPON = r'(?P<weapon>\w+)'
 
 SPL_VERB = 'casts?'
+SPL_VERBS = ('cast', 'casts')
 HEAL_SPELL = 'false life'
 ATK_SPELL = '(firebolt|ray of frost|magic missile)'
 
 GAIN_VERB = '(gets?|gains?)'
+GAIN_VERBS = ('get', 'gets', 'gain', 'gains')
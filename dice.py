@@ -0,0 +1,131 @@
+"""
+Parsing and rolling of dice expressions such as ``2d6+1d4+3``, ``4d6kh3`` or ``1d20 adv``.
+
+Expressions are compiled once and cached, so the hot path never re-parses them.
+"""
+import re
+import random
+from functools import lru_cache
+
+__all__ = ['DiceError', 'DiceExpression', 'DiceRoll', 'compile_dice', 'roll']
+
+_TERM = re.compile(r'([+-])?(?:(\d*)d(\d+)(?:k([hl])(\d+))?|(\d+))', re.IGNORECASE)
+_ADVANTAGE = {'adv': 1, 'advantage': 1, 'dis': -1, 'disadvantage': -1}
+
+
+class DiceError(ValueError):
+    pass
+
+
+class DiceRoll:
+    """
+    The result of rolling a `DiceExpression` once.
+
+    `rolls` holds the kept dice for each dice term, `dropped` any dice discarded by
+    keep-highest/keep-lowest or (dis)advantage, and `modifier` the sum of the constant terms.
+    """
+    __slots__ = ('rolls', 'dropped', 'modifier', 'total')
+
+    def __init__(self, rolls, dropped, modifier, total):
+        self.rolls = rolls
+        self.dropped = dropped
+        self.modifier = modifier
+        self.total = total
+
+    @property
+    def dice(self):
+        """All of the kept dice as a single list."""
+        return [die for term in self.rolls for die in term]
+
+    def __repr__(self):
+        return f"DiceRoll({self.dice}, modifier={self.modifier}, total={self.total})"
+
+
+class DiceExpression:
+    """
+    A compiled dice expression.
+
+    Each term is a ``(sign, count, sides, keep)`` tuple, where ``keep`` is ``None`` or a
+    ``('h'|'l', n)`` pair.
+    """
+    def __init__(self, text, terms, modifier):
+        self.text = text
+        self.terms = terms
+        self.modifier = modifier
+
+    def __repr__(self):
+        return f"DiceExpression({self.text!r})"
+
+    def roll(self, critical=False, rng=random):
+        """Roll the expression once. A critical doubles the number of dice rolled."""
+        return self.roll_many(1, critical=critical, rng=rng)[0]
+
+    def roll_many(self, n, critical=False, rng=random):
+        """
+        Roll the expression `n` times, drawing all the dice for each term in a single batch.
+        """
+        scale = 2 if critical else 1
+        results = [([], []) for _ in range(n)]
+        for sign, count, sides, keep in self.terms:
+            count *= scale
+            batch = rng.choices(range(1, sides + 1), k=count * n)
+            for i, (rolls, dropped) in enumerate(results):
+                dice = batch[i * count:(i + 1) * count]
+                if keep:
+                    order = sorted(dice, reverse=(keep[0] == 'h'))
+                    nkeep = keep[1] * scale
+                    dice = order[:nkeep]
+                    dropped.append(order[nkeep:])
+                rolls.append(dice)
+
+        signs = [term[0] for term in self.terms]
+        return [DiceRoll(rolls, dropped, self.modifier,
+                         self.modifier + sum(sign * sum(dice) for sign, dice in zip(signs, rolls)))
+                for rolls, dropped in results]
+
+    def totals(self, n, critical=False, rng=random):
+        """Return just the totals of `n` rolls."""
+        return [result.total for result in self.roll_many(n, critical=critical, rng=rng)]
+
+
+@lru_cache(maxsize=512)
+def compile_dice(text):
+    """
+    Compile a dice expression, e.g. ``'2d6+1d4+3'``, ``'4d6kh3'`` or ``'1d20 adv'``.
+
+    A trailing ``adv``/``dis`` rolls every d20 twice, keeping the higher/lower result. Any other
+    words after the expression, such as a damage type in ``'1d12 slashing'``, are ignored.
+    """
+    words = re.sub(r'\s*([+-])\s*', r'\1', text.lower()).split()
+    if not words:
+        raise DiceError("Can't roll an empty dice expression")
+    expression, *words = words
+    advantage = 0
+    for word in words:
+        advantage = _ADVANTAGE.get(word, advantage)
+
+    terms, modifier, pos = [], 0, 0
+    while pos < len(expression):
+        match = _TERM.match(expression, pos)
+        if not match or match.end() == pos or (pos and not match.group(1)):
+            raise DiceError(f"Can't parse dice expression '{text}'")
+        sign = -1 if match.group(1) == '-' else 1
+        if match.group(6):
+            modifier += sign * int(match.group(6))
+        else:
+            count = int(match.group(2)) if match.group(2) else 1
+            sides = int(match.group(3))
+            if sides < 1:
+                raise DiceError(f"Can't roll a die with {sides} sides in '{text}'")
+            keep = (match.group(4), int(match.group(5))) if match.group(4) else None
+            if sides == 20 and advantage and not keep:
+                count, keep = count * 2, ('h' if advantage > 0 else 'l', count)
+            terms.append((sign, count, sides, keep))
+        pos = match.end()
+
+    return DiceExpression(text, tuple(terms), modifier)
+
+
+def roll(text, critical=False, rng=random):
+    """Compile (or fetch the already compiled) `text` and roll it once."""
+    return compile_dice(text).roll(critical=critical, rng=rng)
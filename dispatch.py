@@ -0,0 +1,142 @@
+"""
+Routing of messages to the skill's handlers through a single opsdroid matcher.
+
+Rather than registering every handler with opsdroid's `match_regex`, which tests each message
+against every pattern, handlers are registered here with `route` and indexed by keyword. A
+message is only tested against the patterns whose keywords it contains, so most chatter is
+rejected without running any regexes at all.
+"""
+import re
+import time
+import logging
+
+from .metrics import metrics, InstrumentedMessage
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['Route', 'Dispatcher', 'dispatcher', 'route']
+
+_TOKEN = re.compile(r'!?\w+')
+_COMMAND = re.compile(r'!\w+')
+
+
+class Route:
+    """
+    A handler and the pattern which triggers it.
+
+    `keywords` are lower case words, at least one of which appears in any message the pattern
+    can match. A route without keywords is tried for every message.
+    """
+    __slots__ = ('expression', 'pattern', 'handler', 'keywords', 'hits')
+
+    def __init__(self, expression, handler, case_sensitive=True, keywords=()):
+        self.expression = expression
+        self.pattern = re.compile(expression, 0 if case_sensitive else re.IGNORECASE)
+        self.handler = handler
+        self.keywords = frozenset(keyword.lower() for keyword in keywords)
+        self.hits = 0
+
+    def __repr__(self):
+        return f"Route({self.expression!r}, {self.handler.__name__})"
+
+    @property
+    def score(self):
+        # opsdroid prefers the longest of several matching regexes
+        return len(self.expression)
+
+    def search(self, text):
+        return self.pattern.search(text)
+
+
+class Dispatcher:
+    """
+    The table of routes, indexed by keyword.
+    """
+    def __init__(self):
+        self.routes = []
+        self._keywords = {}
+        self._unindexed = []
+        self.messages = 0
+        self.unmatched = 0
+
+    def add(self, expression, handler, case_sensitive=True, keywords=None):
+        """
+        Register `handler` for messages matching `expression`.
+
+        If `keywords` isn't given, a pattern starting with a command such as ``!init`` is
+        indexed by that command.
+        """
+        if keywords is None:
+            command = _COMMAND.match(expression)
+            keywords = [command.group()] if command else []
+        route = Route(expression, handler, case_sensitive, keywords)
+        self.routes.append(route)
+        for keyword in route.keywords:
+            self._keywords.setdefault(keyword, []).append(route)
+        if not route.keywords:
+            self._unindexed.append(route)
+        return route
+
+    def route(self, expression, case_sensitive=True, keywords=None):
+        """
+        Define decorator which routes messages matching `expression` to the decorated function.
+
+        Used in place of opsdroid's `match_regex`, with the same arguments plus `keywords`.
+        """
+        def decorator(func):
+            self.add(expression, func, case_sensitive, keywords)
+            return func
+
+        return decorator
+
+    def candidates(self, text):
+        """Return the routes whose keywords appear in `text`."""
+        tokens = set(_TOKEN.findall(text.lower()))
+        found = list(self._unindexed)
+        for token in tokens.intersection(self._keywords):
+            found.extend(self._keywords[token])
+        return list(dict.fromkeys(found))
+
+    def match(self, text):
+        """Return the best matching (route, match) for `text`, or None."""
+        best = None
+        for route in self.candidates(text):
+            found = route.search(text)
+            if found and (best is None or route.score > best[0].score):
+                best = (route, found)
+        return best
+
+    async def dispatch(self, opsdroid, config, message):
+        """Run the handler matching `message`, if there is one."""
+        self.messages += 1
+        with metrics.timer('rpgchar_dispatch_seconds'):
+            best = self.match(message.text or '')
+        if best is None:
+            self.unmatched += 1
+            return
+        route, message.regex = best
+        route.hits += 1
+        name = route.handler.__name__
+        _LOGGER.debug(f"Routing '{message.text}' to {name}")
+        metrics.inc('rpgchar_commands_total', handler=name, room=message.room)
+        start = time.perf_counter()
+        try:
+            return await route.handler(opsdroid, config, InstrumentedMessage(message, name))
+        except Exception:
+            metrics.inc('rpgchar_handler_errors_total', handler=name)
+            _LOGGER.exception(f"Exception when running skill {name}")
+            await message.respond("Whoops there has been an error")
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe('rpgchar_handler_seconds', elapsed, handler=name)
+            metrics.inc('rpgchar_room_handler_seconds_total', elapsed, room=message.room)
+
+    def stats(self):
+        """Return the number of times each pattern has matched, most used first."""
+        return {'messages': self.messages, 'unmatched': self.unmatched,
+                'routes': {route.expression: route.hits
+                           for route in sorted(self.routes, key=lambda r: r.hits, reverse=True)}}
+
+
+dispatcher = Dispatcher()
+route = dispatcher.route
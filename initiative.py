@@ -2,16 +2,112 @@
 Docstring
 """
 import logging
+from bisect import bisect_left
 from collections import OrderedDict
 
-from random import randint
-from opsdroid.matchers import match_regex
-
+from .dice import compile_dice
+from .rng import room_rng
+from .locks import room_lock
+from .dispatch import route
 from .matchers import match_gm, match_active_player
-from .characters import get_character
-from .picard import load_from_memory, save_new_to_memory, update_memory
+from .characters import Character
+from .picard import (load_from_memory, save_new_to_memory, roster_cache, get_char, get_many,
+                     record_event, load_active_player, save_active_player)
+
+class TurnOrder:
+    """
+    The initiative order for a room, kept sorted with a cursor marking whose turn it is.
+
+    Entries are ordered by initiative and then Dex modifier, both descending, with the name
+    as a final stable tie-break. Advancing the turn is O(1) and adding or removing a
+    combatant is a binary search plus a single list insertion/deletion.
+    """
+    def __init__(self, entries=(), cursor=0):
+        self._keys = {name: (-init, -dex, name) for name, init, dex in entries}
+        self._order = sorted(self._keys.values())
+        self.cursor = cursor if self._order else 0
+
+    @classmethod
+    def from_memory(cls, data, active_player=None):
+        """
+        Build the order from its stored form.
+
+        Older rooms store a plain {name: initiative} dict with the active player separately;
+        those are converted, using the active player to place the cursor.
+        """
+        if not data:
+            return cls()
+        if 'order' in data:
+            return cls(data['order'], data.get('cursor', 0))
+        order = cls((name, init, 0) for name, init in data.items())
+        if active_player in order:
+            order.cursor = order.index(active_player)
+        return order
+
+    def to_memory(self):
+        return {'order': [[name, -init, -dex] for init, dex, name in self._order],
+                'cursor': self.cursor}
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    def index(self, name):
+        return bisect_left(self._order, self._keys[name])
+
+    @property
+    def active(self):
+        """The name of whoever's turn it is, or None if the order is empty."""
+        return self._order[self.cursor][2] if self._order else None
+
+    def initiative(self, name):
+        return -self._keys[name][0]
+
+    def advance(self):
+        """Move on to the next combatant and return their name."""
+        if self._order:
+            self.cursor = (self.cursor + 1) % len(self._order)
+        return self.active
+
+    def add(self, name, init, dex=0):
+        """Add (or move) a combatant without changing whose turn it is."""
+        active = self.active
+        if name in self._keys:
+            self.remove(name)
+        key = self._keys[name] = (-init, -dex, name)
+        self._order.insert(bisect_left(self._order, key), key)
+        # Follow whoever's turn it was, even if that's the combatant who moved
+        self.cursor = self.index(active) if active is not None else 0
+
+    def remove(self, name):
+        """Remove a combatant. If it was their turn, the next combatant becomes active."""
+        i = bisect_left(self._order, self._keys.pop(name))
+        del self._order[i]
+        if i < self.cursor:
+            self.cursor -= 1
+        elif self.cursor >= len(self._order):
+            self.cursor = 0
+
+    def rotation(self):
+        """Return (name, initiative) pairs starting from the active combatant."""
+        order = self._order[self.cursor:] + self._order[:self.cursor]
+        return [(name, -init) for init, _, name in order]
+
+
+async def load_turn_order(opsdroid, room):
+    inits = await load_from_memory(opsdroid, room, 'initiatives')
+    if inits and 'order' not in inits:
+        return TurnOrder.from_memory(inits, await load_active_player(opsdroid, room))
+    return TurnOrder.from_memory(inits)
+
+
+async def save_turn_order(opsdroid, room, order):
+    await save_new_to_memory(opsdroid, room, 'initiatives', order.to_memory())
 
-@match_regex('roll initiative', case_sensitive=False)
+
+@route('roll initiative', case_sensitive=False, keywords=['initiative'])
 @match_gm
 async def create_initiative(opsdroid, config, message):
     """
@@ -19,38 +115,38 @@ async def create_initiative(opsdroid, config, message):
     """
 
     # chars = config['chars'].keys()
-    chars = await load_from_memory(opsdroid, message.room, 'chars')
-    inits = {} #OrderedDict()
-    for charname in chars:
-        char = await get_character(charname, opsdroid, config, message)
-        # TODO replace this with a character method to allow for custon initiative modifiers
-        inits[charname] = randint(1, 20) + char.modifier('Dex')
-
-    inits = OrderedDict(sorted(inits.items(), key=lambda t: t[1], reverse=True))
-    await message.respond('\n'.join(
-        [f'{charname} rolled {inits[charname]}' for charname in inits])) #init_order)
+    async with room_lock(message.room, 'chars', 'initiatives', 'active_player'):
+        chars = await get_many(opsdroid, message.room)
+        # Roll everyone's d20 in one go
+        rolls = compile_dice('1d20').totals(len(chars), rng=room_rng(message.room))
+        entries = []
+        for charname, roll in zip(chars, rolls):
+            char = Character.from_dict(chars[charname])
+            # TODO replace this with a character method to allow for custon initiative modifiers
+            dex = char.modifier('Dex')
+            entries.append((charname, roll + dex, dex))
+
+        order = TurnOrder(entries)
+        await message.respond('\n'.join(
+            [f'{charname} rolled {init}' for charname, init in order.rotation()]))
 
-    await save_new_to_memory(opsdroid, message.room, 'initiatives', inits)
-    await update_memory(opsdroid, message.room, 'active_player', {'name': next(iter(inits))})
+        await save_turn_order(opsdroid, message.room, order)
+        await save_active_player(opsdroid, message.room, order.active)
+        await record_event(opsdroid, message.room, 'init_roll',
+                           order=[[name, init] for name, init in order.rotation()])
 
 
 async def get_initiatives(opsdroid, room):
-    inits = await load_from_memory(opsdroid, room, 'initiatives')
-    active_player = await load_from_memory(opsdroid, room, 'active_player')
-    active_player = active_player['name']
-    if inits:
-        inits = OrderedDict(sorted(inits.items(), key=lambda t: t[1], reverse=True))
-        top = next(iter(inits))
-        while top != active_player:
-            inits.move_to_end(top)
-            top = next(iter(inits))
-    return inits
+    """Return the initiative order as an OrderedDict, starting with the active player."""
+    order = await load_turn_order(opsdroid, room)
+    return OrderedDict(order.rotation())
 
 
-@match_regex("!init order( !usemem (?P<memroom>\w+))?")
+@route(r"!init order( !usemem (?P<memroom>\w+))?")
 async def report_order(opsdroid, config, message):
     room  = message.regex.group('memroom')
     room = room if room else message.room
+    # Read-only, so no need to take the initiative lock
     inits = await get_initiatives(opsdroid, room)
     if inits:
         await message.respond('\n'.join(
@@ -58,44 +154,48 @@ async def report_order(opsdroid, config, message):
     else:
         await message.respond("Looks like there isn't an initiative order yet!")
 
-@match_regex("whose turn", case_sensitive=False)
+@route("whose turn", case_sensitive=False, keywords=['whose'])
 async def get_active_player(opsdroid, config, message):
     """Retreive the character of the player who's turn it is currently"""
 
     # char = await opsdroid.memory.get('active_player')
     # char = inits.values()[0]
-    inits = await get_initiatives(opsdroid, message.room)
-    if inits:
-        char = next(iter(inits))
+    char = await load_active_player(opsdroid, message.room)
+    if char:
         await message.respond(f"It's {char}'s turn")
     else:
         await message.respond("Looks like there isn't an initiative order yet!")
 
 
-@match_regex('next player', case_sensitive=False)
+@route('next player', case_sensitive=False, keywords=['next'])
 @match_active_player
 async def next_player(opsdroid, config, message):
     """
     Report the next player in the initiative order so they know it's their turn.
     """
 
-    inits = await get_initiatives(opsdroid, message.room)
-    current = next(iter(inits))
-    inits.move_to_end(current)
-    nextup = next(iter(inits))
+    async with room_lock(message.room, 'initiatives', 'active_player'):
+        order = await load_turn_order(opsdroid, message.room)
+        # Someone else may have ended this turn while we were waiting for the lock
+        if not message.auth.is_gm and order.active != message.auth.active_player:
+            await message.respond(f"It's already {order.active}'s turn")
+            return
+        nextup = order.advance()
 
-    await save_new_to_memory(opsdroid, message.room, 'initiatives', inits)
-    await update_memory(opsdroid, message.room, 'active_player', {'name': nextup})
+        await save_turn_order(opsdroid, message.room, order)
+        await save_active_player(opsdroid, message.room, nextup)
+        # End of turn is a natural point to persist whatever happened during it
+        await roster_cache.flush(opsdroid, message.room)
 
-    events = await load_from_memory(opsdroid, message.room, 'events')
-    if nextup in events.keys():
-        await message.respond(f"{events[nextup]}")
-    else:
-        await message.respond(f"Next up: {nextup}")
+        events = await load_from_memory(opsdroid, message.room, 'events')
+        if nextup in events.keys():
+            await message.respond(f"{events[nextup]}")
+        else:
+            await message.respond(f"Next up: {nextup}")
 
 
-@match_regex(f'!init add (?P<name>\w+) (?P<initval>\d+)( !usemem (?P<memroom>\w+))?',
-             case_sensitive=False)
+@route(rf'!init add (?P<name>\w+) (?P<initval>\d+)( !usemem (?P<memroom>\w+))?',
+       case_sensitive=False)
 @match_gm
 async def add_character(opsdroid, config, message):
     match = message.regex.group
@@ -105,16 +205,26 @@ async def add_character(opsdroid, config, message):
     room = room if room else message.room
 
     # Get current order from memory and determine current player
-    inits = await get_initiatives(opsdroid, room)
+    async with room_lock(room, 'initiatives', 'active_player'):
+        order = await load_turn_order(opsdroid, room)
+        active = order.active
+
+        # Ties are broken by Dex, if we know the character
+        stats = await get_char(opsdroid, room, charname)
+        dex = Character.from_dict(stats).modifier('Dex') if stats else 0
 
-    # Add new character to order
-    inits[charname] = initval
+        # Add new character to order
+        order.add(charname, initval, dex)
 
-    await save_new_to_memory(opsdroid, room, 'initiatives', inits)
+        await save_turn_order(opsdroid, room, order)
+        await record_event(opsdroid, room, 'init_add', name=charname, init=initval)
+        # Only changes if they're the first in the order
+        if order.active != active:
+            await save_active_player(opsdroid, room, order.active)
 
 
-@match_regex(f'!init event( !usemem (?P<memroom>\w+))? (?P<initval>\d+) (?P<name>\w+) (?P<text>.*)',
-             case_sensitive=False)
+@route(rf'!init event( !usemem (?P<memroom>\w+))? (?P<initval>\d+) (?P<name>\w+) (?P<text>.*)',
+       case_sensitive=False)
 @match_gm
 async def add_event(opsdroid, config, message):
     match = message.regex.group
@@ -125,18 +235,24 @@ async def add_event(opsdroid, config, message):
     room = room if room else message.room
 
     # Add event to order
-    inits = await get_initiatives(opsdroid, room)
-    inits[event_name] = int(initval)
+    async with room_lock(room, 'initiatives', 'events', 'active_player'):
+        order = await load_turn_order(opsdroid, room)
+        active = order.active
+        order.add(event_name, int(initval))
 
-    # Add to events description
-    events = await load_from_memory(opsdroid, room, 'events')
-    events[event_name] = event_text
+        # Add to events description
+        events = await load_from_memory(opsdroid, room, 'events')
+        events[event_name] = event_text
 
-    await save_new_to_memory(opsdroid, room, 'initiatives', inits)
-    await save_new_to_memory(opsdroid, room, 'events', events)
+        await save_turn_order(opsdroid, room, order)
+        await save_new_to_memory(opsdroid, room, 'events', events)
+        await record_event(opsdroid, room, 'init_add', name=event_name, init=int(initval))
+        # Only changes if it's the first in the order
+        if order.active != active:
+            await save_active_player(opsdroid, room, order.active)
 
 
-@match_regex(f'!init remove (?P<name>\w+)( !usemem (?P<memroom>\w+))?', case_sensitive=False)
+@route(rf'!init remove (?P<name>\w+)( !usemem (?P<memroom>\w+))?', case_sensitive=False)
 @match_gm
 async def remove_item(opsdroid, config, message):
     match = message.regex.group
@@ -148,13 +264,29 @@ async def remove_item(opsdroid, config, message):
 
 
 async def remove_from_initiative(name, opsdroid, room):
-    inits = await load_from_memory(opsdroid, room, 'initiatives')
-    # try:
-    inits.pop(name)
-    # except KeyError:
-    #     for k in inits.keys():
-    #         if k.split()[0] == name:
-    #             inits.pop(k)
-    #             break
-
-    await save_new_to_memory(opsdroid, room, 'initiatives', inits)
+    async with room_lock(room, 'initiatives', 'active_player'):
+        order = await load_turn_order(opsdroid, room)
+        was_active = order.active == name
+        order.remove(name)
+
+        await save_turn_order(opsdroid, room, order)
+        await record_event(opsdroid, room, 'init_remove', name=name)
+        if was_active:
+            await save_active_player(opsdroid, room, order.active)
+
+
+async def remove_many_from_initiative(names, opsdroid, room):
+    """Take several characters out of the turn order with a single write, e.g. after a fireball."""
+    async with room_lock(room, 'initiatives', 'active_player'):
+        order = await load_turn_order(opsdroid, room)
+        names = [name for name in names if name in order]
+        if not names:
+            return
+        active = order.active
+        for name in names:
+            order.remove(name)
+
+        await save_turn_order(opsdroid, room, order)
+        await record_event(opsdroid, room, 'init_remove', names=names)
+        if order.active != active:
+            await save_active_player(opsdroid, room, order.active)
@@ -0,0 +1,105 @@
+"""
+An append-only journal of the changes made to each room's game state.
+
+Changes to characters are held in the roster cache and only written out when it is flushed,
+so each change is also appended to the journal as a small record. Flushing the cache is a
+snapshot: entries up to that point are no longer needed, and after a restart the entries
+since the last snapshot are replayed to recover anything which hadn't been flushed.
+
+Entries are stored in a ring of `size` keys, so a snapshot must be taken before the ring
+wraps around.
+"""
+import time
+import asyncio
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['Journal', 'journal']
+
+ENTRY_KEY = 'journal/{}'
+HEAD_KEY = 'journal_head'
+
+
+class Journal:
+    """
+    The journals for every room, written through per-room memory handles.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self._heads = {}
+        self._recovering = {}
+
+    def __contains__(self, room):
+        return room in self._heads
+
+    async def recover(self, memory, room):
+        """
+        Read the journal for `room` and return the entries made since the last snapshot.
+
+        Concurrent calls for the same room share one read, and all get the same entries.
+        """
+        future = self._recovering.get(room)
+        if future is None:
+            future = self._recovering[room] = asyncio.ensure_future(self._recover(memory, room))
+            future.add_done_callback(lambda _: self._recovering.pop(room, None))
+        return await asyncio.shield(future)
+
+    async def _recover(self, memory, room):
+        head = await memory.get(HEAD_KEY) or {'snapshot': 0}
+        seq = head['snapshot']
+        entries = []
+        while True:
+            entry = await memory.get(ENTRY_KEY.format((seq + 1) % self.size))
+            # Slots in the ring are reused, so anything but the next entry ends the journal
+            if not entry or entry.get('seq') != seq + 1:
+                break
+            entries.append(entry)
+            seq += 1
+        # Don't wind back a head which has moved on since it was last recovered
+        self._heads.setdefault(room, {'seq': seq, 'snapshot': head['snapshot']})
+        if entries:
+            _LOGGER.info(f"Recovered {len(entries)} journal entries for {room}")
+        return entries
+
+    async def append(self, memory, room, op, **data):
+        """Record an event, e.g. `append(memory, room, 'damage', name='Thorin', ...)`."""
+        if room not in self._heads:
+            await self.recover(memory, room)
+        head = self._heads[room]
+        head['seq'] += 1
+        entry = dict(data, op=op, seq=head['seq'], time=time.time())
+        await memory.put(ENTRY_KEY.format(head['seq'] % self.size), entry)
+        return head['seq']
+
+    def seq(self, room):
+        """Return the sequence number of the last entry for `room`."""
+        head = self._heads.get(room)
+        return head['seq'] if head else 0
+
+    def pending(self, room):
+        """Return the number of entries made since the last snapshot."""
+        head = self._heads.get(room)
+        return head['seq'] - head['snapshot'] if head else 0
+
+    def full(self, room):
+        return self.pending(room) >= self.size - 1
+
+    async def snapshot(self, memory, room, seq=None):
+        """
+        Mark the entries up to `seq` (by default all of them) as safely stored elsewhere.
+        """
+        head = self._heads.get(room)
+        if head is None:
+            return
+        seq = head['seq'] if seq is None else seq
+        if seq <= head['snapshot']:
+            return
+        head['snapshot'] = seq
+        await memory.put(HEAD_KEY, {'snapshot': head['snapshot']})
+
+    def forget(self, room):
+        self._heads.pop(room, None)
+
+
+journal = Journal()
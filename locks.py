@@ -0,0 +1,110 @@
+"""
+Locks for read-modify-write operations on a room's game state.
+"""
+import time
+import asyncio
+import logging
+from weakref import WeakValueDictionary
+from contextlib import asynccontextmanager
+
+from .metrics import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['StateLock', 'LockRegistry', 'room_locks', 'room_lock']
+
+
+class StateLock:
+    """
+    An asyncio lock which the task holding it can acquire again.
+
+    Handlers lock the state they are about to modify, but the helpers they call (e.g.
+    `Character.take_damage` -> `Character.die` -> `remove_from_initiative`) lock it too.
+    """
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner = None
+        self._depth = 0
+
+    def locked(self):
+        return self._lock.locked()
+
+    def held_by_current_task(self):
+        return self._owner is asyncio.current_task()
+
+    async def acquire(self):
+        if self.held_by_current_task():
+            self._depth += 1
+            return
+        await self._lock.acquire()
+        self._owner = asyncio.current_task()
+        self._depth = 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+
+class LockRegistry:
+    """
+    Hands out one `StateLock` per (room, key) and records how contended each one is.
+    """
+    def __init__(self):
+        self._locks = WeakValueDictionary()
+        self.stats = {}
+
+    def get(self, room, key):
+        lock = self._locks.get((room, key))
+        if lock is None:
+            lock = self._locks[(room, key)] = StateLock()
+        return lock
+
+    def _record(self, name, waited, contended):
+        stats = self.stats.setdefault(name, {'acquired': 0, 'contended': 0,
+                                             'wait_total': 0., 'wait_max': 0.})
+        stats['acquired'] += 1
+        if contended:
+            stats['contended'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            metrics.inc('rpgchar_lock_contended_total', key=name[1])
+            metrics.observe('rpgchar_lock_wait_seconds', waited, key=name[1])
+
+    @asynccontextmanager
+    async def lock(self, room, *keys):
+        """
+        Hold the locks for `keys` in `room` for the duration of the context.
+
+        Locks are always taken in sorted order so that handlers locking overlapping sets of
+        keys cannot deadlock each other.
+        """
+        held = []
+        try:
+            for key in sorted(set(keys)):
+                lock = self.get(room, key)
+                contended = lock.locked() and not lock.held_by_current_task()
+                start = time.perf_counter()
+                await lock.acquire()
+                held.append(lock)
+                waited = time.perf_counter() - start
+                if contended:
+                    _LOGGER.debug(f"Waited {waited:.4f}s for {key} in {room}")
+                self._record((room, key), waited, contended)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    def contention(self):
+        """Return the lock statistics, most contended first."""
+        return sorted(self.stats.items(), key=lambda item: item[1]['contended'], reverse=True)
+
+
+room_locks = LockRegistry()
+
+
+def room_lock(room, *keys):
+    """Lock `keys` (e.g. 'chars', 'initiatives') in `room` using the shared registry."""
+    return room_locks.lock(room, *keys)
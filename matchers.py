@@ -1,24 +1,68 @@
 import logging
+from functools import wraps
 
 from opsdroid.helper import get_opsdroid
 
-from .picard import load_from_memory
+from .metrics import metrics
+from .picard import load_active_player
 
 _LOGGER = logging.getLogger(__name__)
 
+_UNRESOLVED = object()
+
+
+class AuthContext:
+    """
+    Who sent a message, and who the GM and active player were when it was checked.
+
+    The matchers attach one to each message as `message.auth`, so the active player is looked
+    up at most once per message and handlers can use it without fetching it again.
+    """
+    __slots__ = ('user', 'gm', '_active_player')
+
+    def __init__(self, user, gm):
+        self.user = user
+        self.gm = gm
+        self._active_player = _UNRESOLVED
+
+    @property
+    def is_gm(self):
+        return self.user == self.gm
+
+    @property
+    def active_player(self):
+        if self._active_player is _UNRESOLVED:
+            raise AttributeError("The active player hasn't been looked up for this message")
+        return self._active_player
+
+    async def resolve_active_player(self, opsdroid, room):
+        if self._active_player is _UNRESOLVED:
+            self._active_player = await load_active_player(opsdroid, room)
+        return self._active_player
+
+
+def get_auth(config, message):
+    """Return the message's `AuthContext`, creating it if this is the first check."""
+    auth = getattr(message, 'auth', None)
+    if not isinstance(auth, AuthContext):
+        auth = message.auth = AuthContext(message.user, config['game_master'])
+    return auth
+
 
 def match_gm(func):
     """Define GM-matching decorator"""
+    @wraps(func)
     async def matcher(opsdroid, config, message):
         """Restrict the use of `func`'s skill to only the Game Master"""
-        gm = config['game_master']
-        user = message.user
-        _LOGGER.debug("Matching user to GM")
-        _LOGGER.debug(f'GM: {gm}; User: {user}')
+        with metrics.timer('rpgchar_auth_seconds', check='gm'):
+            auth = get_auth(config, message)
+            _LOGGER.debug("Matching user to GM")
+            _LOGGER.debug(f'GM: {auth.gm}; User: {auth.user}')
 
-        if user == gm:
+        if auth.is_gm:
             return await func(opsdroid, config, message)
         else:
+            metrics.inc('rpgchar_auth_denied_total', check='gm', handler=func.__name__)
             return await message.respond("I can't let you do that, Dave. That functionality is reserved for the Game Master")
 
     return matcher
@@ -26,19 +70,22 @@ def match_gm(func):
 
 def match_active_player(func):
     """Define decorator to match the active player"""
+    @wraps(func)
     async def matcher(opsdroid, config, message):
         """Restrict the decorated functions actions to the person whose turn it is (and the GM)"""
-        gm = config['game_master']
-        active_player = await load_from_memory(opsdroid, message.room, 'active_player')
-        active_player = active_player['name']
-        user = message.user
+        with metrics.timer('rpgchar_auth_seconds', check='active_player'):
+            auth = get_auth(config, message)
+            active_player = await auth.resolve_active_player(opsdroid, message.room)
+            user = auth.user
 
-        _LOGGER.debug("Matching user to active player")
-        _LOGGER.debug(f"Active player: {active_player}; User: {user} (GM: {gm})")
+            _LOGGER.debug("Matching user to active player")
+            _LOGGER.debug(f"Active player: {active_player}; User: {user} (GM: {auth.gm})")
 
-        if user in [active_player, gm]:
+        if auth.is_gm or user == active_player:
             return await func(opsdroid, config, message)
         else:
+            metrics.inc('rpgchar_auth_denied_total', check='active_player',
+                        handler=func.__name__)
             return await message.respond(f"You wait your damn turn, {user}!")
 
     return matcher
@@ -0,0 +1,161 @@
+"""
+Counters and latency histograms for the skill's hot paths.
+
+Everything is recorded in the shared `metrics` registry, which can be dumped as JSON or in the
+Prometheus text format (see the ``!stats`` command).
+"""
+import json
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['Histogram', 'Metrics', 'InstrumentedMessage', 'metrics', 'payload_size']
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def payload_size(data):
+    """Return the approximate size in bytes of `data` once serialised."""
+    if data is None:
+        return 0
+    if isinstance(data, (str, bytes)):
+        return len(data)
+    try:
+        return len(json.dumps(data, separators=(',', ':'), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Histogram:
+    """
+    Counts of observations falling into each of a fixed set of buckets.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate the `q` quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class Metrics:
+    """
+    A registry of labelled counters and histograms, e.g.
+    ``metrics.inc('rpgchar_memory_calls_total', op='get')``.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Record how long the body of the `with` statement takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def to_json(self):
+        """Return every metric as a JSON-serialisable dict."""
+        return {
+            'counters': {name: [dict(labels, value=value) for labels, value in series.items()]
+                         for name, series in self.counters.items()},
+            'histograms': {name: [dict(labels, **histogram.to_dict())
+                                  for labels, histogram in series.items()]
+                           for name, series in self.histograms.items()},
+        }
+
+    def to_prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in series.items():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, n in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class InstrumentedMessage:
+    """
+    Wraps a message, counting the responses sent through it.
+    """
+    def __init__(self, message, handler):
+        self.message = message
+        self.handler = handler
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    async def respond(self, text, room=None):
+        metrics.inc('rpgchar_responses_total', handler=self.handler)
+        metrics.inc('rpgchar_response_bytes_total', payload_size(str(text)), handler=self.handler)
+        with metrics.timer('rpgchar_send_seconds'):
+            if room is None:
+                return await self.message.respond(text)
+            return await self.message.respond(text, room=room)
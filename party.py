@@ -0,0 +1,219 @@
+"""
+Operations applied to many characters in a room at once, e.g. a long rest or an XP award.
+
+An operation is a function which changes one character's stored stats in place and returns what
+should be reported about them, if anything. `update_party` applies it to every selected
+character with one read of the roster and one write back to it, which is journalled as a single
+entry, so a party-wide command costs the same number of database calls however big the party.
+Each command reports its results in one message.
+"""
+import re
+import logging
+
+from .dice import compile_dice, DiceError
+from .rng import room_rng
+from .locks import room_lock
+from .dispatch import route
+from .matchers import match_gm
+from .characters import level_for_xp, get_character, get_players
+from .constants.regex_constants import *
+from .picard import get_many, put_many, delete_chars
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['update_party', 'restore_hp', 'grant_xp', 'take_damage', 'add_condition',
+           'remove_condition']
+
+PARTY = ('everyone', 'you all', 'the party', 'the group')
+TARGETS = rf"(?P<targets>{'|'.join(PARTY)}|\w+((, ?| and )\w+)*)"
+
+
+async def update_party(opsdroid, room, operation, names=None, where=None, reason='update'):
+    """
+    Apply `operation` to characters in `room`, with one read of the roster and one write.
+
+    `names` picks out characters (everyone in the room by default) and `where(stats)` filters
+    them further. Returns {name: result} for every character the operation was applied to.
+    """
+    async with room_lock(room, 'chars'):
+        chars = await get_many(opsdroid, room, names)
+        if where is not None:
+            chars = {name: stats for name, stats in chars.items() if where(stats)}
+        _LOGGER.debug(f"Applying a {reason} to {len(chars)} characters in {room}")
+        results = {name: operation(stats) for name, stats in chars.items()}
+        await put_many(opsdroid, room, chars, reason=reason)
+    return results
+
+
+def restore_hp(stats):
+    """Bring a character back to full health, as after a long rest."""
+    stats['current_hp'] = stats['max_hp']
+    stats['unconscious'] = False
+    stats['death_saves'] = {'success': 0, 'fail': 0}
+
+
+def grant_xp(nXP):
+    """Return an operation giving `nXP` experience points, which returns any new level."""
+    def operation(stats):
+        stats['XP'] = stats.get('XP', 0) + nXP
+        level = level_for_xp(stats['XP'])
+        if level > stats['level']:
+            stats['level'] = level
+            return level
+
+    return operation
+
+
+def take_damage(ndamage):
+    """Return an operation dealing `ndamage` damage, which returns the remaining hit points."""
+    def operation(stats):
+        # Characters fresh from a template don't have current_hp until they're hurt
+        current_hp = stats.get('current_hp')
+        if current_hp is None:
+            current_hp = stats['max_hp']
+        stats['current_hp'] = current_hp - ndamage
+        return stats['current_hp']
+
+    return operation
+
+
+def add_condition(condition):
+    """Return an operation adding `condition`, which returns whether it was new."""
+    def operation(stats):
+        conditions = stats.setdefault('conditions', [])
+        if condition not in conditions:
+            conditions.append(condition)
+            return True
+        return False
+
+    return operation
+
+
+def remove_condition(condition):
+    """Return an operation removing `condition`, which returns whether it was there."""
+    def operation(stats):
+        conditions = stats.get('conditions') or []
+        if condition in conditions:
+            stats['conditions'] = [c for c in conditions if c != condition]
+            return True
+        return False
+
+    return operation
+
+
+def target_names(targets):
+    """Return the names in e.g. 'Thorin, Balin and Dwalin', or None for the whole party."""
+    if targets.lower() in PARTY:
+        return None
+    return re.split(r', ?| and ', targets)
+
+
+def describe(names, everyone=False):
+    """Return e.g. 'Thorin, Balin and Dwalin'."""
+    if everyone:
+        return 'Everyone'
+    names = list(names)
+    if len(names) > 1:
+        return f"{', '.join(names[:-1])} and {names[-1]}"
+    return names[0]
+
+
+def plural(names, everyone=False):
+    """Return the 's' on the end of a verb agreeing with `describe(names, everyone)`."""
+    return 's' if everyone or len(names) == 1 else ''
+
+
+async def load_configured(opsdroid, config, message, names):
+    """Load any of `names` which are in the campaign config but not yet in the room's roster."""
+    if names is None:
+        return
+    found = await get_many(opsdroid, message.room, names)
+    players = await get_players(opsdroid, config, message.room)
+    for name in names:
+        if name not in found and name in players:
+            await get_character(name, opsdroid, config, message)
+
+
+def missing(names, found):
+    if names is None:
+        return []
+    return [f"There's no {name} here." for name in names if name not in found]
+
+
+@route(rf'{TARGETS} {GAIN_VERB} (?P<nXP>\d+) XP', case_sensitive=False, keywords=GAIN_VERBS)
+@match_gm
+async def parse_xp(opsdroid, config, message):
+    """Grant XP to some characters or the whole party, announcing anyone who levels up."""
+    match = message.regex.group
+    names = target_names(match('targets'))
+    nXP = int(match('nXP'))
+
+    await load_configured(opsdroid, config, message, names)
+    levels = await update_party(opsdroid, message.room, grant_xp(nXP), names, reason='xp')
+    if not levels:
+        return await message.respond('\n'.join(missing(names, levels)) or "There's no one here.")
+    report = [f"{describe(levels, names is None)} gain{plural(levels, names is None)} "
+              f"{nXP} XP."]
+    report += [f"{name}, you have reached level {level}! Hooray!"
+               for name, level in levels.items() if level]
+    await message.respond('\n'.join(report + missing(names, levels)))
+
+
+@route(rf'!damage {TARGETS} (?P<dice>[\dd+\- ]+)$', case_sensitive=False)
+@match_gm
+async def area_damage(opsdroid, config, message):
+    """
+    Deal the same damage to several characters at once, e.g. ``!damage goblin1, goblin2 8d6``.
+
+    The damage is rolled once, as for a fireball.
+    """
+    # Here because it's a circular import otherwise
+    from .initiative import remove_many_from_initiative
+
+    match = message.regex.group
+    room = message.room
+    names = target_names(match('targets'))
+    try:
+        damage = compile_dice(match('dice').strip()).roll(rng=room_rng(room))
+    except DiceError as error:
+        return await message.respond(f"I can't roll {match('dice')}: {error}")
+
+    async with room_lock(room, 'active_player', 'chars', 'initiatives'):
+        hp = await update_party(opsdroid, room, take_damage(damage.total), names,
+                                reason='damage')
+        dead = [name for name, current_hp in hp.items() if current_hp < 0]
+        if dead:
+            await delete_chars(opsdroid, room, dead)
+            await remove_many_from_initiative(dead, opsdroid, room)
+
+    if not hp:
+        return await message.respond('\n'.join(missing(names, hp)) or "There's no one here.")
+    rolls = f" ({', '.join(str(die) for die in damage.dice)})" if damage.dice else ''
+    report = [f"{describe(hp, names is None)} take{plural(hp, names is None)} "
+              f"{damage.total} damage!{rolls}"]
+    report += [f"{name} died!" for name in dead]
+    await message.respond('\n'.join(report + missing(names, hp)))
+
+
+@route(rf'!condition {TARGETS} (?P<sign>[+-])(?P<condition>\w+)', case_sensitive=False)
+@match_gm
+async def set_condition(opsdroid, config, message):
+    """Add (``+prone``) or remove (``-prone``) a condition on several characters at once."""
+    match = message.regex.group
+    names = target_names(match('targets'))
+    condition = match('condition').lower()
+    adding = match('sign') == '+'
+    operation = add_condition(condition) if adding else remove_condition(condition)
+
+    changed = await update_party(opsdroid, message.room, operation, names, reason='condition')
+    if not changed:
+        return await message.respond('\n'.join(missing(names, changed)) or "There's no one here.")
+    affected = [name for name, result in changed.items() if result]
+    if affected:
+        state = 'now' if adding else 'no longer'
+        everyone = names is None and len(affected) == len(changed)
+        verb = 'is' if plural(affected, everyone) else 'are'
+        report = [f"{describe(affected, everyone)} {verb} {state} {condition}."]
+    else:
+        report = ["Nothing changed."]
+    await message.respond('\n'.join(report + missing(names, changed)))
@@ -1,12 +1,33 @@
+import time
+import asyncio
+import hashlib
 import logging
-from contextlib import contextmanager
+from copy import deepcopy
+from collections import OrderedDict
 
 import aiohttp
 from matrix_client.errors import MatrixRequestError
 
+from .util import RoomMemory
+from .journal import journal
+from .metrics import metrics
+
 _LOGGER = logging.getLogger(__name__)
 
 
+def get_skill_config(opsdroid, name='rpgchar'):
+    """
+    Return this skill's section of the opsdroid configuration.
+    """
+    skills = opsdroid.config.get('skills', [])
+    if isinstance(skills, dict):
+        return skills.get(name, {}) or {}
+    for skill in skills:
+        if skill.get('name') == name:
+            return skill
+    return {}
+
+
 def get_matrix_connector(opsdroid):
     """
     Return the first configured matrix connector.
@@ -16,24 +37,68 @@ def get_matrix_connector(opsdroid):
             return conn
 
 
+class TTLCache:
+    """
+    A dict whose entries expire `ttl` seconds after they were set.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+
+    def get(self, key, default=None):
+        value, expires = self._data.get(key, (default, 0))
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, (default, 0))[0]
+
+    def clear(self):
+        self._data.clear()
+
+
+# Homeserver lookups, which rarely change but are made several times per command
+_room_ids = TTLCache(ttl=600)
+_joined_rooms = TTLCache(ttl=60)
+
+
 async def room_id_if_exists(api, room_alias):
     """
     Returns the room id if the room exists or `None` if it doesn't.
     """
     if room_alias.startswith('!'):
         return room_alias
+    room_id = _room_ids.get(room_alias)
+    if room_id is not None:
+        return room_id
     try:
         room_id = await api.get_room_id(room_alias)
-        return room_id
     except MatrixRequestError as e:
         if e.code != 404:
             raise e
         return None
+    _room_ids[room_alias] = room_id
+    return room_id
 
 
 async def joined_rooms(api):
-    respjson = await api._send("GET", "/joined_rooms")
-    return respjson['joined_rooms']
+    rooms = _joined_rooms.get('rooms')
+    if rooms is None:
+        respjson = await api._send("GET", "/joined_rooms")
+        rooms = _joined_rooms['rooms'] = set(respjson['joined_rooms'])
+    return rooms
+
+
+def room_joined(room_id):
+    """Record that we've joined a room, so the cached joined rooms stay accurate."""
+    rooms = _joined_rooms.get('rooms')
+    if rooms is not None:
+        rooms.add(room_id)
 
 
 async def is_in_matrix_room(api, room_id):
@@ -57,12 +122,17 @@ async def intent_self_in_room(opsdroid, room):
             room_id = respjson['room_id']
         except MatrixRequestError:
             room_id = await connector.connection.get_room_id(room)
+        _room_ids[room] = room_id
         respjson = await connector.connection.join_room(room_id)
+        room_joined(room_id)
     else:
-        is_in_room = is_in_matrix_room(connector.connection, room_id)
+        is_in_room = await is_in_matrix_room(connector.connection, room_id)
 
         if not is_in_room:
             respjson = await connector.connection.join_room(room_id)
+            room_joined(room_id)
+
+    room_index.learn(room, room_id)
 
     return room_id
 
@@ -172,30 +242,78 @@ async def room_notifications_pl0(power_levels, room_alias):
     return power_levels
 
 
-async def configure_room_power_levels(opsdroid, config, room_alias):
+def _semaphore(limit):
+    return limit if isinstance(limit, asyncio.Semaphore) else asyncio.Semaphore(limit)
+
+
+async def gather_bounded(coros, limit=8):
+    """
+    Run `coros` concurrently, but with no more than `limit` of them in flight at once.
+
+    `limit` may be an `asyncio.Semaphore`, to share one bound between several calls.
+    """
+    semaphore = _semaphore(limit)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[bounded(coro) for coro in coros])
+
+
+async def configure_room_power_levels(opsdroid, config, room_alias, concurrency=8):
     """
     Do all the power level related stuff.
+
+    At most `concurrency` requests are made at once; pass a semaphore to share the bound with
+    other rooms being configured at the same time.
     """
+    semaphore = _semaphore(concurrency)
     connector = get_matrix_connector(opsdroid)
-    room_id = await room_id_if_exists(connector.connection, room_alias)
+    async with semaphore:
+        room_id = await room_id_if_exists(connector.connection, room_alias)
 
     # Get the users to be made admin in the matrix room
     users_as_admin = config.get("users_as_admin", [])
 
-    power_levels = await get_power_levels(opsdroid, room_id)
+    async with semaphore:
+        power_levels = await connector.connection.get_power_levels(room_id)
 
     # Add admin users
+    await gather_bounded([intent_user_in_room(opsdroid, user, room_id) for user in users_as_admin],
+                         semaphore)
     for user in users_as_admin:
-        await intent_user_in_room(opsdroid, user, room_id)
         power_levels = await user_is_room_admin(power_levels, room_id, user)
 
     room_pl_0 = config.get("room_pl_0", False)
     if room_pl_0:
         power_levels = await room_notifications_pl0(power_levels, room_id)
 
-    # Only actually modify room state if we need to
+    # Only actually modify room state if we need to, and then in a single state event
     if users_as_admin or room_pl_0:
-        await set_power_levels(opsdroid, room_id, power_levels)
+        async with semaphore:
+            await connector.connection.set_power_levels(room_id, power_levels)
+
+
+async def provision_rooms(opsdroid, config, rooms, concurrency=8):
+    """
+    Make sure we're in each of `rooms` and that their power levels are configured.
+
+    Rooms are set up concurrently, at most `concurrency` requests at a time. Returns the
+    room ids, in the same order as `rooms`.
+    """
+    connector = get_matrix_connector(opsdroid)
+
+    # Fetch the joined rooms once up front rather than once per room
+    await joined_rooms(connector.connection)
+    # One bound on the requests in flight, shared by every room. The rooms themselves aren't
+    # bounded, as a room holding a slot while its requests wait for one could deadlock.
+    semaphore = asyncio.Semaphore(concurrency)
+    room_ids = await gather_bounded([intent_self_in_room(opsdroid, room) for room in rooms],
+                                    semaphore)
+    await asyncio.gather(*[configure_room_power_levels(opsdroid, config, room_id, semaphore)
+                           for room_id in room_ids])
+    return room_ids
 
 
 """
@@ -203,17 +321,93 @@ Helpers for room avatar
 """
 
 
-async def upload_image_to_matrix(self, image_url):
+class HTTPClient:
     """
-    Given a URL upload the image to the homeserver for the given user.
+    A connection-pooled aiohttp session shared by everything the skill fetches.
+
+    `setup` starts `run` as a task, which opens the session on the running loop and holds it
+    open until the skill's `teardown` closes it or the task is cancelled.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.request("GET", image_url) as resp:
-            data = await resp.read()
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self._session = None
+        self._closing = None
+
+    def configure(self, pool_size=None):
+        if pool_size is not None:
+            self.pool_size = pool_size
+
+    def open(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @property
+    def session(self):
+        # Only opened here if something fetches before `run` has started, e.g. in a test
+        return self.open()
+
+    async def run(self):
+        """Hold the session open until `close` is called or the task is cancelled."""
+        self.open()
+        # Held here rather than only in this frame, so the waiting task can't be collected
+        self._closing = asyncio.Event()
+        try:
+            await self._closing.wait()
+        finally:
+            self._closing = None
+            await self.close()
 
-    respjson = await self.api.media_upload(data, resp.content_type)
+    async def close(self):
+        if self._closing is not None:
+            self._closing.set()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
-    return respjson['content_uri']
+
+http_client = HTTPClient()
+
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+# Already uploaded images, by URL and by the SHA-256 of their content
+_uploaded_urls = {}
+_uploaded_hashes = {}
+
+
+async def upload_image_to_matrix(opsdroid, image_url, max_size=MAX_IMAGE_SIZE):
+    """
+    Given a URL upload the image to the homeserver for the given user.
+
+    The image is downloaded in chunks and abandoned if it's bigger than `max_size` bytes.
+    Images we've uploaded before, whether from the same URL or with identical content, are
+    not uploaded again.
+    """
+    if image_url in _uploaded_urls:
+        return _uploaded_urls[image_url]
+
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    async with http_client.session.get(image_url) as resp:
+        resp.raise_for_status()
+        content_type = resp.content_type
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(f"Image at {image_url} is larger than {max_size} bytes")
+            digest.update(chunk)
+            chunks.append(chunk)
+
+    content_uri = _uploaded_hashes.get(digest.hexdigest())
+    if content_uri is None:
+        connector = get_matrix_connector(opsdroid)
+        respjson = await connector.connection.media_upload(b''.join(chunks), content_type)
+        content_uri = _uploaded_hashes[digest.hexdigest()] = respjson['content_uri']
+    _uploaded_urls[image_url] = content_uri
+
+    return content_uri
 
 
 async def set_room_avatar(opsdroid, room_id, avatar_url):
@@ -223,7 +417,7 @@ async def set_room_avatar(opsdroid, room_id, avatar_url):
     connector = get_matrix_connector(opsdroid)
 
     if not avatar_url.startswith("mxc"):
-        avatar_url = await upload_image_to_matrix(avatar_url)
+        avatar_url = await upload_image_to_matrix(opsdroid, avatar_url)
 
     # Set state event
     content = {
@@ -235,42 +429,432 @@ async def set_room_avatar(opsdroid, room_id, avatar_url):
                                                        content)
 
 
+# Each character is stored under its own key, with an index of the names in the room
+CHAR_KEY = 'char/{}'
+INDEX_KEY = 'chars_index'
+
+
+class RosterCache:
+    """
+    In-process write-back cache of the characters in each room.
+
+    Characters are read from the database one record at a time as they're needed, and then
+    served from memory. Writes update the cached copy and mark the affected characters as
+    dirty; they only reach the opsdroid database when the room is flushed, either by the
+    periodic flusher, at the end of a turn or when the room is evicted for being the least
+    recently used. A flush writes only the records which changed, plus the name index if
+    characters were added or removed.
+
+    Every change is also appended to the room's journal as it happens, and a flush snapshots
+    the journal. Changes which were journalled but never flushed are replayed when the room
+    is next read into the cache.
+    """
+    def __init__(self, max_rooms=64, flush_interval=30):
+        self.max_rooms = max_rooms
+        self.flush_interval = flush_interval
+        self._rooms = OrderedDict()
+        self._loading = {}
+
+    def configure(self, max_rooms=None, flush_interval=None):
+        if max_rooms is not None:
+            self.max_rooms = max_rooms
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+
+    def __contains__(self, room):
+        return room in self._rooms
+
+    def clear(self):
+        """Drop every room, and the cached active players, without writing anything back."""
+        for room in self._rooms:
+            journal.forget(room)
+        self._rooms.clear()
+        forget_active_player()
+
+    async def _entry(self, opsdroid, room):
+        """Return the cache entry for `room`, reading its name index if it isn't cached."""
+        entry = self._rooms.get(room)
+        if entry is not None:
+            self._rooms.move_to_end(room)
+            return entry
+
+        # Everyone reading the room at once waits for the same load, so the journal is
+        # replayed into the one entry which ends up cached
+        future = self._loading.get(room)
+        if future is None:
+            future = self._loading[room] = asyncio.ensure_future(self._load(opsdroid, room))
+            future.add_done_callback(lambda _: self._loading.pop(room, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, opsdroid, room):
+        """Read a room into the cache, replaying any journalled changes which weren't flushed."""
+        memory = room_memory(opsdroid)[room]
+        entry = {'chars': {}, 'names': set(), 'dirty': set(), 'removed': set(),
+                 'index_dirty': False}
+        index = await memory.get(INDEX_KEY)
+        if index is not None:
+            entry['names'] = set(index['names'])
+        else:
+            # Rooms from before characters had their own keys store them all under 'chars'
+            legacy = await memory.get('chars')
+            if legacy:
+                _LOGGER.info(f"Migrating {len(legacy)} characters in {room} to per-character keys")
+                entry['chars'] = deepcopy(legacy)
+                entry['names'] = set(legacy)
+                entry['dirty'] = set(legacy)
+                entry['index_dirty'] = True
+        if room not in journal:
+            await self._replay(memory, entry, await journal.recover(memory, room))
+
+        self._rooms[room] = entry
+        await self.evict(opsdroid)
+        return entry
+
+    @staticmethod
+    async def _replay(memory, entry, records):
+        """Apply journalled changes which hadn't been flushed to a new cache entry."""
+        # Changes to several characters at once are journalled together under 'records'
+        changes = [(record['op'], change)
+                   for record in records for change in record.get('records', [record])]
+        for op, record in changes:
+            name = record.get('name')
+            if op == 'delete':
+                entry['names'].discard(name)
+                entry['chars'].pop(name, None)
+                entry['dirty'].discard(name)
+                entry['removed'].add(name)
+                entry['index_dirty'] = True
+            elif 'changes' in record:
+                if record.get('replace'):
+                    entry['chars'][name] = deepcopy(record['changes'])
+                else:
+                    if name not in entry['chars']:
+                        entry['chars'][name] = await memory.get(CHAR_KEY.format(name)) or {}
+                    entry['chars'][name].update(deepcopy(record['changes']))
+                entry['dirty'].add(name)
+                entry['removed'].discard(name)
+                if name not in entry['names']:
+                    entry['names'].add(name)
+                    entry['index_dirty'] = True
+
+    async def _compact(self, opsdroid, room):
+        """Snapshot the room's journal before it runs out of space."""
+        if journal.full(room):
+            await self.flush(opsdroid, room)
+
+    async def names(self, opsdroid, room):
+        """Return the names of every character in `room`."""
+        entry = await self._entry(opsdroid, room)
+        return set(entry['names'])
+
+    async def get_many(self, opsdroid, room, names=None):
+        """
+        Return copies of the named characters in `room` (all of them if `names` is None).
+
+        Characters which aren't cached are read concurrently; unknown names are skipped.
+        """
+        entry = await self._entry(opsdroid, room)
+        if names is None:
+            names = sorted(entry['names'])
+        else:
+            names = [name for name in names if name in entry['names']]
+        missing = [name for name in names if name not in entry['chars']]
+        if missing:
+            memory = room_memory(opsdroid)[room]
+            records = await asyncio.gather(*[memory.get(CHAR_KEY.format(name))
+                                             for name in missing])
+            for name, record in zip(missing, records):
+                # Don't clobber anything written while we were reading
+                if record and name not in entry['chars']:
+                    entry['chars'][name] = record
+        return {name: deepcopy(entry['chars'][name]) for name in names if name in entry['chars']}
+
+    async def put_many(self, opsdroid, room, chars, reason='update'):
+        """
+        Add or update characters in `room`, marking and journalling any which changed.
+
+        `reason` names the event in the journal, e.g. 'damage' or 'heal'.
+        """
+        entry = await self._entry(opsdroid, room)
+        records = []
+        for name, stats in chars.items():
+            old = entry['chars'].get(name)
+            if old != stats:
+                if old is None or set(old) - set(stats):
+                    records.append({'name': name, 'changes': deepcopy(stats), 'replace': True})
+                else:
+                    records.append({'name': name, 'changes': {
+                        key: deepcopy(value) for key, value in stats.items()
+                        if old.get(key) != value}})
+                entry['chars'][name] = deepcopy(stats)
+                entry['dirty'].add(name)
+            if name not in entry['names']:
+                entry['names'].add(name)
+                entry['index_dirty'] = True
+            entry['removed'].discard(name)
+
+        await self._journal(opsdroid, room, reason, records)
+        await self._compact(opsdroid, room)
+
+    async def delete(self, opsdroid, room, names):
+        """Remove characters from `room`."""
+        entry = await self._entry(opsdroid, room)
+        removed = [name for name in names if name in entry['names']]
+        for name in removed:
+            entry['names'].discard(name)
+            entry['chars'].pop(name, None)
+            entry['dirty'].discard(name)
+            entry['removed'].add(name)
+            entry['index_dirty'] = True
+
+        await self._journal(opsdroid, room, 'delete', [{'name': name} for name in removed])
+        await self._compact(opsdroid, room)
+
+    @staticmethod
+    async def _journal(opsdroid, room, op, records):
+        """Journal changes to several characters as a single entry, however many there are."""
+        if not records:
+            return
+        memory = room_memory(opsdroid)[room]
+        if len(records) == 1:
+            await journal.append(memory, room, op, **records[0])
+        else:
+            await journal.append(memory, room, op, records=records)
+
+    async def record(self, opsdroid, room, op, **data):
+        """
+        Journal an event which doesn't change any characters, e.g. a scene change.
+        """
+        await self._entry(opsdroid, room)
+        await journal.append(room_memory(opsdroid)[room], room, op, **data)
+        await self._compact(opsdroid, room)
+
+    def is_dirty(self, room):
+        entry = self._rooms.get(room)
+        return bool(entry and (entry['dirty'] or entry['removed'] or entry['index_dirty']))
+
+    async def flush(self, opsdroid, room):
+        """
+        Write the characters in `room` which changed back to the database and snapshot the
+        room's journal.
+        """
+        memory = room_memory(opsdroid)[room]
+        if not self.is_dirty(room):
+            await journal.snapshot(memory, room)
+            return
+        entry = self._rooms[room]
+        # Anything journalled while we're writing will be flushed next time, not now
+        seq = journal.seq(room)
+        dirty, removed, index_dirty = entry['dirty'], entry['removed'], entry['index_dirty']
+        entry['dirty'], entry['removed'], entry['index_dirty'] = set(), set(), False
+        _LOGGER.debug(f"Flushing roster for {room}: {len(dirty)} changed, {len(removed)} removed")
+        try:
+            for name in dirty:
+                await memory.put(CHAR_KEY.format(name), deepcopy(entry['chars'][name]))
+            for name in removed:
+                await memory.put(CHAR_KEY.format(name), {})
+            if index_dirty:
+                await memory.put(INDEX_KEY, {'names': sorted(entry['names'])})
+        except Exception:
+            entry['dirty'] |= dirty
+            entry['removed'] |= removed
+            entry['index_dirty'] |= index_dirty
+            raise
+        await journal.snapshot(memory, room, seq)
+
+    async def flush_all(self, opsdroid):
+        for room in list(self._rooms):
+            await self.flush(opsdroid, room)
+
+    async def evict(self, opsdroid):
+        """Flush and drop the least recently used rooms until we're within `max_rooms`."""
+        while len(self._rooms) > self.max_rooms:
+            room = next(iter(self._rooms))
+            await self.flush(opsdroid, room)
+            self._rooms.pop(room, None)
+            journal.forget(room)
+            # A room quiet enough to be evicted needn't keep its turn cached either
+            forget_active_player(room)
+
+
+roster_cache = RosterCache()
+
+
+async def flush_rosters_periodically(opsdroid):
+    """Flush every dirty roster each `roster_cache.flush_interval` seconds."""
+    while True:
+        await asyncio.sleep(roster_cache.flush_interval)
+        try:
+            await roster_cache.flush_all(opsdroid)
+        except Exception:
+            _LOGGER.exception("Failed to flush cached rosters")
+
+
+async def get_char(opsdroid, room, name):
+    """Return the stored stats of one character in `room`, or None if there's no such character."""
+    return (await roster_cache.get_many(opsdroid, room, [name])).get(name)
+
+
+async def put_char(opsdroid, room, name, stats, reason='update'):
+    """Store the stats of one character in `room`."""
+    await roster_cache.put_many(opsdroid, room, {name: stats}, reason)
+
+
+async def get_many(opsdroid, room, names=None):
+    """Return {name: stats} for the named characters in `room`, or all of them."""
+    return await roster_cache.get_many(opsdroid, room, names)
+
+
+async def put_many(opsdroid, room, chars, reason='update'):
+    """Store several characters' stats in `room` at once."""
+    await roster_cache.put_many(opsdroid, room, chars, reason)
+
+
+async def delete_chars(opsdroid, room, names):
+    """Remove characters from `room`."""
+    await roster_cache.delete(opsdroid, room, names)
+
+
+async def record_event(opsdroid, room, op, **data):
+    """Journal an event, e.g. `record_event(opsdroid, room, 'scene', scene='tavern')`."""
+    await roster_cache.record(opsdroid, room, op, **data)
+
+
+async def char_names(opsdroid, room):
+    """Return the names of all the characters in `room`, without loading any of them."""
+    return await roster_cache.names(opsdroid, room)
+
+
+_room_memory = None
+
+
+def room_memory(opsdroid):
+    """
+    Return the `RoomMemory` for this opsdroid instance.
+    """
+    global _room_memory
+    if _room_memory is None or _room_memory.opsdroid is not opsdroid:
+        _room_memory = RoomMemory(opsdroid)
+    return _room_memory
+
+
 async def load_from_memory(opsdroid, room, key, default={}):
-    with memory_in_room(room, opsdroid):
-        data = await opsdroid.memory.get(key)
-        if not data:
-            data = default
+    metrics.inc('rpgchar_memory_requests_total', function='load_from_memory', key=key)
+    if key == 'chars':
+        return await get_many(opsdroid, room)
+    data = await room_memory(opsdroid)[room].get(key)
+    if not data:
+        data = deepcopy(default)
     return data
 
 
 async def save_new_to_memory(opsdroid, room, key, data):
-    with memory_in_room(room, opsdroid):
-        await opsdroid.memory.put(key, data)
+    metrics.inc('rpgchar_memory_requests_total', function='save_new_to_memory', key=key)
+    if key == 'chars':
+        await delete_chars(opsdroid, room, await char_names(opsdroid, room) - set(data))
+        await put_many(opsdroid, room, data)
+        return
+    await room_memory(opsdroid)[room].put(key, data)
 
 
 async def update_memory(opsdroid, room, key, data):
-    with memory_in_room(room, opsdroid):
-        olddata = await opsdroid.memory.get(key)
-        if olddata:
-            olddata.update(data)
-            data = olddata
-        await opsdroid.memory.put(key, data)
+    metrics.inc('rpgchar_memory_requests_total', function='update_memory', key=key)
+    if key == 'chars':
+        await put_many(opsdroid, room, data)
+        return
+    memory = room_memory(opsdroid)[room]
+    olddata = await memory.get(key)
+    if olddata:
+        olddata.update(data)
+        data = olddata
+    await memory.put(key, data)
+
+
+_active_players = {}
 
 
-@contextmanager
-def memory_in_room(room, opsdroid):
-    opsdroid.memory.databases[0].room = room
-    yield opsdroid
-    opsdroid.memory.databases[0].room = opsdroid.default_connector.default_room
+async def load_active_player(opsdroid, room):
+    """
+    Return the name of the character whose turn it is in `room`, or None.
+
+    The name is cached per room; it only changes through `save_active_player`.
+    """
+    if room in _active_players:
+        metrics.inc('rpgchar_cache_total', cache='active_player', result='hit')
+        return _active_players[room]
+    metrics.inc('rpgchar_cache_total', cache='active_player', result='miss')
+    name = (await load_from_memory(opsdroid, room, 'active_player')).get('name')
+    # Don't overwrite a newer value saved while we were reading
+    return _active_players.setdefault(room, name)
+
+
+async def save_active_player(opsdroid, room, name):
+    """Store (and cache) whose turn it is in `room`."""
+    _active_players[room] = name
+    await save_new_to_memory(opsdroid, room, 'active_player', {'name': name})
+
+
+def forget_active_player(room=None):
+    """Drop the cached active player for `room`, or for every room."""
+    if room is None:
+        _active_players.clear()
+    else:
+        _active_players.pop(room, None)
+
+
+class RoomIndex:
+    """
+    Map between the room names used in the connector config, room aliases and room ids.
+    """
+    def __init__(self, miss_ttl=60):
+        self.names = {}
+        self.aliases = {}
+        self.ids = {}
+        # Rooms we've rebuilt the index for and still not found, e.g. unconfigured room ids
+        self._misses = TTLCache(ttl=miss_ttl)
+
+    def add(self, name, alias=None, room_id=None):
+        if alias:
+            self.aliases[name] = alias
+            self.names[alias] = name
+            self._misses.pop(alias)
+        if room_id:
+            self.ids[name] = room_id
+            self.names[room_id] = name
+            self._misses.pop(room_id)
+
+    def learn(self, alias, room_id):
+        """Record the id of an aliased room, if it's one of ours."""
+        name = self.names.get(alias)
+        if name is not None:
+            self.add(name, room_id=room_id)
+
+    def build(self, connector):
+        """(Re)build the index from the connector's configured and joined rooms."""
+        self.names, self.aliases, self.ids = {}, {}, {}
+        self._misses.clear()
+        room_ids = getattr(connector, 'room_ids', {})
+        for name, alias in connector.rooms.items():
+            self.add(name, alias, room_ids.get(name))
+
+    def name_of(self, opsdroid, room):
+        """Return the config name of the room with the given alias or id, or None."""
+        name = self.names.get(room)
+        if name is None and not self._misses.get(room):
+            # The connector may have joined (or been configured with) rooms since we last looked,
+            # but a room which still isn't there isn't looked for again for a while
+            self.build(opsdroid.default_connector)
+            name = self.names.get(room)
+            if name is None:
+                self._misses[room] = True
+        return name
+
+
+room_index = RoomIndex()
 
 
 def get_roomname(opsdroid, room):
     if room[0] == '#' or room[0] == '!':
-        conn = opsdroid.default_connector
-        for connroom in conn.rooms:
-            if room == connroom or room == conn.room_ids[connroom]:
-                roomname = connroom
-                break
-        return roomname
+        return room_index.name_of(opsdroid, room) or room
 
     return room
@@ -0,0 +1,86 @@
+"""
+Coalescing of the responses a handler sends, so each room gets one message per command.
+"""
+import time
+import asyncio
+import logging
+from functools import wraps
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['BufferedMessage', 'buffer_responses', 'configure_responses']
+
+settings = {'max_size': 4000, 'deadline': 2.0}
+
+
+def configure_responses(max_size=None, deadline=None):
+    """Set the maximum size of a combined message and how long responses may be held."""
+    if max_size is not None:
+        settings['max_size'] = max_size
+    if deadline is not None:
+        settings['deadline'] = deadline
+
+
+class BufferedMessage:
+    """
+    Wraps a message, collecting the text passed to `respond` for each target room.
+
+    Collected responses are sent as a single message per room when `flush` is called, when
+    adding another response would exceed `max_size` characters, or `deadline` seconds after
+    the first response was collected. Every other attribute comes from the wrapped message.
+    """
+    def __init__(self, message, max_size=None, deadline=None):
+        self.message = message
+        self.max_size = max_size or settings['max_size']
+        self.deadline = deadline if deadline is not None else settings['deadline']
+        self._pending = {}
+        self._started = None
+        self._timer = None
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    async def respond(self, text, room=None):
+        text = str(text)
+        pending = self._pending.get(room, [])
+        size = sum(len(t) + 1 for t in pending)
+        if pending and size + len(text) > self.max_size:
+            await self._send(room, self._pending.pop(room))
+        self._pending.setdefault(room, []).append(text)
+
+        if self._started is None:
+            self._started = time.monotonic()
+            self._timer = asyncio.get_event_loop().call_later(
+                self.deadline, lambda: asyncio.ensure_future(self.flush()))
+        elif time.monotonic() - self._started >= self.deadline:
+            await self.flush()
+
+    async def _send(self, room, texts):
+        if room is None:
+            await self.message.respond('\n'.join(texts))
+        else:
+            await self.message.respond('\n'.join(texts), room=room)
+
+    async def flush(self):
+        """Send everything collected so far."""
+        if self._timer is not None:
+            self._timer.cancel()
+        pending, self._pending = self._pending, {}
+        self._started = self._timer = None
+        for room, texts in pending.items():
+            await self._send(room, texts)
+
+
+def buffer_responses(func):
+    """
+    Define decorator which sends all of a handler's responses to each room as one message.
+    """
+    @wraps(func)
+    async def buffered(opsdroid, config, message):
+        message = BufferedMessage(message)
+        try:
+            return await func(opsdroid, config, message)
+        finally:
+            await message.flush()
+
+    return buffered
@@ -0,0 +1,130 @@
+"""
+Per-room random number generation for dice rolls.
+
+Each room has its own seeded generator, so the rolls made in a room can be reproduced from its
+seed, and every seed used is kept in an audit log in case a roll is disputed. Dice are drawn
+from blocks generated in bulk for each die size.
+"""
+import time
+import random
+import hashlib
+import logging
+from collections import deque
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['RoomRNG', 'RNGService', 'rngs', 'room_rng']
+
+
+class RoomRNG:
+    """
+    A seeded source of dice rolls for one room.
+
+    Can be passed anywhere the `random` module is expected by the dice code, i.e. it provides
+    `choices` and `randint`.
+    """
+    def __init__(self, seed, block_size=1024):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed):
+        self.current_seed = seed
+        self._random = random.Random(seed)
+        self._blocks = {}
+        self.draws = {}
+
+    def _block(self, sides, n):
+        block = self._blocks.get(sides)
+        if block is None or len(block[0]) - block[1] < n:
+            rest = block[0][block[1]:] if block else []
+            size = max(self.block_size, n)
+            block = self._blocks[sides] = [
+                rest + self._random.choices(range(1, sides + 1), k=size), 0]
+        return block
+
+    def roll(self, sides):
+        """Roll a single die."""
+        block = self._block(sides, 1)
+        value = block[0][block[1]]
+        block[1] += 1
+        self.draws[sides] = self.draws.get(sides, 0) + 1
+        return value
+
+    def rolls(self, sides, n):
+        """Roll `n` dice with `sides` sides."""
+        block = self._block(sides, n)
+        start = block[1]
+        block[1] += n
+        self.draws[sides] = self.draws.get(sides, 0) + n
+        return block[0][start:start + n]
+
+    def randint(self, a, b):
+        if a == 1:
+            return self.roll(b)
+        return self._random.randint(a, b)
+
+    def choices(self, population, k=1):
+        if isinstance(population, range) and population.start == 1 and population.step == 1:
+            return self.rolls(population.stop - 1, k)
+        return self._random.choices(population, k=k)
+
+
+class RNGService:
+    """
+    Hands out a `RoomRNG` per room and records the seeds they use.
+
+    If `seed` is set, each room's seed is derived from it and the room name, so a whole session
+    can be replayed; otherwise rooms are seeded from the operating system.
+    """
+    def __init__(self, seed=None, block_size=1024, audit_size=1000):
+        self.base_seed = seed
+        self.block_size = block_size
+        self.audit = deque(maxlen=audit_size)
+        self._rooms = {}
+
+    def configure(self, seed=None, block_size=None):
+        if seed is not None:
+            self.base_seed = seed
+            self._rooms.clear()
+        if block_size is not None:
+            self.block_size = block_size
+
+    def _new_seed(self, room):
+        if self.base_seed is None:
+            return random.SystemRandom().getrandbits(64)
+        digest = hashlib.sha256(f'{self.base_seed}:{room}'.encode()).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def _log(self, room, seed, reason):
+        self.audit.append({'time': time.time(), 'room': room, 'seed': seed, 'reason': reason})
+        _LOGGER.info(f"Seeded dice for {room} with {seed} ({reason})")
+
+    def __getitem__(self, room):
+        rng = self._rooms.get(room)
+        if rng is None:
+            seed = self._new_seed(room)
+            rng = self._rooms[room] = RoomRNG(seed, self.block_size)
+            self._log(room, seed, 'new')
+        return rng
+
+    def seed(self, room, seed=None, reason='reseed'):
+        """Reseed the dice for `room`, with a fresh seed if none is given. Returns the seed."""
+        seed = self._new_seed(room) if seed is None else seed
+        if room in self._rooms:
+            self._rooms[room].seed(seed)
+        else:
+            self._rooms[room] = RoomRNG(seed, self.block_size)
+        self._log(room, seed, reason)
+        return seed
+
+    def history(self, room):
+        """Return the audit entries for `room`, oldest first."""
+        return [entry for entry in self.audit if entry['room'] == room]
+
+
+rngs = RNGService()
+
+
+def room_rng(room):
+    """Return the dice generator for `room`."""
+    return rngs[room]
@@ -2,18 +2,273 @@
 Docstring
 """
 
-import yaml
+import os
+import asyncio
 import logging
 from os.path import join
 
-from opsdroid.matchers import match_regex
-
+from .locks import room_lock
+from .dispatch import route
+from .responses import buffer_responses
+from .templates import templates, load_template_async, copy_template, campaign_path
 from .matchers import match_gm
 from .constants.regex_constants import *
-from .picard import load_from_memory, save_new_to_memory, update_memory, get_roomname
+from .picard import (load_from_memory, update_memory, get_roomname, put_many, record_event,
+                     room_memory)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SceneNode:
+    """
+    One scene file: where its exits lead, and the other files it needs.
+    """
+    __slots__ = ('file', 'name', 'exits', 'characters', 'loadfiles')
+
+    def __init__(self, file, name, exits, characters, loadfiles):
+        self.file = file
+        self.name = name
+        self.exits = exits
+        self.characters = characters
+        self.loadfiles = loadfiles
+
+    def __repr__(self):
+        return f"SceneNode({self.file!r}, exits={sorted(self.exits)})"
+
+
+class SceneGraph:
+    """
+    The scenes in a campaign folder and the exits between them, keyed by file name.
+
+    Built by parsing every scene in the folder once (through the template cache), so that
+    moving through an exit can be resolved without reading anything, and the scenes beyond
+    the exits can be read ahead of time.
+    """
+    def __init__(self, folder, characters_folder, nodes, stamps=None):
+        self.folder = folder
+        self.characters_folder = characters_folder
+        self.nodes = nodes
+        self.stamps = stamps or {}
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def build(cls, folder, characters_folder, cache=templates):
+        """Parse every scene in `folder`. This reads files, so run it in an executor."""
+        # Taken before reading, so a file changed while we read it is read again next time
+        stamps = {folder: cls._stamp(folder)}
+        nodes = {}
+        for fname in sorted(os.listdir(folder)):
+            if not fname.endswith(('.yaml', '.yml')):
+                continue
+            try:
+                stamps[join(folder, fname)] = cls._stamp(join(folder, fname))
+                scene = cache.get(join(folder, fname))
+            except Exception as e:
+                _LOGGER.warning(f"Couldn't read scene {fname} in {folder}: {e}")
+                continue
+            # Files holding just the dm_info loaded by other scenes aren't scenes themselves
+            if not isinstance(scene, dict) or 'name' not in scene:
+                continue
+            dm_info = scene.get('dm_info') or {}
+            loadfiles = [join(folder, dm_info['loadfile'])] if 'loadfile' in dm_info else []
+            exits = dict(dm_info.get('exits') or {})
+            for loadfile in loadfiles:
+                # The loaded file's dm_info takes precedence, as in load_scene
+                try:
+                    stamps.setdefault(loadfile, cls._stamp(loadfile))
+                    exits.update(cache.get(loadfile)['dm_info'].get('exits') or {})
+                except Exception:
+                    pass
+            characters = [join(characters_folder, info['loadfile'])
+                          for info in (scene.get('characters') or {}).values()
+                          if 'loadfile' in info]
+            nodes[fname] = SceneNode(fname, scene.get('name'), exits, characters, loadfiles)
+        return cls(folder, characters_folder, nodes, stamps)
+
+    def is_current(self):
+        """
+        Return whether no scene has been added, removed or changed since the graph was built.
+        This stats every file, so run it in an executor.
+        """
+        try:
+            return all(self._stamp(path) == stamp for path, stamp in self.stamps.items())
+        except OSError:
+            return False
+
+    def validate(self):
+        """
+        Return a description of every exit or file reference which leads nowhere. This checks
+        files exist, so run it in an executor.
+        """
+        problems = []
+        for node in self.nodes.values():
+            for exit_, target in sorted(node.exits.items()):
+                if target not in self.nodes:
+                    problems.append(f"{node.file}: exit '{exit_}' leads to missing scene {target}")
+            for path in node.characters + node.loadfiles:
+                if not os.path.isfile(path):
+                    problems.append(f"{node.file}: refers to missing file {path}")
+        return problems
+
+    def resolve(self, fname, exit_):
+        """Return the file which `exit_` from the scene in `fname` leads to, or None."""
+        node = self.nodes.get(fname)
+        return node.exits.get(exit_) if node else None
+
+    def neighbours(self, fname):
+        node = self.nodes.get(fname)
+        if node is None:
+            return []
+        return [self.nodes[target] for target in dict.fromkeys(node.exits.values())
+                if target in self.nodes]
+
+    def warm(self, fname, cache=templates):
+        """Start reading the scenes beyond the exits of `fname`, and everything they use."""
+        paths = []
+        for node in self.neighbours(fname):
+            paths += [join(self.folder, node.file)] + node.loadfiles + node.characters
+        cache.prefetch(dict.fromkeys(paths))
+
+
+_scene_graphs = {}
+
+
+async def _run_in_executor(func, *args):
+    """Run `func`, which touches the file system, in the template thread pool."""
+    return await asyncio.get_event_loop().run_in_executor(templates.executor, func, *args)
+
+
+async def scene_graph(opsdroid, campaign):
+    """
+    Return the `SceneGraph` for `campaign`, building it in the template thread pool if it
+    isn't cached or scenes have been added, removed or changed since.
+    """
+    folder = campaign_path(opsdroid, 'scenes', campaign)
+    graph = _scene_graphs.get(folder)
+    # Checking means a stat of every scene file, so that happens in the thread pool too
+    if graph is None or not await _run_in_executor(graph.is_current):
+        graph = await _run_in_executor(SceneGraph.build, folder,
+                                       campaign_path(opsdroid, 'characters'))
+        for problem in await _run_in_executor(graph.validate):
+            _LOGGER.warning(f"Campaign {campaign}: {problem}")
+        _scene_graphs[folder] = graph
+    return graph
+
+
+SCENE_INFO_KEY = 'scenes/{}'
+
+
+class SceneInfo:
+    """
+    The DM's information about one room's current scene, indexed by path.
+
+    Every nested key is indexed by its full path (e.g. ``'npcs/barkeep'``), so looking up a
+    path or listing what's under it doesn't walk the nested dicts.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.index = {}
+        self.children = {}
+        self._add('', data)
+
+    def _add(self, path, value):
+        self.index[path] = value
+        if isinstance(value, dict):
+            self.children[path] = list(value)
+            for key, child in value.items():
+                self._add(f'{path}/{key}' if path else str(key), child)
 
+    def _remove(self, path):
+        for child in self.children.pop(path, []):
+            self._remove(f'{path}/{child}' if path else str(child))
+        self.index.pop(path, None)
 
-@match_regex(f"!goto ((?P<filename>\d\d-\w+.yaml)|(?P<exit>\w+))( !usemem (?P<memroom>\w+))?")
+    def __contains__(self, path):
+        return path.strip('/') in self.index
+
+    def get(self, path=''):
+        """Return the value at `path`, raising KeyError if there's nothing there."""
+        return self.index[path.strip('/')]
+
+    def list(self, path=''):
+        """Return the keys directly under `path`."""
+        return list(self.children.get(path.strip('/'), []))
+
+    def set(self, path, value):
+        """
+        Set the value at `path`, creating any missing parents, and reindex that branch.
+
+        Raises KeyError if one of the parents is a value rather than a section, and ValueError
+        if `path` is empty (the whole of the information can't be replaced) or has an empty part.
+        """
+        parts = path.strip('/').split('/')
+        if not all(parts):
+            raise ValueError(f"'{path}' isn't a path in the scene information")
+        parent = ''
+        for part in parts[:-1]:
+            child = f'{parent}/{part}' if parent else part
+            if child not in self.index:
+                self.set(child, {})
+            elif not isinstance(self.index[child], dict):
+                raise KeyError(child)
+            parent = child
+        container = self.index[parent]
+        if not isinstance(container, dict):
+            raise KeyError(parent)
+        path = '/'.join(parts)
+        if parts[-1] not in container:
+            self.children[parent].append(parts[-1])
+        self._remove(path)
+        container[parts[-1]] = value
+        self._add(path, value)
+
+
+_scene_info = {}
+
+
+async def load_scene_info(opsdroid, roomname):
+    """
+    Return the `SceneInfo` for the room called `roomname`, or None if it has no scene yet.
+
+    Reads just that room's entry in the main room, falling back to the single 'scenes' entry
+    in which every room's information used to be kept.
+    """
+    info = _scene_info.get(roomname)
+    if info is not None:
+        return info
+    memory = room_memory(opsdroid)['main']
+    data = await memory.get(SCENE_INFO_KEY.format(roomname))
+    if not data:
+        data = (await memory.get('scenes') or {}).get(roomname)
+        if not data:
+            return None
+        await memory.put(SCENE_INFO_KEY.format(roomname), data)
+    return _scene_info.setdefault(roomname, SceneInfo(data))
+
+
+async def save_scene_info(opsdroid, roomname, info):
+    """Store the `SceneInfo` for the room called `roomname`."""
+    _scene_info[roomname] = info
+    await room_memory(opsdroid)['main'].put(SCENE_INFO_KEY.format(roomname), info.data)
+
+
+async def build_scene_graphs(opsdroid, config):
+    """Build the scene graph of every configured campaign, e.g. at startup."""
+    campaigns = {campaign['name'] for campaign in config.get('campaigns', {}).values()
+                 if 'name' in campaign}
+    for campaign in sorted(campaigns):
+        try:
+            await scene_graph(opsdroid, campaign)
+        except OSError as e:
+            _LOGGER.warning(f"Couldn't index the scenes for campaign {campaign}: {e}")
+
+
+@route(rf"!goto ((?P<filename>\d\d-\w+.yaml)|(?P<exit>\w+))( !usemem (?P<memroom>\w+))?")
+@buffer_responses
 @match_gm
 async def load_scene(opsdroid, config, message):
     """Load information about a scene or location from the specified file."""
@@ -23,85 +278,132 @@ async def load_scene(opsdroid, config, message):
     room = match('memroom')
     room = room if room else message.room
 
-    dm_scenes = await load_from_memory(opsdroid, 'main', 'scenes')
     roomname = get_roomname(opsdroid, room)
-    current_scene = dm_scenes.get(roomname, None)
-    if not fname:
-        fname = current_scene['exits'][newscene]
-    folder = join('scenes', config['campaigns'][roomname]['name'])
-    if opsdroid.config.get('module-path', None):
-        folder = join(opsdroid.config['module-path'], folder)
-    fname = join(folder, fname)
-    with open(fname) as f:
-        scene_info = yaml.safe_load(f)
-
-    # Check the scene against previously visited scenes and do things if it's new
-    previous_scenes = await load_from_memory(opsdroid, room, 'prev_scenes', {'scenes': []})
-    if scene_info['name'] not in previous_scenes['scenes']:
-        intro = scene_info['intro_text']
-        if isinstance(intro, dict):
-            await message.respond(intro['players'], room=roomname)
-            await message.respond(intro['dm'], room='main')
-        else:
-            await message.respond(intro, room=roomname)
-
-        if 'characters' in scene_info.keys():
-            # Load all the characters
-            chars = await load_from_memory(opsdroid, room, 'chars')
-            for charname, info in scene_info['characters'].items():
-                nchars = info['number'] if 'number' in info.keys() else 1
-                name = charname+'_' if nchars > 1 else charname
-                chardir = 'characters'
-                if opsdroid.config.get('module-path', None):
-                    chardir = join(opsdroid.config['module-path'], chardir)
-                loadfile = join(chardir, info['loadfile'])
-                for i in range(nchars):
-                    with open(loadfile) as f:
-                        charstats = yaml.safe_load(f)
-                    if nchars > 1:
-                        name = name[:-1]+str(i+1)
-                    charstats['name'] = name
-                    chars[name] = charstats
-            await update_memory(opsdroid, room, 'chars', chars)
-
-    # Store the defined info for the DM in the DM room
-    dm_info = scene_info['dm_info']
-    if 'loadfile' in dm_info.keys():
-        loadfile = join(folder, dm_info.pop('loadfile'))
-        with open(loadfile) as f:
-            loaded = yaml.safe_load(f)
-        dm_info.update(loaded['dm_info'])
-    # DM will likely be dealing with several scenes across adventures, so they'll need to be stored
-    # per-room
-    dm_scenes.update({roomname: dm_info})
-    await save_new_to_memory(opsdroid, 'main', 'scenes', dm_scenes)
-    previous_scenes['scenes'].append(scene_info['name'])
-    await update_memory(opsdroid, room, 'prev_scenes', previous_scenes)
-
-    # Reporting is useful
-    name = scene_info['name']
-    features = '\t\t'.join(dm_info.keys())
-    await message.respond(f"Moved to scene '{name}'\nFeatures of this scene:\n{features}",
-                          room='main')
-
-
-@match_regex(f"!info (?P<group>\w+)( (?P<key>\D+))?")
+    async with room_lock('main', SCENE_INFO_KEY.format(roomname)), \
+            room_lock(room, 'chars', 'prev_scenes'):
+        current_scene = await load_scene_info(opsdroid, roomname)
+        previous_scenes = await load_from_memory(opsdroid, room, 'prev_scenes', {'scenes': []})
+        graph = await scene_graph(opsdroid, config['campaigns'][roomname]['name'])
+        if not fname:
+            fname = graph.resolve(previous_scenes.get('current'), newscene)
+        if not fname and current_scene:
+            # Rooms which moved scene before the graph existed don't record the current file
+            fname = current_scene.index.get(f'exits/{newscene}')
+        if not fname:
+            return await message.respond(f"There's no exit called {newscene} here", room='main')
+        folder = graph.folder
+        scene_info = await load_template_async(join(folder, fname))
+
+        # Check the scene against previously visited scenes and do things if it's new
+        if scene_info['name'] not in previous_scenes['scenes']:
+            intro = scene_info['intro_text']
+            if isinstance(intro, dict):
+                await message.respond(intro['players'], room=roomname)
+                await message.respond(intro['dm'], room='main')
+            else:
+                await message.respond(intro, room=roomname)
+
+            if 'characters' in scene_info.keys():
+                # Read every character's template at once, each only once however many of
+                # that character there are
+                characters = scene_info['characters']
+                loaded = await asyncio.gather(*[
+                    templates.get_async(campaign_path(opsdroid, 'characters', info['loadfile']))
+                    for info in characters.values()])
+                chars = {}
+                for (charname, info), template in zip(characters.items(), loaded):
+                    nchars = info['number'] if 'number' in info.keys() else 1
+                    name = charname+'_' if nchars > 1 else charname
+                    for i in range(nchars):
+                        charstats = copy_template(template)
+                        if nchars > 1:
+                            name = name[:-1]+str(i+1)
+                        charstats['name'] = name
+                        chars[name] = charstats
+                await put_many(opsdroid, room, chars, reason='spawn')
+
+        # Store the defined info for the DM in the DM room
+        dm_info = scene_info['dm_info']
+        if 'loadfile' in dm_info.keys():
+            loaded = await templates.get_async(join(folder, dm_info.pop('loadfile')))
+            dm_info.update(copy_template(loaded['dm_info']))
+        # The party will probably go through one of the exits next
+        graph.warm(fname)
+        # DM will likely be dealing with several scenes across adventures, so they'll need to be
+        # stored per-room
+        await save_scene_info(opsdroid, roomname, SceneInfo(dm_info))
+        previous_scenes['scenes'].append(scene_info['name'])
+        previous_scenes['current'] = fname
+        await update_memory(opsdroid, room, 'prev_scenes', previous_scenes)
+        await record_event(opsdroid, room, 'scene', scene=scene_info['name'], file=fname)
+
+        # Reporting is useful
+        name = scene_info['name']
+        features = '\t\t'.join(dm_info.keys())
+        await message.respond(f"Moved to scene '{name}'\nFeatures of this scene:\n{features}",
+                              room='main')
+
+
+@route(r'!scenes( (?P<campaign>\w+))?', case_sensitive=False)
+@match_gm
+async def check_scenes(opsdroid, config, message):
+    """Report the exits and file references in a campaign's scenes which lead nowhere."""
+    campaign = message.regex.group('campaign')
+    if campaign:
+        campaigns = [campaign]
+    else:
+        campaigns = sorted({c['name'] for c in config.get('campaigns', {}).values() if 'name' in c})
+    for campaign in campaigns:
+        graph = await scene_graph(opsdroid, campaign)
+        problems = await _run_in_executor(graph.validate)
+        report = [f"Campaign {campaign}: {len(graph.nodes)} scenes, "
+                  f"{sum(len(node.exits) for node in graph.nodes.values())} exits"]
+        report += problems or ['No problems found']
+        await message.respond('\n'.join(report))
+
+
+@route(rf"!info (?P<group>\w+)( (?P<key>\D+))?")
+@buffer_responses
 @match_gm
 async def get_info(opsdroid, config, message):
     match = message.regex.group
     room = match('group')
     key = match('key')
-    info = await load_from_memory(opsdroid, 'main', 'scenes')
-    info = info[room]
+    scene = await load_scene_info(opsdroid, room)
+    if scene is None:
+        return await message.respond(f"There's no scene information for {room}")
 
-    if key:
-        keys = key.split('/')
-        for key in keys:
-            info = info[key]
+    path = key or ''
+    try:
+        info = scene.get(path)
+    except KeyError:
+        return await message.respond(f"There's nothing at {path} for {room}")
     if isinstance(info, dict):
-        info = '\t'.join(info.keys())
+        info = '\t'.join(scene.list(path))
     elif isinstance(info, list):
         info = info[0]
         await message.respond(f"{info['name']}")
         info = info['info']
     await message.respond(f"{info}")
+
+
+@route(rf"!setinfo (?P<group>\w+) (?P<key>\S+) (?P<value>.+)")
+@match_gm
+async def set_info(opsdroid, config, message):
+    """Change one piece of the DM's information about a room's scene."""
+    match = message.regex.group
+    room, path = match('group'), match('key')
+    async with room_lock('main', SCENE_INFO_KEY.format(room)):
+        scene = await load_scene_info(opsdroid, room)
+        if scene is None:
+            return await message.respond(f"There's no scene information for {room}")
+        try:
+            # Stored as typed, rather than parsed, so e.g. 'no' stays 'no' rather than False
+            scene.set(path, match('value'))
+        except KeyError as error:
+            section = error.args[0]
+            return await message.respond(f"{section} isn't a section of the scene information")
+        except ValueError as error:
+            return await message.respond(str(error))
+        await save_scene_info(opsdroid, room, scene)
+    await message.respond(f"Updated {path} for {room}")
@@ -0,0 +1,247 @@
+"""
+Caching of the YAML files which define characters and scenes.
+"""
+import os
+import pickle
+import asyncio
+import hashlib
+import logging
+from os.path import join, normpath
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from .metrics import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ['TemplateCache', 'templates', 'load_template', 'load_template_async', 'copy_template',
+           'campaign_path', 'parse_yaml', 'compile_templates', 'load_compiled_templates',
+           'prepare_templates']
+
+# libyaml is several times faster than the pure Python parser, but is optional
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+COMPILED_FILE = '.rpgchar-templates.pickle'
+COMPILED_VERSION = 1
+
+
+def campaign_path(opsdroid, *parts):
+    """
+    Return the path to a campaign file, relative to the module path if one is configured.
+    """
+    if opsdroid.config.get('module-path', None):
+        return join(opsdroid.config['module-path'], *parts)
+    return join(*parts)
+
+
+def parse_yaml(stream):
+    """Parse YAML safely, using libyaml if it is available."""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def copy_template(data):
+    """
+    Copy parsed YAML data.
+
+    Templates only ever contain dicts, lists and scalars, so this is considerably cheaper than
+    `copy.deepcopy`.
+    """
+    if isinstance(data, dict):
+        return {key: copy_template(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [copy_template(value) for value in data]
+    return data
+
+
+class TemplateCache:
+    """
+    Parse each YAML file once and hand out copies of the result.
+
+    A file is parsed again only when its modification time or size changes. The `_async`
+    methods do the file I/O and parsing in a thread pool, so a slow disk doesn't hold up the
+    event loop; concurrent requests for the same file share one read.
+    """
+    def __init__(self, workers=4):
+        self._templates = {}
+        self._pending = {}
+        self._executor = None
+        self.workers = workers
+        self.parses = 0
+
+    def configure(self, workers=None):
+        if workers is not None and workers != self.workers:
+            self.workers = workers
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='rpgchar-templates')
+        return self._executor
+
+    def _parse(self, path):
+        with metrics.timer('rpgchar_yaml_parse_seconds'), open(path) as f:
+            data = parse_yaml(f)
+        self.parses += 1
+        metrics.inc('rpgchar_yaml_parses_total')
+        _LOGGER.debug(f"Parsed template {path}")
+        return data
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path):
+        """Return the parsed template for `path`. The result must not be modified."""
+        path = normpath(path)
+        stamp = self._stamp(path)
+        cached = self._templates.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = self._templates[path] = (stamp, self._parse(path))
+        return cached[1]
+
+    def load(self, path):
+        """Return a fresh copy of the template for `path` which the caller may modify."""
+        return copy_template(self.get(path))
+
+    def _fetch(self, path):
+        """Return a future for the parsed template, reading it in the thread pool."""
+        path = normpath(path)
+        future = self._pending.get(path)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self._pending[path] = asyncio.ensure_future(
+                loop.run_in_executor(self.executor, self.get, path))
+            future.add_done_callback(lambda _: self._pending.pop(path, None))
+        return future
+
+    async def get_async(self, path):
+        """Like `get`, without blocking the event loop. The result must not be modified."""
+        return await asyncio.shield(self._fetch(path))
+
+    async def load_async(self, path):
+        """Like `load`, without blocking the event loop."""
+        return copy_template(await self.get_async(path))
+
+    def prefetch(self, paths):
+        """Start reading `paths` in the background, so they're cached when they're needed."""
+        for path in paths:
+            self._fetch(path).add_done_callback(_log_prefetch_error)
+
+    def invalidate(self, path=None):
+        if path is None:
+            self._templates.clear()
+        else:
+            self._templates.pop(normpath(path), None)
+
+    def entries(self):
+        return dict(self._templates)
+
+    def preload(self, entries):
+        """
+        Add previously parsed templates, skipping any whose file has changed since.
+
+        Returns the number of templates which were out of date.
+        """
+        stale = 0
+        for path, (stamp, data) in entries.items():
+            try:
+                current = self._stamp(path)
+            except OSError:
+                current = None
+            if current == stamp:
+                self._templates[path] = (stamp, data)
+            else:
+                stale += 1
+        return stale
+
+
+def _log_prefetch_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        _LOGGER.warning(f"Couldn't prefetch template: {future.exception()}")
+
+
+templates = TemplateCache()
+
+
+def load_template(path):
+    """Return a modifiable copy of the YAML data in `path`."""
+    return templates.load(path)
+
+
+async def load_template_async(path):
+    """Return a modifiable copy of the YAML data in `path`, read in the thread pool."""
+    return await templates.load_async(path)
+
+
+def _template_files(directory):
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.endswith(('.yaml', '.yml')):
+                yield normpath(join(dirpath, filename))
+
+
+def compile_templates(directories, outfile, cache=templates):
+    """
+    Parse every YAML file under `directories` and write them to `outfile` as one pickle.
+
+    The pickle is preceded by a line containing its SHA-256, which is checked on loading.
+    """
+    for directory in directories:
+        for path in _template_files(directory):
+            cache.get(path)
+    entries = {path: entry for path, entry in cache.entries().items()
+               if any(path.startswith(normpath(d) + os.sep) for d in directories)}
+    payload = pickle.dumps({'version': COMPILED_VERSION, 'templates': entries},
+                           protocol=pickle.HIGHEST_PROTOCOL)
+    with open(outfile, 'wb') as f:
+        f.write(hashlib.sha256(payload).hexdigest().encode() + b'\n')
+        f.write(payload)
+    _LOGGER.info(f"Compiled {len(entries)} templates into {outfile}")
+    return len(entries)
+
+
+def load_compiled_templates(infile, cache=templates):
+    """
+    Load templates written by `compile_templates` into `cache`.
+
+    Returns the number of stale templates, or None if the file is missing or invalid.
+    """
+    try:
+        with open(infile, 'rb') as f:
+            digest = f.readline().strip().decode()
+            payload = f.read()
+    except OSError:
+        return None
+    if hashlib.sha256(payload).hexdigest() != digest:
+        _LOGGER.warning(f"Ignoring corrupt compiled templates in {infile}")
+        return None
+    compiled = pickle.loads(payload)
+    if compiled.get('version') != COMPILED_VERSION:
+        return None
+    return cache.preload(compiled['templates'])
+
+
+def prepare_templates(opsdroid, config):
+    """
+    Load the compiled templates for the configured campaigns, recompiling them if needed.
+    """
+    campaigns = {campaign['name'] for campaign in config.get('campaigns', {}).values()
+                 if 'name' in campaign}
+    directories = [campaign_path(opsdroid, 'characters')]
+    directories += [campaign_path(opsdroid, 'scenes', name) for name in sorted(campaigns)]
+    directories = [d for d in directories if os.path.isdir(d)]
+    compiled = campaign_path(opsdroid, COMPILED_FILE)
+
+    stale = load_compiled_templates(compiled)
+    if stale == 0:
+        return
+    try:
+        compile_templates(directories, compiled)
+    except OSError as e:
+        _LOGGER.warning(f"Couldn't write compiled templates to {compiled}: {e}")
@@ -0,0 +1,31 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.harness import Harness, load_skill
+
+# Import the skill as the `rpgchar` package, as opsdroid does, so the tests can import its modules
+load_skill()
+
+
+@pytest.fixture
+def run_in_harness():
+    """
+    Return a function running `func(harness, room)` to completion in a fresh harness, where
+    `room` is its first room and already holds the characters `chars`.
+    """
+    def run(func, *chars, **options):
+        async def main():
+            async with Harness(**options) as harness:
+                room = harness.room(0)
+                if chars:
+                    await harness.add_characters(room, list(chars))
+                return await func(harness, room)
+
+        return asyncio.run(main())
+
+    return run
@@ -1,5 +1,18 @@
 import pytest
 
+from benchmarks.harness import character
+from rpgchar.characters import Character, level_for_xp
+
+
+def thorin(**changes):
+    return Character.from_dict(character('Thorin Oakenshield', **changes))
+
+
+@pytest.mark.parametrize('XP, level', [(0, 1), (299, 1), (300, 2), (1000, 3), (355000, 20),
+                                       (10 ** 6, 20)])
+def test_level_for_xp(XP, level):
+    assert level_for_xp(XP) == level
+
 
 class TestCharacter:
     def test_init(self):
@@ -20,6 +33,52 @@ class TestCharacter:
     def test_modifier(self):
         pass
 
+    def test_set_ability(self):
+        char = thorin()
+        assert char.modifier('Str') == 2
+        char.set_ability('Str', 9)
+        assert char.abilities['Str'] == 9 and char.modifier('Str') == -1
+        # The abilities can only be changed through set_ability
+        with pytest.raises(TypeError):
+            char.abilities['Str'] = 20
+
+    @pytest.mark.parametrize('level, proficiency', [(1, 2), (4, 2), (5, 3), (12, 4), (17, 6),
+                                                    (20, 6)])
+    def test_proficiency(self, level, proficiency):
+        char = thorin(level=level)
+        assert char.proficiency == proficiency
+        char.level = 9
+        assert char.proficiency == 4
+
+    def test_to_dict(self):
+        data = thorin(current_hp=7, conditions=['prone']).to_dict()
+        assert data['schema'] == Character.SCHEMA_VERSION
+        assert data['current_hp'] == 7 and data['conditions'] == ['prone']
+        assert data['abilities'] == character('Thorin')['abilities']
+        assert set(data) == set(Character.fields) | {'schema'}
+
+    @pytest.mark.parametrize('current_hp', [0, 7, -3])
+    def test_round_trip(self, current_hp):
+        char = thorin(max_hp=10, current_hp=current_hp)
+        again = Character.from_dict(char.to_dict())
+        assert again.current_hp == current_hp
+        assert again.to_dict() == char.to_dict()
+
+    def test_from_dict(self):
+        assert thorin(max_hp=10).current_hp == 10
+        assert thorin().shortname() == 'Thorin'
+        with pytest.raises(ValueError):
+            Character.from_dict(dict(thorin().to_dict(), schema=Character.SCHEMA_VERSION + 1))
+
+    def test_from_dict_v1(self):
+        """Version 1 characters had no conditions."""
+        v1 = thorin(max_hp=10, current_hp=0).to_dict()
+        del v1['conditions']
+        v1['schema'] = 1
+        char = Character.from_dict(v1)
+        assert char.conditions == [] and char.current_hp == 0
+        assert char.to_dict()['schema'] == 2
+
     def test_ability_check(self):
         pass
 
@@ -74,20 +133,22 @@ def test_get_players():
     pass
 
 
-def test_grant_xp():
-    pass
-
-
-def test_parse_xp():
-    pass
-
-
 def test_make_check():
     pass
 
 
-def test_set_value():
-    pass
+def test_set_value(run_in_harness):
+    async def run(harness, room):
+        for text in ['!setvalue Thorin current_hp 3', '!setvalue Thorin Str 18',
+                     '!setvalue Thorin bogus 3', '!changevalue Thorin bogus +1',
+                     '!changevalue Thorin current_hp +2']:
+            await harness.send(text, room=room)
+        stats = await harness.skill.picard.get_char(harness.opsdroid, room, 'Thorin')
+        return stats, [text for _, text in harness.sent]
+
+    stats, sent = run_in_harness(run, character('Thorin', max_hp=30))
+    assert stats['current_hp'] == 5 and stats['abilities']['Str'] == 18
+    assert sent == ["Thorin has no attribute 'bogus'"] * 2
 
 
 def test_get_value():
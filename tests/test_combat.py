@@ -1,10 +1,25 @@
 import pytest
 
+from benchmarks.harness import character
+from rpgchar.combat import attack, group_attack, group_members
+from rpgchar.dispatch import dispatcher
+
 
 def test_weapon_attack():
     pass
 
 
+@pytest.mark.parametrize('text, handler', [
+    ("Thorin attacks goblin1 with his axe", attack),
+    ("I attack goblin1 with my sword with advantage", attack),
+    ("the goblins attack Thorin with their scimitars", group_attack),
+    ("The goblins attack Thorin", group_attack),
+])
+def test_attack_routing(text, handler):
+    route, _ = dispatcher.match(text)
+    assert route.handler is handler
+
+
 def test_attack():
     pass
 
@@ -15,3 +30,42 @@ def test_castheal():
 
 def test_castdmg():
     pass
+
+
+@pytest.mark.parametrize('group, members', [
+    ('goblins', ['goblin1', 'Goblin2', 'goblin_3', 'goblins4']),
+    ('Goblin', ['goblin1', 'Goblin2', 'goblin_3']),
+    ('goblinkings', ['goblinking1']),
+    ('hobgoblins', ['hobgoblin1']),
+    ('boxes', ['box1']),
+    ('gob.lins', ['gob.lin1']),
+    ('ælfs', ['Ælf1']),
+    ('dragons', []),
+])
+def test_group_members(group, members):
+    chars = ['Thorin', 'goblin1', 'Goblin2', 'goblin_3', 'goblins4', 'goblin', 'goblinking1',
+             'hobgoblin1', 'box1', 'gob.lin1', 'gob+lin1', 'goblin1a', 'Ælf1']
+    assert group_members(chars, group) == members
+
+
+def test_group_attack(run_in_harness):
+    async def run(harness, room):
+        await harness.send('the goblins attack Thorin with their swords', room=room)
+        return harness.sent
+
+    sent = run_in_harness(run, character('Thorin'),
+                          *[character(f'goblin{i}') for i in range(1, 4)])
+    assert len(sent) == 1
+    assert sent[0][1].startswith('3 goblins attack Thorin with their sword:')
+
+
+def test_group_attack_damage_type(run_in_harness):
+    axe = {'axe': {'modifier': 'Str', 'damage': '1d12 slashing'}}
+
+    async def run(harness, room):
+        await harness.send('the orcs attack Thorin', room=room)
+        return harness.sent
+
+    sent = run_in_harness(run, character('Thorin'),
+                          *[character(f'orc{i}', weapons=axe) for i in (1, 2)])
+    assert sent[0][1].startswith('2 orcs attack Thorin with their axe:')
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from rpgchar.dice import DiceError, compile_dice, roll
+
+
+class FixedRNG:
+    """Deals out the given dice in order, whatever is asked for."""
+    def __init__(self, *dice):
+        self.dice = list(dice)
+
+    def choices(self, population, k=1):
+        dealt, self.dice = self.dice[:k], self.dice[k:]
+        assert all(die in population for die in dealt)
+        return dealt
+
+
+class TestDiceExpression:
+    def test_roll(self):
+        result = compile_dice('2d6+1d4-1d4+3').roll(rng=FixedRNG(6, 5, 4, 1))
+        assert result.rolls == [[6, 5], [4], [1]]
+        assert result.dice == [6, 5, 4, 1]
+        assert result.modifier == 3
+        assert result.total == 6 + 5 + 4 - 1 + 3
+
+    def test_roll_critical(self):
+        result = compile_dice('2d6+2').roll(critical=True, rng=FixedRNG(1, 2, 3, 4))
+        assert result.dice == [1, 2, 3, 4]
+        assert result.total == 12
+
+    def test_roll_keep(self):
+        result = compile_dice('4d6kh3').roll(rng=FixedRNG(1, 6, 3, 5))
+        assert result.rolls == [[6, 5, 3]]
+        assert result.dropped == [[1]]
+        assert result.total == 14
+
+    def test_roll_advantage(self):
+        assert compile_dice('1d20+2 adv').roll(rng=FixedRNG(4, 17)).total == 19
+        assert compile_dice('1d20+2 dis').roll(rng=FixedRNG(4, 17)).total == 6
+
+    def test_roll_many(self):
+        results = compile_dice('1d6+1').roll_many(3, rng=FixedRNG(1, 2, 3))
+        assert [result.total for result in results] == [2, 3, 4]
+
+    def test_totals(self):
+        totals = compile_dice('3d8').totals(100, rng=random.Random(1))
+        assert totals == compile_dice('3d8').totals(100, rng=random.Random(1))
+        assert all(3 <= total <= 24 for total in totals)
+
+
+@pytest.mark.parametrize('text, terms, modifier', [
+    ('2d6+1d4+3', ((1, 2, 6, None), (1, 1, 4, None)), 3),
+    ('d20 - 1', ((1, 1, 20, None),), -1),
+    ('4d6kh3', ((1, 4, 6, ('h', 3)),), 0),
+    ('1d20 adv', ((1, 2, 20, ('h', 1)),), 0),
+    ('1d20 disadvantage', ((1, 2, 20, ('l', 1)),), 0),
+    # Words after the expression, e.g. the type of damage, are ignored
+    ('1d12 slashing', ((1, 1, 12, None),), 0),
+    ('1d8 + 2 fire', ((1, 1, 8, None),), 2),
+    ('5', (), 5),
+])
+def test_compile_dice(text, terms, modifier):
+    expression = compile_dice(text)
+    assert expression.terms == terms
+    assert expression.modifier == modifier
+
+
+@pytest.mark.parametrize('text', ['', 'slashing', '2d6*2', '2d', '1d6++1', '1d0', '1d6+2d00'])
+def test_compile_dice_errors(text):
+    with pytest.raises(DiceError):
+        compile_dice(text)
+
+
+def test_compile_dice_cached():
+    assert compile_dice('2d6+1') is compile_dice('2d6+1')
+
+
+def test_roll():
+    assert roll('1d6+1', rng=FixedRNG(6)).total == 7
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import FakeMessage
+from rpgchar.dispatch import Dispatcher
+
+
+async def handler(opsdroid, config, message):
+    await message.respond(f"{message.regex.group('name')} rolled")
+
+
+async def fails(opsdroid, config, message):
+    raise RuntimeError
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.add('!init add (?P<name>\\w+)', handler)
+    dispatcher.add('(?P<name>\\w+) rolls?', handler, keywords=['roll', 'rolls'])
+    dispatcher.add('(?P<name>\\w+) rolls? initiative', handler, case_sensitive=False,
+                   keywords=['initiative'])
+    dispatcher.add('!fail(?P<name>)', fails)
+    return dispatcher
+
+
+def send(dispatcher, text):
+    sent = []
+    asyncio.run(dispatcher.dispatch(None, {}, FakeMessage(text, 'gm', 'room', sent)))
+    return sent
+
+
+class TestDispatcher:
+    def test_add(self, dispatcher):
+        route = dispatcher.routes[0]
+        assert route.keywords == {'!init'}
+        # Without a leading command or keywords, a pattern is tried for every message
+        unindexed = dispatcher.add('hello', handler)
+        assert unindexed.keywords == frozenset()
+        assert dispatcher.candidates('anything') == [unindexed]
+
+    def test_candidates(self, dispatcher):
+        add, roll, initiative, _ = dispatcher.routes
+        assert dispatcher.candidates('!init add Thorin') == [add]
+        assert set(dispatcher.candidates('Thorin ROLLS Initiative')) == {roll, initiative}
+        assert dispatcher.candidates('init add Thorin') == []
+
+    def test_match(self, dispatcher):
+        add, roll, initiative, _ = dispatcher.routes
+        route, match = dispatcher.match('Thorin rolls initiative')
+        # The longest matching pattern wins
+        assert route is initiative and match.group('name') == 'Thorin'
+        assert dispatcher.match('Thorin rolls')[0] is roll
+        # Case sensitivity is per route
+        assert dispatcher.match('THORIN ROLLS INITIATIVE')[0] is initiative
+        assert dispatcher.match('the goblins attack') is None
+
+    def test_dispatch(self, dispatcher):
+        assert send(dispatcher, 'Thorin rolls initiative') == [('room', 'Thorin rolled')]
+        assert send(dispatcher, 'nothing to see here') == []
+        assert dispatcher.messages == 2 and dispatcher.unmatched == 1
+
+    def test_dispatch_error(self, dispatcher):
+        assert send(dispatcher, '!fail') == [('room', 'Whoops there has been an error')]
+
+    def test_stats(self, dispatcher):
+        send(dispatcher, 'Thorin rolls')
+        send(dispatcher, 'Balin rolls')
+        send(dispatcher, '!init add Dwalin')
+        stats = dispatcher.stats()
+        assert stats['messages'] == 3
+        assert list(stats['routes'].items())[:2] == [('(?P<name>\\w+) rolls?', 2),
+                                                     ('!init add (?P<name>\\w+)', 1)]
@@ -1,5 +1,10 @@
+import json
+
 import pytest
 
+from benchmarks.harness import character
+from rpgchar.metrics import metrics
+
 
 def test_long_rest():
     pass
@@ -11,3 +16,51 @@ def test_to_room():
 
 def test_user_help():
     pass
+
+
+def test_report_stats(run_in_harness):
+    async def run(harness, room):
+        metrics.reset()
+        await harness.send('how is Thorin', room=room)
+        await harness.send('how is Thorin', room=room)
+        harness.reset()
+        for text in ['!stats', '!stats json', '!stats prometheus']:
+            await harness.send(text, room=room)
+        await harness.send('!stats', user='Thorin', room=room)
+        return [text for _, text in harness.sent]
+
+    summary, dump, prometheus, *refused = run_in_harness(run, character('Thorin'))
+    assert summary.startswith('Commands (by total time):\n  howami: 2 calls, ')
+    assert '\nResponses sent: 2 (' in summary
+
+    dump = json.loads(dump)
+    assert {'handler': 'howami', 'room': '#campaign0:bench', 'value': 2} in (
+        dump['counters']['rpgchar_commands_total'])
+    assert [h['count'] for h in dump['histograms']['rpgchar_handler_seconds']
+            if h['handler'] == 'howami'] == [2]
+
+    assert 'rpgchar_commands_total{handler="howami",room="#campaign0:bench"} 2' in (
+        prometheus.splitlines())
+    assert 'rpgchar_handler_seconds_count{handler="howami"} 2' in prometheus.splitlines()
+    # Only the GM can see the stats
+    assert not any(text.startswith('Commands') for text in refused)
+
+
+def test_seed_dice(run_in_harness):
+    async def run(harness, room):
+        replies = []
+        for _ in range(2):
+            harness.reset()
+            await harness.send('!seed 42', room=room)
+            await harness.send('roll initiative', room=room)
+            await harness.send('!seed', room=room)
+            replies.append([text for _, text in harness.sent])
+        return replies
+
+    first, second = run_in_harness(run, *[character(name) for name in ('Thorin', 'Balin')])
+    # The same seed gives the same fight
+    assert first[:2] == second[:2]
+    assert first[0] == 'Dice in #campaign0:bench reseeded with 42'
+    assert first[2].startswith('Dice in #campaign0:bench are seeded with 42, and have rolled '
+                               '2d20 since.\nSeeds used:\n')
+    assert second[2].count('(set by gm)') == 2
@@ -1,5 +1,80 @@
 import pytest
 
+from benchmarks.harness import character
+from rpgchar.initiative import (TurnOrder, load_turn_order, save_turn_order,
+                                remove_many_from_initiative)
+
+
+def turn_order(active=None):
+    order = TurnOrder([('Thorin', 15, 0), ('Balin', 10, 1), ('Dwalin', 10, 3), ('Ori', 5, 0)])
+    if active:
+        order.cursor = order.index(active)
+    return order
+
+
+def names(order):
+    return [name for name, _ in order.rotation()]
+
+
+class TestTurnOrder:
+    def test_order(self):
+        # Ties are broken by Dex
+        assert names(turn_order()) == ['Thorin', 'Dwalin', 'Balin', 'Ori']
+        assert turn_order().active == 'Thorin'
+        assert TurnOrder().active is None
+
+    def test_from_memory(self):
+        order = turn_order('Balin')
+        restored = TurnOrder.from_memory(order.to_memory())
+        assert names(restored) == names(order) and restored.active == 'Balin'
+        # Rooms from before the order was stored with its cursor
+        legacy = TurnOrder.from_memory({'Thorin': 15, 'Ori': 5, 'Balin': 10}, 'Balin')
+        assert names(legacy) == ['Balin', 'Ori', 'Thorin']
+        assert not TurnOrder.from_memory({})
+
+    def test_advance(self):
+        order = turn_order('Balin')
+        assert order.advance() == 'Ori'
+        assert order.advance() == 'Thorin'
+        assert TurnOrder().advance() is None
+
+    def test_add(self):
+        order = turn_order('Dwalin')
+        order.add('Nori', 20)
+        order.add('Gloin', 1)
+        assert order.active == 'Dwalin'
+        assert names(order) == ['Dwalin', 'Balin', 'Ori', 'Gloin', 'Nori', 'Thorin']
+        assert order.initiative('Nori') == 20
+
+    def test_add_active(self):
+        # Moving whoever's turn it is doesn't skip or repeat anyone's turn
+        order = turn_order('Dwalin')
+        order.add('Dwalin', 1, 3)
+        assert order.active == 'Dwalin'
+        assert names(order) == ['Dwalin', 'Thorin', 'Balin', 'Ori']
+        order.add('Dwalin', 20, 3)
+        assert names(order) == ['Dwalin', 'Thorin', 'Balin', 'Ori']
+
+    def test_add_first(self):
+        order = TurnOrder()
+        order.add('Thorin', 15)
+        assert order.active == 'Thorin'
+
+    def test_remove(self):
+        order = turn_order('Balin')
+        order.remove('Thorin')
+        assert order.active == 'Balin'
+        order.remove('Balin')
+        assert order.active == 'Ori'
+        order.remove('Ori')
+        assert order.active == 'Dwalin'
+        order.remove('Dwalin')
+        assert order.active is None and len(order) == 0
+
+    def test_rotation(self):
+        order = turn_order('Ori')
+        assert order.rotation() == [('Ori', 5), ('Thorin', 15), ('Dwalin', 10), ('Balin', 10)]
+
 
 def test_create_initiative():
     pass
@@ -21,12 +96,32 @@ def test_next_player():
     pass
 
 
-def test_add_character():
-    pass
+def test_add_character(run_in_harness):
+    async def run(harness, room):
+        await harness.send('!init add Thorin 15', room=room)
+        await harness.send('!init add Balin 10', room=room)
+        await harness.send('!init add Thorin 5', room=room)
+        order = await load_turn_order(harness.opsdroid, room)
+        return names(order), await harness.active_player(room)
 
+    assert run_in_harness(run, character('Thorin'), character('Balin')) == (
+        ['Thorin', 'Balin'], 'Thorin')
 
-def test_add_event():
-    pass
+
+def test_add_event(run_in_harness):
+    async def run(harness, room):
+        # An event in an empty order is the first thing to happen
+        await harness.send('!init event 20 collapse The ceiling falls in', room=room)
+        first = await harness.active_player(room)
+        await harness.send('!init add Thorin 15', room=room)
+        await harness.send('next player', room=room)
+        order = await load_turn_order(harness.opsdroid, room)
+        return first, names(order), await harness.active_player(room), harness.sent
+
+    first, order, active, sent = run_in_harness(run, character('Thorin'))
+    assert first == 'collapse'
+    assert order == ['Thorin', 'collapse'] and active == 'Thorin'
+    assert sent == [('#campaign0:bench', 'Next up: Thorin')]
 
 
 def test_remove_item():
@@ -35,3 +130,18 @@ def test_remove_item():
 
 def test_remove_from_initiative():
     pass
+
+
+def test_remove_many_from_initiative(run_in_harness):
+    async def run(harness, room):
+        opsdroid = harness.opsdroid
+        await save_turn_order(opsdroid, room, turn_order('Dwalin'))
+        await harness.skill.picard.save_active_player(opsdroid, room, 'Dwalin')
+        # Dwalin, whose turn it is, and Thorin before them; Gandalf isn't in the order
+        await remove_many_from_initiative(['Thorin', 'Dwalin', 'Gandalf'], opsdroid, room)
+        order = await load_turn_order(opsdroid, room)
+        return order, await harness.active_player(room)
+
+    order, active = run_in_harness(run)
+    assert names(order) == ['Balin', 'Ori']
+    assert order.cursor == 0 and active == 'Balin'
@@ -0,0 +1,140 @@
+import asyncio
+
+from benchmarks.harness import character
+from rpgchar.journal import Journal
+
+
+class DictMemory:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def put(self, key, value):
+        self.data[key] = value
+
+
+class SlowMemory(DictMemory):
+    """A memory whose reads give other tasks a chance to run."""
+    async def get(self, key):
+        await asyncio.sleep(0)
+        return self.data.get(key)
+
+
+def ops(entries):
+    return [(entry['op'], entry['seq']) for entry in entries]
+
+
+class TestJournal:
+    def test_append(self):
+        async def run():
+            journal, memory = Journal(size=8), DictMemory()
+            seqs = [await journal.append(memory, 'room', 'damage', name='Thorin', hp=n)
+                    for n in range(3)]
+            return journal, memory, seqs
+
+        journal, memory, seqs = asyncio.run(run())
+        assert seqs == [1, 2, 3]
+        assert journal.seq('room') == 3 and journal.pending('room') == 3
+        assert memory.data['journal/2']['hp'] == 1
+
+    def test_recover(self):
+        async def run():
+            memory = DictMemory()
+            journal = Journal(size=8)
+            for op in ('a', 'b', 'c'):
+                await journal.append(memory, 'room', op)
+            await journal.snapshot(memory, 'room', seq=1)
+            # A restart: a new journal reading the same memory
+            restarted = Journal(size=8)
+            return await restarted.recover(memory, 'room'), restarted
+
+        entries, restarted = asyncio.run(run())
+        assert ops(entries) == [('b', 2), ('c', 3)]
+        assert restarted.seq('room') == 3 and restarted.pending('room') == 2
+
+    def test_recover_empty(self):
+        journal = Journal()
+        assert asyncio.run(journal.recover(DictMemory(), 'room')) == []
+        assert journal.seq('room') == 0
+
+    def test_recover_concurrently(self):
+        async def run():
+            memory, writer = SlowMemory(), Journal(size=8)
+            for op in ('a', 'b'):
+                await writer.append(memory, 'room', op)
+            journal = Journal(size=8)
+            return journal, await asyncio.gather(journal.recover(memory, 'room'),
+                                                 journal.recover(memory, 'room'))
+
+        journal, (first, second) = asyncio.run(run())
+        # Neither caller is left without the entries to replay
+        assert ops(first) == ops(second) == [('a', 1), ('b', 2)]
+        assert journal.seq('room') == 2
+
+    def test_snapshot(self):
+        async def run():
+            journal, memory = Journal(size=8), DictMemory()
+            await journal.append(memory, 'room', 'a')
+            await journal.snapshot(memory, 'room')
+            await journal.snapshot(memory, 'room', seq=0)
+            return journal, memory
+
+        journal, memory = asyncio.run(run())
+        assert memory.data['journal_head'] == {'snapshot': 1}
+        assert journal.pending('room') == 0
+
+    def test_ring_wraps(self):
+        async def run():
+            journal, memory = Journal(size=4), DictMemory()
+            for op in ('a', 'b', 'c'):
+                await journal.append(memory, 'room', op)
+            full = journal.full('room')
+            await journal.snapshot(memory, 'room')
+            for op in ('d', 'e', 'f'):
+                await journal.append(memory, 'room', op)
+            return full, await Journal(size=4).recover(memory, 'room')
+
+        full, entries = asyncio.run(run())
+        assert full
+        # Slots 0-2 were reused; the stale entry for 'c' in slot 3 ends the journal
+        assert ops(entries) == [('d', 4), ('e', 5), ('f', 6)]
+
+
+def test_roster_replay(run_in_harness):
+    """Changes journalled but never flushed are replayed when the room is next read."""
+    async def run(harness, room):
+        picard = harness.skill.picard
+        await picard.roster_cache.flush(harness.opsdroid, room)
+        await picard.put_many(harness.opsdroid, room, {
+            'Thorin': character('Thorin', max_hp=30, current_hp=10),
+            'Balin': character('Balin', max_hp=30, current_hp=20)}, reason='damage')
+        await picard.delete_chars(harness.opsdroid, room, ['Dwalin'])
+        # Lose the cache without flushing, as if opsdroid had stopped
+        picard.roster_cache.clear()
+        return await picard.get_many(harness.opsdroid, room)
+
+    chars = run_in_harness(run, *[character(name, max_hp=30)
+                                  for name in ('Thorin', 'Balin', 'Dwalin')])
+    assert sorted(chars) == ['Balin', 'Thorin']
+    assert chars['Thorin']['current_hp'] == 10 and chars['Balin']['current_hp'] == 20
+
+
+def test_roster_replay_concurrently(run_in_harness):
+    """Two handlers reading a room for the first time after a restart both see the replay."""
+    async def run(harness, room):
+        picard = harness.skill.picard
+        await picard.roster_cache.flush(harness.opsdroid, room)
+        await picard.put_char(harness.opsdroid, room, 'Thorin',
+                              character('Thorin', max_hp=30, current_hp=7), reason='damage')
+        picard.roster_cache.clear()
+        reads = await asyncio.gather(picard.get_char(harness.opsdroid, room, 'Thorin'),
+                                     picard.get_char(harness.opsdroid, room, 'Thorin'))
+        await picard.roster_cache.flush(harness.opsdroid, room)
+        picard.roster_cache.clear()
+        return reads, await picard.get_char(harness.opsdroid, room, 'Thorin')
+
+    reads, reread = run_in_harness(run, character('Thorin', max_hp=30), latency=0.001)
+    assert [stats['current_hp'] for stats in reads] == [7, 7]
+    assert reread['current_hp'] == 7
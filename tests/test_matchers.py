@@ -1,9 +1,97 @@
+
 import pytest
 
+from benchmarks.harness import GM, FakeMessage
+from rpgchar import picard
+from rpgchar.matchers import AuthContext, get_auth, match_gm, match_active_player
+
+CONFIG = {'game_master': GM}
+
+
+@match_gm
+async def gm_only(opsdroid, config, message):
+    await message.respond('done')
+
+
+@match_active_player
+async def on_turn(opsdroid, config, message):
+    await message.respond(f'done by {message.auth.active_player}')
+
+
+def send(run_in_harness, handler, *users):
+    """Send a message from each of `users` to `handler`, with Thorin as the active player."""
+    async def run(harness, room):
+        await picard.save_active_player(harness.opsdroid, room, 'Thorin')
+        sent = []
+        for user in users:
+            await handler(harness.opsdroid, CONFIG, FakeMessage('', user, room, sent))
+        return [text for _, text in sent]
+
+    return run_in_harness(run)
+
+
+def test_match_gm(run_in_harness):
+    assert send(run_in_harness, gm_only, GM, 'Thorin') == [
+        'done',
+        "I can't let you do that, Dave. That functionality is reserved for the Game Master"]
+
+
+def test_match_active_player(run_in_harness):
+    assert send(run_in_harness, on_turn, 'Thorin', 'Balin', GM) == [
+        'done by Thorin', 'You wait your damn turn, Balin!', 'done by Thorin']
+
+
+class TestAuthContext:
+    def test_is_gm(self):
+        assert AuthContext(GM, GM).is_gm
+        assert not AuthContext('Thorin', GM).is_gm
+
+    def test_active_player_unresolved(self):
+        with pytest.raises(AttributeError):
+            AuthContext('Thorin', GM).active_player
+
+    def test_resolve_active_player(self, run_in_harness):
+        async def run(harness, room):
+            opsdroid = harness.opsdroid
+            await picard.save_active_player(opsdroid, room, 'Thorin')
+            auth = AuthContext('Thorin', GM)
+            first = await auth.resolve_active_player(opsdroid, room)
+            # Looked up once per message
+            await picard.save_active_player(opsdroid, room, 'Balin')
+            again = await auth.resolve_active_player(opsdroid, room)
+            changed = await AuthContext('Balin', GM).resolve_active_player(opsdroid, room)
+
+            # Stored behind the cache's back, e.g. by another process
+            await picard.save_new_to_memory(opsdroid, room, 'active_player', {'name': 'Dwalin'})
+            cached = await AuthContext('Dwalin', GM).resolve_active_player(opsdroid, room)
+            picard.forget_active_player(room)
+            reread = await AuthContext('Dwalin', GM).resolve_active_player(opsdroid, room)
+            return first, again, changed, cached, reread
+
+        assert run_in_harness(run) == ('Thorin', 'Thorin', 'Balin', 'Balin', 'Dwalin')
+
+    def test_evicted_room_rereads_active_player(self, run_in_harness):
+        async def run(harness, room):
+            opsdroid = harness.opsdroid
+            max_rooms = picard.roster_cache.max_rooms
+            picard.roster_cache.configure(max_rooms=1)
+            try:
+                await harness.add_characters(room, [])
+                await picard.save_active_player(opsdroid, room, 'Thorin')
+                await picard.save_new_to_memory(opsdroid, room, 'active_player', {'name': 'Balin'})
+                # Reading another room pushes this one out of the roster cache
+                await picard.get_many(opsdroid, harness.room(1))
+                return await AuthContext('Balin', GM).resolve_active_player(opsdroid, room)
+            finally:
+                picard.roster_cache.configure(max_rooms=max_rooms)
 
-def test_match_gm():
-    pass
+        assert run_in_harness(run, nrooms=2) == 'Balin'
 
 
-def test_match_active_player():
-    pass
+def test_get_auth():
+    message = FakeMessage('', 'Thorin', 'room', [])
+    auth = get_auth(CONFIG, message)
+    assert (auth.user, auth.gm) == ('Thorin', GM)
+    # Every check on the same message shares one context
+    assert get_auth(CONFIG, message) is auth
+    assert get_auth(CONFIG, FakeMessage('', 'Thorin', 'room', [])) is not auth
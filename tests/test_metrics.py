@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from rpgchar.metrics import Histogram, Metrics, payload_size
+
+
+class TestHistogram:
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.))
+        for value in (0.05, 0.1, 0.5, 2.):
+            histogram.observe(value)
+        # Bucket bounds are inclusive, with an overflow bucket at the end
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4 and histogram.sum == pytest.approx(2.65)
+
+    def test_quantile(self):
+        histogram = Histogram(buckets=(0.1, 1.))
+        assert histogram.quantile(0.5) == 0.
+        for value in [0.01] * 98 + [0.5, 5.]:
+            histogram.observe(value)
+        assert histogram.quantile(0.5) == 0.1
+        assert histogram.quantile(0.99) == 1.
+        assert histogram.quantile(1.) == float('inf')
+
+
+class TestMetrics:
+    def test_inc(self):
+        metrics = Metrics()
+        metrics.inc('calls', op='get')
+        metrics.inc('calls', 3, op='get')
+        metrics.inc('calls', op='put')
+        # Labels are the same series whatever order they're given in
+        metrics.inc('bytes', 10, op='get', room='a')
+        metrics.inc('bytes', 5, room='a', op='get')
+        assert metrics.counters['calls'] == {(('op', 'get'),): 4, (('op', 'put'),): 1}
+        assert metrics.counters['bytes'] == {(('op', 'get'), ('room', 'a')): 15}
+
+    def test_timer(self):
+        metrics = Metrics()
+        with metrics.timer('seconds', handler='attack'):
+            pass
+        with pytest.raises(RuntimeError):
+            with metrics.timer('seconds', handler='attack'):
+                raise RuntimeError
+        histogram = metrics.histograms['seconds'][(('handler', 'attack'),)]
+        # Failures are timed too
+        assert histogram.count == 2 and 0 <= histogram.sum < 1
+
+    def test_to_json(self):
+        metrics = Metrics()
+        metrics.inc('calls', op='get')
+        metrics.observe('seconds', 0.002, handler='attack')
+        dump = json.loads(json.dumps(metrics.to_json()))
+        assert dump['counters'] == {'calls': [{'op': 'get', 'value': 1}]}
+        assert dump['histograms'] == {'seconds': [
+            {'handler': 'attack', 'count': 1, 'sum': 0.002, 'p50': 0.0025, 'p99': 0.0025}]}
+
+    def test_to_prometheus(self):
+        metrics = Metrics()
+        metrics.inc('calls', 2, op='get')
+        metrics.observe('seconds', 0.5)
+        lines = metrics.to_prometheus().splitlines()
+        assert lines[:2] == ['# TYPE calls counter', 'calls{op="get"} 2']
+        assert lines[2] == '# TYPE seconds histogram'
+        assert 'seconds_bucket{le="0.25"} 0' in lines
+        assert 'seconds_bucket{le="0.5"} 1' in lines
+        assert 'seconds_bucket{le="+Inf"} 1' in lines
+        assert lines[-2:] == ['seconds_sum 0.5', 'seconds_count 1']
+
+
+circular = []
+circular.append(circular)
+
+
+@pytest.mark.parametrize('data, size', [(None, 0), ('abc', 3), ({'a': 1}, 7), (circular, 0)])
+def test_payload_size(data, size):
+    assert payload_size(data) == size
@@ -0,0 +1,127 @@
+import pytest
+import yaml
+
+from benchmarks.harness import character
+from rpgchar.party import (update_party, restore_hp, grant_xp, take_damage, add_condition,
+                           remove_condition, target_names)
+from rpgchar.templates import campaign_path
+
+
+def test_update_party(run_in_harness):
+    async def run(harness, room):
+        harness.reset()
+        results = await update_party(harness.opsdroid, room, take_damage(5),
+                                     where=lambda stats: stats['name'] != 'Balin')
+        chars = await harness.skill.picard.get_many(harness.opsdroid, room)
+        return results, chars, dict(harness.opsdroid.database.calls)
+
+    results, chars, calls = run_in_harness(
+        run, *[character(name, max_hp=30) for name in ('Thorin', 'Balin', 'Dwalin')])
+    assert results == {'Thorin': 25, 'Dwalin': 25}
+    assert chars['Balin']['max_hp'] == 30 and 'current_hp' not in chars['Balin']
+    # The roster is cached, so the only write is the single journal entry
+    assert calls == {'get': 0, 'put': 1}
+
+
+def test_restore_hp():
+    stats = character('Thorin', max_hp=30, current_hp=3, unconscious=True,
+                      death_saves={'success': 1, 'fail': 2})
+    restore_hp(stats)
+    assert stats['current_hp'] == 30
+    assert not stats['unconscious']
+    assert stats['death_saves'] == {'success': 0, 'fail': 0}
+
+
+def test_grant_xp():
+    stats = character('Thorin', level=1, XP=0)
+    assert grant_xp(100)(stats) is None
+    assert stats['level'] == 1
+    # Enough for level 3 in one go
+    assert grant_xp(900)(stats) == 3
+    assert stats == dict(stats, level=3, XP=1000)
+
+
+def test_take_damage():
+    stats = character('Thorin', max_hp=30)
+    assert take_damage(5)(stats) == 25
+    assert take_damage(25)(stats) == 0
+    assert take_damage(3)(stats) == -3
+
+
+def test_add_condition():
+    stats = character('Thorin')
+    assert add_condition('prone')(stats)
+    assert not add_condition('prone')(stats)
+    assert stats['conditions'] == ['prone']
+
+
+def test_remove_condition():
+    stats = character('Thorin', conditions=['prone', 'poisoned'])
+    assert remove_condition('prone')(stats)
+    assert not remove_condition('prone')(stats)
+    assert stats['conditions'] == ['poisoned']
+    assert not remove_condition('prone')(character('Balin'))
+
+
+@pytest.mark.parametrize('targets, names', [
+    ('everyone', None),
+    ('The Party', None),
+    ('Thorin', ['Thorin']),
+    ('Thorin, Balin and Dwalin', ['Thorin', 'Balin', 'Dwalin']),
+])
+def test_target_names(targets, names):
+    assert target_names(targets) == names
+
+
+def test_parse_xp(run_in_harness):
+    async def run(harness, room):
+        await harness.send('everyone gains 1000 XP', room=room)
+        await harness.send('Thorin and Gandalf gain 10 XP', room=room)
+        return [text for _, text in harness.sent]
+
+    sent = run_in_harness(run, character('Thorin', level=1), character('Balin', level=5))
+    assert sent == ["Everyone gains 1000 XP.\nThorin, you have reached level 3! Hooray!",
+                    "Thorin gains 10 XP.\nThere's no Gandalf here."]
+
+
+def test_area_damage(run_in_harness):
+    async def run(harness, room):
+        await harness.send('!setvalue Thorin current_hp 0', room=room)
+        await harness.send('!damage Thorin and Balin 3', room=room)
+        return (await harness.skill.picard.get_many(harness.opsdroid, room),
+                [text for _, text in harness.sent])
+
+    chars, sent = run_in_harness(run, character('Thorin', max_hp=30),
+                                character('Balin', max_hp=30))
+    assert sent == ["Thorin and Balin take 3 damage!\nThorin died!"]
+    assert list(chars) == ['Balin']
+    assert chars['Balin']['current_hp'] == 27
+
+
+def test_set_condition(run_in_harness):
+    async def run(harness, room):
+        await harness.send('!condition Thorin +prone', room=room)
+        await harness.send('!condition everyone +prone', room=room)
+        await harness.send('!condition everyone -prone', room=room)
+        return [text for _, text in harness.sent]
+
+    sent = run_in_harness(run, character('Thorin'), character('Balin'))
+    assert sent == ["Thorin is now prone.", "Balin is now prone.",
+                    "Everyone is no longer prone."]
+
+
+def test_parse_xp_from_config(run_in_harness):
+    """Characters defined in the campaign config are loaded the first time they're named."""
+    async def run(harness, room):
+        path = campaign_path(harness.opsdroid, 'characters', 'bilbo.yaml')
+        with open(path, 'w') as f:
+            yaml.safe_dump(character('Bilbo', level=1), f)
+        harness.config['campaigns']['campaign0']['characters']['Bilbo'] = 'bilbo.yaml'
+        await harness.send('Bilbo gains 300 XP', room=room)
+        stats = await harness.skill.picard.get_char(harness.opsdroid, room, 'Bilbo')
+        return stats, [text for _, text in harness.sent]
+
+    stats, sent = run_in_harness(run)
+    assert sent == ["Character Bilbo not in memory - loaded from config.",
+                    "Bilbo gains 300 XP.\nBilbo, you have reached level 2! Hooray!"]
+    assert stats['XP'] == 300 and stats['level'] == 2
@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import character
+from rpgchar import picard
+
+
+class FakeAPI:
+    """A Matrix API whose requests take a moment, counting how many are in flight."""
+    def __init__(self):
+        self.in_flight = self.max_in_flight = self.requests = 0
+
+    async def _request(self, result=None):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return result
+
+    async def _send(self, method, path):
+        return await self._request({'joined_rooms': []})
+
+    async def get_room_id(self, alias):
+        return await self._request('!' + alias[1:])
+
+    async def join_room(self, room_id):
+        return await self._request({})
+
+    async def invite_user(self, room_id, user):
+        return await self._request({})
+
+    async def get_power_levels(self, room_id):
+        return await self._request({'users': {}})
+
+    async def set_power_levels(self, room_id, power_levels):
+        return await self._request({})
+
+
+class FakeConnector:
+    name = 'ConnectorMatrix'
+
+    def __init__(self):
+        self.connection = FakeAPI()
+
+
+class FakeOpsdroid:
+    def __init__(self):
+        self.connectors = [FakeConnector()]
+
+
+def test_gather_bounded():
+    api = FakeAPI()
+    asyncio.run(picard.gather_bounded([api._request(n) for n in range(20)], 3))
+    assert api.requests == 20 and api.max_in_flight == 3
+
+
+def test_provision_rooms():
+    picard._room_ids.clear()
+    picard._joined_rooms.clear()
+    opsdroid = FakeOpsdroid()
+    config = {'users_as_admin': [f'@user{n}:test' for n in range(5)]}
+    rooms = [f'#room{n}:test' for n in range(10)]
+
+    room_ids = asyncio.run(picard.provision_rooms(opsdroid, config, rooms, concurrency=4))
+    api = opsdroid.connectors[0].connection
+    assert room_ids == [f'!room{n}:test' for n in range(10)]
+    # The bound covers every request, however they're nested
+    assert api.max_in_flight == 4
+
+
+class IndexedConnector:
+    """A connector counting how often the room index reads its rooms."""
+    def __init__(self, rooms):
+        self._rooms = rooms
+        self.room_ids = {}
+        self.reads = 0
+
+    @property
+    def rooms(self):
+        self.reads += 1
+        return self._rooms
+
+
+class TestRoomIndex:
+    def test_name_of(self):
+        connector = IndexedConnector({'main': '#main:test'})
+        opsdroid = type('FakeOpsdroid', (), {'default_connector': connector})
+        index = picard.RoomIndex()
+        assert index.name_of(opsdroid, '#main:test') == 'main'
+        assert index.name_of(opsdroid, '#main:test') == 'main'
+        assert connector.reads == 1
+
+    def test_name_of_miss(self):
+        connector = IndexedConnector({'main': '#main:test'})
+        opsdroid = type('FakeOpsdroid', (), {'default_connector': connector})
+        index = picard.RoomIndex()
+        for _ in range(3):
+            assert index.name_of(opsdroid, '!unknown:test') is None
+        # Only the first miss rebuilds the index
+        assert connector.reads == 1
+        # Until the room turns up
+        connector.room_ids['main'] = '!unknown:test'
+        index.build(connector)
+        assert index.name_of(opsdroid, '!unknown:test') == 'main'
+
+    def test_learn(self):
+        index = picard.RoomIndex()
+        index.add('main', '#main:test')
+        index.learn('#main:test', '!main:test')
+        index.learn('#other:test', '!other:test')
+        assert index.ids == {'main': '!main:test'}
+        assert index.names['!main:test'] == 'main'
+
+
+def test_evict_forgets_active_player(run_in_harness):
+    async def run(harness, room):
+        max_rooms = picard.roster_cache.max_rooms
+        picard.roster_cache.configure(max_rooms=2)
+        try:
+            for i in range(3):
+                room = harness.room(i)
+                await harness.add_characters(room, [character(f'Hero{i}')])
+                await picard.save_active_player(harness.opsdroid, room, f'Hero{i}')
+            await picard.roster_cache.evict(harness.opsdroid)
+            cached = dict(picard._active_players)
+            # Still stored, so it's read back when the room is next used
+            active = await picard.load_active_player(harness.opsdroid, harness.room(0))
+        finally:
+            picard.roster_cache.configure(max_rooms=max_rooms)
+        return cached, active
+
+    cached, active = run_in_harness(run, nrooms=3)
+    assert sorted(cached) == ['#campaign1:bench', '#campaign2:bench']
+    assert active == 'Hero0'
+
+
+def test_http_client_lifecycle():
+    async def run():
+        client = picard.HTTPClient(pool_size=2)
+        task = asyncio.ensure_future(client.run())
+        await asyncio.sleep(0)
+        session = client.session
+        assert not session.closed
+        # Fetching uses the session opened by `run`
+        assert client.session is session
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return session
+
+    session = asyncio.run(run())
+    assert session.closed
+
+
+def test_http_client_close():
+    async def run():
+        client = picard.HTTPClient()
+        task = asyncio.ensure_future(client.run())
+        await asyncio.sleep(0)
+        session = client.session
+        # Closing explicitly, as the skill's teardown does, also ends the task
+        await client.close()
+        await asyncio.wait_for(task, 1)
+        return session
+
+    assert asyncio.run(run()).closed
+
+
+def test_teardown(run_in_harness):
+    async def run(harness, room):
+        session = picard.http_client.session
+        await harness.skill.teardown(harness.opsdroid)
+        return session
+
+    assert run_in_harness(run).closed
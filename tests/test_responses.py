@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import FakeMessage
+from rpgchar.responses import BufferedMessage, buffer_responses
+
+
+def buffered(sent, **options):
+    return BufferedMessage(FakeMessage('hello', 'gm', 'room', sent), **options)
+
+
+class TestBufferedMessage:
+    def test_respond(self):
+        sent = []
+
+        async def run():
+            message = buffered(sent)
+            for text in ('one', 'two', 3):
+                await message.respond(text)
+            await message.respond('elsewhere', room='main')
+            # Nothing is sent until the responses are flushed
+            assert sent == []
+            await message.flush()
+
+        asyncio.run(run())
+        assert sent == [('room', 'one\ntwo\n3'), ('main', 'elsewhere')]
+
+    def test_max_size(self):
+        sent = []
+
+        async def run():
+            message = buffered(sent, max_size=10)
+            for text in ('one', 'two', 'three', 'four'):
+                await message.respond(text)
+            await message.flush()
+
+        asyncio.run(run())
+        assert sent == [('room', 'one\ntwo'), ('room', 'three\nfour')]
+
+    def test_deadline(self):
+        sent = []
+
+        async def run():
+            message = buffered(sent, deadline=0.01)
+            await message.respond('one')
+            await message.respond('two')
+            await asyncio.sleep(0.05)
+            sent.append('slept')
+            await message.flush()
+
+        asyncio.run(run())
+        # Held back no longer than the deadline, and not sent again by the final flush
+        assert sent == [('room', 'one\ntwo'), 'slept']
+
+    def test_getattr(self):
+        message = buffered([])
+        assert (message.text, message.user, message.room) == ('hello', 'gm', 'room')
+
+
+def test_buffer_responses():
+    sent = []
+
+    @buffer_responses
+    async def handler(opsdroid, config, message):
+        await message.respond('one')
+        await message.respond('two')
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(handler(None, {}, FakeMessage('hello', 'gm', 'room', sent)))
+    # Whatever was collected is sent when the handler finishes, even if it fails
+    assert sent == [('room', 'one\ntwo')]
@@ -0,0 +1,65 @@
+from rpgchar.rng import RoomRNG, RNGService
+
+
+class TestRoomRNG:
+    def test_roll(self):
+        rng = RoomRNG(1)
+        rolls = [rng.roll(6) for _ in range(100)]
+        assert set(rolls) == set(range(1, 7))
+        assert rng.draws == {6: 100}
+
+    def test_rolls(self):
+        # Rolls carry on across refills, taking whatever was left in the previous block first
+        rng = RoomRNG(1, block_size=4)
+        rolls = [rng.roll(6) for _ in range(3)] + rng.rolls(6, 6) + [rng.roll(6)]
+        assert rolls == RoomRNG(1, block_size=100).rolls(6, 10)
+        assert rng.draws == {6: 10}
+
+    def test_choices(self):
+        rng = RoomRNG(1)
+        # Dice go through the blocks, anything else straight to the generator
+        assert rng.choices(range(1, 21), k=3) == RoomRNG(1).rolls(20, 3)
+        assert rng.choices('abc', k=2)[0] in 'abc'
+        assert rng.draws == {20: 3}
+
+    def test_seed(self):
+        rng = RoomRNG(1)
+        first = rng.rolls(20, 10)
+        rng.seed(1)
+        assert rng.draws == {}
+        assert rng.rolls(20, 10) == first
+        rng.seed(2)
+        assert rng.current_seed == 2 and rng.rolls(20, 10) != first
+
+
+class TestRNGService:
+    def test_reproducible(self):
+        first, second = RNGService(seed=7), RNGService(seed=7)
+        assert first['room'].rolls(20, 10) == second['room'].rolls(20, 10)
+        assert first['room'].current_seed != first['other'].current_seed
+
+    def test_independent(self):
+        busy, quiet = RNGService(seed=7), RNGService(seed=7)
+        busy['other'].rolls(20, 50)
+        # Rolling in one room doesn't change what another room rolls
+        assert busy['room'].rolls(20, 10) == quiet['room'].rolls(20, 10)
+
+    def test_seed(self):
+        rngs = RNGService()
+        assert rngs.seed('room', 42) == 42
+        first = [rngs['room'].roll(20) for _ in range(20)]
+        rngs.seed('room', 42)
+        assert [rngs['room'].roll(20) for _ in range(20)] == first
+        # With a base seed, a fresh seed for a room is always the same one
+        assert RNGService(seed=7).seed('room') == RNGService(seed=7)['room'].current_seed
+
+    def test_history(self):
+        rngs = RNGService(seed=7, audit_size=3)
+        rngs['room']
+        rngs.seed('room', 42, reason='replay')
+        rngs['other']
+        assert [(entry['seed'], entry['reason']) for entry in rngs.history('room')] == [
+            (RNGService(seed=7)['room'].current_seed, 'new'), (42, 'replay')]
+        rngs.seed('other', 1)
+        # Only the last `audit_size` entries are kept
+        assert len(rngs.history('room')) == 1
@@ -1,5 +1,16 @@
+import os
+import asyncio
+import threading
+
 import pytest
 
+import yaml
+
+from benchmarks.harness import write_campaign
+from rpgchar.scenes import SceneGraph, SceneInfo, load_scene_info, scene_graph
+from rpgchar.picard import room_memory
+from rpgchar.templates import TemplateCache, campaign_path
+
 
 def test_load_scene():
     pass
@@ -7,3 +18,203 @@ def test_load_scene():
 
 def test_get_info():
     pass
+
+
+def test_check_scenes(run_in_harness):
+    async def run(harness, room):
+        await harness.send('!scenes', room=room)
+        os.remove(campaign_path(harness.opsdroid, 'scenes', 'bench', 'scene-2.yaml'))
+        await harness.send('!scenes bench', room=room)
+        await harness.send('!scenes bench', user='Thorin', room=room)
+        return [text for _, text in harness.sent]
+
+    sent = run_in_harness(run, nscenes=4)
+    assert sent[:2] == [
+        "Campaign bench: 4 scenes, 4 exits\nNo problems found",
+        "Campaign bench: 3 scenes, 3 exits\n"
+        "scene-1.yaml: exit 'next' leads to missing scene scene-2.yaml"]
+    assert sent[2].startswith("I can't let you do that")
+
+
+class TestSceneGraph:
+    @pytest.fixture
+    def campaign(self, tmp_path):
+        write_campaign(tmp_path, nscenes=3, monsters=1)
+        return str(tmp_path / 'scenes' / 'bench'), str(tmp_path / 'characters')
+
+    def graph(self, campaign):
+        return SceneGraph.build(*campaign, cache=TemplateCache())
+
+    def test_build(self, campaign):
+        graph = self.graph(campaign)
+        assert sorted(graph.nodes) == ['00-start.yaml', 'scene-1.yaml', 'scene-2.yaml']
+        node = graph.nodes['scene-1.yaml']
+        assert node.name == 'Scene 1'
+        assert node.exits == {'next': 'scene-2.yaml'}
+        assert node.characters == [f'{campaign[1]}/goblin.yaml']
+
+    def test_build_loadfile(self, campaign):
+        folder = campaign[0]
+        with open(f'{folder}/exits.yaml', 'w') as f:
+            yaml.safe_dump({'dm_info': {'exits': {'next': '00-start.yaml'}}}, f)
+        with open(f'{folder}/scene-2.yaml') as f:
+            scene = yaml.safe_load(f)
+        scene['dm_info'] = {'loadfile': 'exits.yaml', 'exits': {'next': 'nowhere.yaml'}}
+        with open(f'{folder}/scene-2.yaml', 'w') as f:
+            yaml.safe_dump(scene, f)
+
+        graph = self.graph(campaign)
+        # Files holding dm_info for other scenes aren't scenes, and their exits win
+        assert 'exits.yaml' not in graph.nodes
+        assert graph.resolve('scene-2.yaml', 'next') == '00-start.yaml'
+
+    def test_is_current(self, campaign):
+        graph = self.graph(campaign)
+        assert graph.is_current()
+        path = f'{campaign[0]}/scene-1.yaml'
+        with open(path) as f:
+            scene = yaml.safe_load(f)
+        scene['dm_info']['exits']['next'] = '00-start.yaml'
+        with open(path, 'w') as f:
+            yaml.safe_dump(scene, f)
+        assert not graph.is_current()
+        assert self.graph(campaign).resolve('scene-1.yaml', 'next') == '00-start.yaml'
+
+    def test_is_current_removed(self, campaign):
+        graph = self.graph(campaign)
+        os.remove(f'{campaign[0]}/scene-2.yaml')
+        assert not graph.is_current()
+
+    def test_validate(self, campaign):
+        os.remove(f'{campaign[0]}/scene-2.yaml')
+        assert self.graph(campaign).validate() == [
+            "scene-1.yaml: exit 'next' leads to missing scene scene-2.yaml"]
+
+    def test_resolve(self, campaign):
+        graph = self.graph(campaign)
+        assert graph.resolve('scene-2.yaml', 'next') == '00-start.yaml'
+        assert graph.resolve('scene-2.yaml', 'up') is None
+        assert graph.resolve('nowhere.yaml', 'next') is None
+
+    def test_warm(self, campaign, tmp_path):
+        cache = TemplateCache()
+        graph = SceneGraph.build(*campaign, cache=cache)
+        cache.invalidate()
+
+        async def run():
+            graph.warm('scene-1.yaml', cache=cache)
+            await asyncio.gather(*cache._pending.values())
+
+        asyncio.run(run())
+        cache.executor.shutdown()
+        # The scene beyond the exit and the characters in it, but not the scene itself
+        assert sorted(os.path.relpath(path, tmp_path) for path in cache.entries()) == [
+            'characters/goblin.yaml', 'scenes/bench/scene-2.yaml']
+
+
+def test_scene_graph_checks_off_the_loop(run_in_harness, monkeypatch):
+    """Checking a graph is up to date stats every scene, so it mustn't block the event loop."""
+    threads = []
+    for method in ('is_current', 'validate'):
+        def record(self, method=getattr(SceneGraph, method)):
+            threads.append(threading.current_thread().name)
+            return method(self)
+        monkeypatch.setattr(SceneGraph, method, record)
+
+    async def run(harness, room):
+        first = await scene_graph(harness.opsdroid, 'bench')
+        assert await scene_graph(harness.opsdroid, 'bench') is first
+        await harness.send('!goto 00-start.yaml', room=room)
+        await harness.send('!scenes bench', room=room)
+
+    run_in_harness(run)
+    # Built at startup, then checked at each lookup and by !scenes
+    assert len(threads) >= 4
+    assert all(name.startswith('rpgchar-templates') for name in threads)
+
+
+def test_set_info(run_in_harness):
+    async def run(harness, room):
+        await harness.send('!goto 00-start.yaml', room=room)
+        harness.reset()
+        for text in ["!setinfo campaign0 notes/mood no",
+                     "!setinfo campaign0 notes/odd it's: odd",
+                     "!setinfo campaign0 notes/mood/why because",
+                     "!setinfo campaign0 / everything",
+                     "!setinfo campaign9 x y"]:
+            await harness.send(text, room=room)
+        scene = await load_scene_info(harness.opsdroid, 'campaign0')
+        return scene.get('notes'), [text for _, text in harness.sent]
+
+    notes, sent = run_in_harness(run)
+    assert notes == {'lighting': 'dim', 'smell': 'damp', 'mood': 'no', 'odd': "it's: odd"}
+    assert sent == ["Updated notes/mood for campaign0", "Updated notes/odd for campaign0",
+                    "notes/mood isn't a section of the scene information",
+                    "'/' isn't a path in the scene information",
+                    "There's no scene information for campaign9"]
+
+
+class TestSceneInfo:
+    def scene(self):
+        return SceneInfo({'npcs': {'barkeep': 'Grumpy', 'guard': 'Asleep'}, 'lighting': 'dim'})
+
+    def test_get(self):
+        scene = self.scene()
+        assert scene.get('npcs/barkeep') == 'Grumpy'
+        assert scene.get('/lighting/') == 'dim'
+        assert scene.get()['lighting'] == 'dim'
+        assert 'npcs/guard' in scene and 'npcs/cook' not in scene
+        with pytest.raises(KeyError):
+            scene.get('npcs/cook')
+
+    def test_list(self):
+        scene = self.scene()
+        assert scene.list() == ['npcs', 'lighting']
+        assert scene.list('npcs') == ['barkeep', 'guard']
+        assert scene.list('lighting') == []
+
+    def test_set(self):
+        scene = self.scene()
+        scene.set('npcs/barkeep', {'mood': 'Grumpy'})
+        scene.set('exits/north/door', 'locked')
+        assert scene.get('npcs/barkeep/mood') == 'Grumpy'
+        assert scene.get('exits/north') == {'door': 'locked'}
+        assert scene.list() == ['npcs', 'lighting', 'exits']
+        assert scene.data['exits'] == {'north': {'door': 'locked'}}
+
+    @pytest.mark.parametrize('path', ['', '/', 'npcs//barkeep'])
+    def test_set_empty_path(self, path):
+        scene = self.scene()
+        with pytest.raises(ValueError):
+            scene.set(path, 'gone')
+        assert scene.get() == self.scene().data
+        assert scene.list() == ['npcs', 'lighting']
+
+    def test_set_under_value(self):
+        scene = self.scene()
+        with pytest.raises(KeyError):
+            scene.set('lighting/colour', 'red')
+        assert scene.get('lighting') == 'dim'
+
+
+def test_load_scene_info(run_in_harness):
+    async def run(harness, room):
+        memory = room_memory(harness.opsdroid)['main']
+        # Rooms' information used to be kept together under one key
+        await memory.put('scenes', {'campaign0': {'notes': {'mood': 'tense'}}})
+        harness.reset()
+        info = await load_scene_info(harness.opsdroid, 'campaign0')
+        calls = dict(harness.opsdroid.database.calls)
+        again = await load_scene_info(harness.opsdroid, 'campaign0')
+        missing = await load_scene_info(harness.opsdroid, 'campaign9')
+        after = dict(harness.opsdroid.database.calls)
+        return info, await memory.get('scenes/campaign0'), calls, again, missing, after
+
+    info, migrated, calls, again, missing, after = run_in_harness(run)
+    assert info.get('notes/mood') == 'tense'
+    assert migrated == {'notes': {'mood': 'tense'}}
+    # The room's own key, then the old one; then it's copied to the room's own key
+    assert calls == {'get': 2, 'put': 1}
+    # Cached once loaded
+    assert again is info
+    assert missing is None and after == {'get': 4, 'put': 1}
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import threading
+
+import pytest
+import yaml
+
+from rpgchar.templates import TemplateCache, compile_templates, load_compiled_templates
+
+
+@pytest.fixture
+def cache():
+    cache = TemplateCache(workers=2)
+    yield cache
+    cache.executor.shutdown()
+
+
+@pytest.fixture
+def goblin(tmp_path):
+    path = tmp_path / 'characters' / 'goblin.yaml'
+    path.parent.mkdir()
+    path.write_text(yaml.safe_dump({'name': 'goblin', 'max_hp': 7}))
+    return str(path)
+
+
+def touch(path, data):
+    """Rewrite `path`, making sure its modification time changes."""
+    stat = os.stat(path)
+    with open(path, 'w') as f:
+        yaml.safe_dump(data, f)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+class TestTemplateCache:
+    def test_get(self, cache, goblin):
+        assert cache.get(goblin) == {'name': 'goblin', 'max_hp': 7}
+        # A cache hit doesn't read the file again
+        assert cache.get(goblin) is cache.get(goblin)
+        assert cache.parses == 1
+        touch(goblin, {'name': 'goblin', 'max_hp': 9})
+        assert cache.get(goblin)['max_hp'] == 9
+        assert cache.parses == 2
+
+    def test_load(self, cache, goblin):
+        cache.load(goblin)['max_hp'] = 100
+        assert cache.get(goblin)['max_hp'] == 7
+
+    def test_get_async(self, cache, goblin):
+        threads = []
+        parse = cache._parse
+
+        def record(path):
+            threads.append(threading.current_thread().name)
+            return parse(path)
+
+        cache._parse = record
+
+        async def run():
+            # Concurrent requests for the same file share one read
+            return await asyncio.gather(*[cache.get_async(goblin) for _ in range(3)])
+
+        results = asyncio.run(run())
+        assert results[0] == {'name': 'goblin', 'max_hp': 7}
+        assert all(result is results[0] for result in results)
+        assert len(threads) == 1 and threads[0].startswith('rpgchar-templates')
+        touch(goblin, {'name': 'goblin', 'max_hp': 9})
+        assert asyncio.run(cache.get_async(goblin))['max_hp'] == 9
+        assert len(threads) == 2
+
+    def test_load_async(self, cache, goblin):
+        async def run():
+            first = await cache.load_async(goblin)
+            first['max_hp'] = 100
+            return await cache.load_async(goblin)
+
+        assert asyncio.run(run())['max_hp'] == 7
+        assert cache.parses == 1
+
+    def test_prefetch(self, cache, goblin, tmp_path):
+        async def run():
+            cache.prefetch([goblin, str(tmp_path / 'missing.yaml')])
+            # A missing file is only logged
+            await asyncio.gather(*cache._pending.values(), return_exceptions=True)
+
+        asyncio.run(run())
+        assert cache.parses == 1
+        assert cache.get(goblin)['max_hp'] == 7 and cache.parses == 1
+
+
+def test_compiled_templates(cache, goblin, tmp_path):
+    compiled = str(tmp_path / 'compiled.pickle')
+    directory = os.path.dirname(goblin)
+    assert compile_templates([directory], compiled, cache=cache) == 1
+
+    # A fresh cache (as after a restart) loads the pickle instead of parsing the YAML
+    loaded = TemplateCache()
+    assert load_compiled_templates(compiled, cache=loaded) == 0
+    assert asyncio.run(loaded.get_async(goblin)) == {'name': 'goblin', 'max_hp': 7}
+    assert loaded.parses == 0
+    loaded.executor.shutdown()
+
+    touch(goblin, {'name': 'goblin', 'max_hp': 9})
+    stale = TemplateCache()
+    assert load_compiled_templates(compiled, cache=stale) == 1
+    assert stale.get(goblin)['max_hp'] == 9
+
+    with open(compiled, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\0')
+    assert load_compiled_templates(compiled, cache=TemplateCache()) is None
+    assert load_compiled_templates(str(tmp_path / 'missing'), cache=TemplateCache()) is None
@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+from rpgchar.util import RoomHandle
+
+
+class DictMemory:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def put(self, key, value):
+        self.data[key] = value
+
+
+def handle(room, *databases):
+    opsdroid = SimpleNamespace(memory=SimpleNamespace(databases=list(databases)))
+    return RoomHandle(opsdroid, room)
+
+
+class TestRoomHandle:
+    def test_namespaced(self):
+        memory = DictMemory()
+        asyncio.run(handle('!a', memory).put('chars', {'Thorin': {}}))
+        assert memory.data == {'!a/chars': {'Thorin': {}}}
+        assert asyncio.run(handle('!b', memory).get('chars')) is None
+
+    def test_legacy_key_migrated(self):
+        memory = DictMemory({'chars': {'Thorin': {}}})
+        assert asyncio.run(handle('!a', memory).get('chars')) == {'Thorin': {}}
+        assert memory.data['!a/chars'] == {'Thorin': {}}
+        # Other rooms were sharing the old value, so it stays for them
+        assert asyncio.run(handle('!b', memory).get('chars')) == {'Thorin': {}}
+        assert memory.data['chars'] == {'Thorin': {}}
+
+    def test_legacy_key_not_preferred(self):
+        memory = DictMemory({'chars': {'Thorin': {}}, '!a/chars': {'Balin': {}}})
+        assert asyncio.run(handle('!a', memory).get('chars')) == {'Balin': {}}
+
+    def test_only_legacy_keys_fall_back(self):
+        memory = DictMemory({'journal/1': {'op': 'damage'}})
+        assert asyncio.run(handle('!a', memory).get('journal/1')) is None
+        assert '!a/journal/1' not in memory.data
@@ -1,21 +1,93 @@
-from contextlib import contextmanager
+import time
+from copy import copy
 
-__all__ = ['RoomMemory']
+from .metrics import metrics, payload_size
+
+__all__ = ['RoomMemory', 'RoomHandle']
+
+# Keys written before rooms were namespaced, when databases without a ``room`` attribute
+# stored them unprefixed and so shared by every room
+LEGACY_KEYS = frozenset({'chars', 'initiatives', 'active_player', 'events', 'scenes',
+                         'prev_scenes'})
+
+
+class RoomHandle:
+    """
+    Access to opsdroid memory for a single room.
+
+    Databases which store data per room (i.e. have a ``room`` attribute) are given their own
+    shallow copy pointing at this room; any others have their keys namespaced by the room.
+    Values those databases still hold under an unprefixed `LEGACY_KEYS` key are read as a
+    fallback and copied to the room's key on first use.
+    No shared state is modified, so handles for different rooms can be used concurrently.
+    """
+    def __init__(self, opsdroid, room):
+        self.room = room
+        self._databases = [self._scope(database) for database in opsdroid.memory.databases]
+        self._local = {}
+
+    def _scope(self, database):
+        if hasattr(database, 'room'):
+            database = copy(database)
+            database.room = self.room
+            return database, ''
+        return database, f'{self.room}/'
+
+    async def get(self, key):
+        """Return the first value any database has stored for `key` in this room."""
+        start = time.perf_counter()
+        data = await self._get(key)
+        _record('get', key, data, start)
+        return data
+
+    async def _get(self, key):
+        if not self._databases:
+            return self._local.get(key)
+        for database, prefix in self._databases:
+            data = await database.get(prefix + key)
+            if data is None and prefix and key in LEGACY_KEYS:
+                data = await self._migrate(database, prefix, key)
+            if data is not None:
+                return data
+        return None
+
+    async def _migrate(self, database, prefix, key):
+        # The unprefixed value is left in place, as every other room was reading it too
+        data = await database.get(key)
+        if data is not None:
+            await database.put(prefix + key, data)
+        return data
+
+    async def put(self, key, data):
+        """Store `data` under `key` in this room in every database."""
+        start = time.perf_counter()
+        if not self._databases:
+            self._local[key] = data
+        for database, prefix in self._databases:
+            await database.put(prefix + key, data)
+        _record('put', key, data, start)
+
+
+def _record(op, key, data, start):
+    # Per-character and journal keys are counted together, e.g. everything under 'char/'
+    kind = key.split('/', 1)[0]
+    metrics.observe('rpgchar_memory_seconds', time.perf_counter() - start, op=op)
+    metrics.inc('rpgchar_memory_calls_total', op=op, key=kind)
+    metrics.inc('rpgchar_memory_bytes_total', payload_size(data), op=op, key=kind)
 
 
 class RoomMemory:
     """
     A way of accessing opsdroid memory based on rooms.
+
+    Indexing with a room name or id returns the `RoomHandle` for that room.
     """
     def __init__(self, opsdroid):
         self.opsdroid = opsdroid
+        self._handles = {}
 
-    @contextmanager
-    def memory_in_room(self, room):
-        ori_room = self.opsdroid.memory.databases[0].room
-        self.opsdroid.memory.databases[0].room = room
-        yield
-        self.opsdroid.memory.databases[0].room = ori_room
-
-    def __getitem__(self, item):
-        return self.memory_in_room(item)
+    def __getitem__(self, room):
+        handle = self._handles.get(room)
+        if handle is None:
+            handle = self._handles[room] = RoomHandle(self.opsdroid, room)
+        return handle